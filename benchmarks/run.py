@@ -0,0 +1,308 @@
+"""
+Benchmarks of the neurofeedback and music generation hot paths.
+
+Each benchmark reports throughput and p50/p95/p99 latency per call. Results can be saved as a
+JSON baseline and later runs compared against it, the comparison fails (exit code 1) when a
+benchmark's p50 latency regresses by more than the threshold.
+
+Usage (from the repository root):
+    python -m benchmarks.run --save benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json --threshold 1.3
+    python -m benchmarks.run --filter band_powers
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from pathlib import Path
+import numpy as np
+
+from emotion_detection import utils
+from emotion_detection.pipeline import NeuroPipeline
+from emotion_detection.sources import ReplayInlet
+from music_gen.generator import MetaGenerator
+
+FS = 256
+RECORDING = Path(__file__).parent.parent / "emotion_detection/eeg_recording/recording_2024-11-05-14.33.15.csv"
+
+# name -> (setup returning the callable to time, number of timed calls)
+BENCHMARKS = {}
+
+
+def benchmark(name, iterations=2000):
+    def register(setup):
+        BENCHMARKS[name] = (setup, iterations)
+        return setup
+    return register
+
+
+def _chunks(n_channels=4, size=128, count=64, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.normal(scale=50, size=(size, n_channels)) for _ in range(count)]
+
+
+@benchmark("update_buffer")
+def _update_buffer():
+    chunks = _chunks()
+    state = {"buffer": np.zeros((4 * FS, 4)), "filter": None, "i": 0}
+
+    def run():
+        state["i"] += 1
+        state["buffer"], state["filter"] = utils.update_buffer(
+            state["buffer"], chunks[state["i"] % len(chunks)], notch=True, filter_state=state["filter"])
+    return run
+
+
+@benchmark("ring_buffer_append")
+def _ring_buffer_append():
+    chunks = _chunks()
+    ring = utils.EEGRingBuffer(4 * FS, 4)
+    counter = iter(range(sys.maxsize))
+    return lambda: ring.append(chunks[next(counter) % len(chunks)])
+
+
+def _band_powers(n_channels, epoch_len):
+    epoch = _chunks(n_channels, size=int(epoch_len * FS), count=1)[0]
+    return lambda: utils.compute_band_powers(epoch, FS)
+
+
+for _channels in (1, 4):
+    for _epoch_len in (1, 2, 4):
+        benchmark(f"compute_band_powers[{_channels}ch,{_epoch_len}s]")(
+            lambda c=_channels, e=_epoch_len: _band_powers(c, e))
+
+
+@benchmark("band_power_engine[4ch,2s]")
+def _band_power_engine():
+    engine = utils.BandPowerEngine(FS, 2)
+    epoch = _chunks(4, size=engine.n_samples, count=1)[0]
+    return lambda: engine.compute(epoch)
+
+
+@benchmark("artifact_detector_check[4ch,2s]")
+def _artifact_detector():
+    from emotion_detection.artifacts import ArtifactDetector
+
+    detector = ArtifactDetector(FS)
+    epoch = _chunks(4, size=2 * FS, count=1)[0]
+    return lambda: detector.check(epoch)
+
+
+@benchmark("artifact_detector_update[4ch,0.5s]")
+def _artifact_detector_update():
+    from emotion_detection.artifacts import ArtifactDetector
+
+    detector = ArtifactDetector(FS)
+    chunks = _chunks(4, size=FS // 2, count=64)
+    counter = iter(range(sys.maxsize))
+    return lambda: detector.update(chunks[next(counter) % len(chunks)])
+
+
+def _band_smoother(method, length):
+    smoother = utils.BandSmoother(length, (4, 4), method=method)
+    values = np.random.default_rng(0).normal(size=(256, 4, 4))
+    counter = iter(range(sys.maxsize))
+    return lambda: smoother.update(values[next(counter) % len(values)])
+
+
+for _method in ("mean", "ema"):
+    for _length in (10, 1000):
+        benchmark(f"band_smoother[{_method},{_length}]")(lambda m=_method, n=_length: _band_smoother(m, n))
+
+
+@benchmark("dynamic_scaler_update_scale")
+def _dynamic_scaler():
+    scaler = utils.DynamicScaler()
+    values = np.random.default_rng(0).normal(size=1024).tolist()
+    for value in values[:scaler.window_size]:
+        scaler.update(value)
+    counter = iter(range(sys.maxsize))
+
+    def run():
+        value = values[next(counter) % len(values)]
+        scaler.update(value)
+        scaler.scale(value)
+    return run
+
+
+@benchmark("generate_next_event", iterations=1000)
+def _generate_next_event():
+    random.seed(0)
+    generator = MetaGenerator()
+    rng = np.random.default_rng(0)
+    metrics = rng.uniform(0, 1, size=(256, 2)).tolist()
+    counter = iter(range(sys.maxsize))
+    return lambda: generator.generate_next_event(*metrics[next(counter) % len(metrics)])
+
+
+@benchmark("sample_progressions[256x16]", iterations=20)
+def _sample_progressions():
+    """256 progressions of 16 events at once, for offline rendering"""
+    generator = MetaGenerator()
+    metrics = np.random.default_rng(0).uniform(0, 1, size=(16, 2))
+    seeds = iter(range(sys.maxsize))
+    return lambda: generator.sample_progressions(metrics, n=256, rng=next(seeds))
+
+
+@benchmark("chord_event_to_ableton_osc")
+def _chord_to_osc():
+    random.seed(0)
+    chord_event, _ = MetaGenerator().generate_next_event(0.6, 0.6)
+    return lambda: chord_event.to_ableton_osc(start_time=8)
+
+
+@benchmark("arpeggiator_event_to_ableton_osc")
+def _arpeggiator_to_osc():
+    random.seed(0)
+    _, arp_event = MetaGenerator().generate_next_event(0.6, 0.9)
+    return lambda: arp_event.to_ableton_osc(start_time=8)
+
+
+def _multi_subject_engine(n_subjects):
+    """One epoch of the group engine, all subjects delivering a shift of samples"""
+    from emotion_detection.multi import MultiSubjectEngine
+
+    engine = MultiSubjectEngine(n_subjects, FS)
+    chunks = _chunks(n_channels=4, size=engine.shift_samples, count=16)
+    counter = iter(range(sys.maxsize))
+
+    def run():
+        chunk = chunks[next(counter) % len(chunks)]
+        for subject in range(n_subjects):
+            engine.push(subject, chunk)
+    return run
+
+
+for _subjects in (1, 4, 16):
+    benchmark(f"multi_subject_engine[{_subjects}]")(lambda n=_subjects: _multi_subject_engine(n))
+
+
+class NullOSCClient:
+    """Stands in for the UDP client, so the loop is measured without a network"""
+    def send_message(self, address, params):
+        pass
+
+    def send(self, content):
+        pass
+
+
+def null_controller():
+    """An AbletonMetaController whose OSC messages go nowhere"""
+    from music_gen.controllers import AbletonMetaController
+
+    controller = AbletonMetaController()
+    osc = controller.controller
+    osc.client = osc.sender.client = NullOSCClient()
+    osc.sender.limiter = None  # no network to protect
+    return controller
+
+
+@benchmark("main_loop_iteration", iterations=50)
+def _main_loop_iteration():
+    """One iteration of main_neuro_music.py: pull, pipeline, controller update, on a replayed recording"""
+    random.seed(0)
+    inlet = ReplayInlet(RECORDING, speed=None)
+    pipeline = NeuroPipeline(FS)
+    controller = null_controller()
+    while pipeline.push(inlet.pull_chunk(timeout=1, max_samples=pipeline.chunk_size)[0]) is None:
+        pass  # fill the buffers and scalers
+
+    def run():
+        eeg_data, _ = inlet.pull_chunk(timeout=1, max_samples=pipeline.chunk_size)
+        metrics = pipeline.push(eeg_data)
+        if metrics is not None:
+            controller.update_metrics(valence=metrics[0], arousal=metrics[1])
+    return run
+
+
+def measure(run, iterations, warmup=None):
+    """Times `iterations` calls of `run`, returns latency percentiles (µs) and throughput (calls/s)"""
+    for _ in range(warmup if warmup is not None else max(iterations // 10, 1)):
+        run()
+    latencies = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter_ns()
+        run()
+        latencies[i] = time.perf_counter_ns() - start
+    latencies /= 1e3
+    return {
+        "iterations": iterations,
+        "mean_us": float(latencies.mean()),
+        "p50_us": float(np.percentile(latencies, 50)),
+        "p95_us": float(np.percentile(latencies, 95)),
+        "p99_us": float(np.percentile(latencies, 99)),
+        "throughput_per_s": float(1e6 / latencies.mean()),
+    }
+
+
+def run_benchmarks(pattern=None, scale=1.0):
+    """Runs the benchmarks whose name contains `pattern`, with iterations scaled by `scale`"""
+    results = {}
+    for name, (setup, iterations) in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        results[name] = measure(setup(), max(int(iterations * scale), 1))
+    return results
+
+
+def compare(results, baseline, threshold=1.3):
+    """
+    Compares p50 latencies with a baseline.
+    :return: List of (name, baseline p50, current p50, ratio) for the benchmarks slower than `threshold` x baseline.
+    """
+    regressions = []
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        ratio = current["p50_us"] / baseline[name]["p50_us"]
+        if ratio > threshold:
+            regressions.append((name, baseline[name]["p50_us"], current["p50_us"], ratio))
+    return regressions
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<40} {'p50 µs':>10} {'p95 µs':>10} {'p99 µs':>10} {'calls/s':>12} {'vs base':>8}")
+    for name, r in results.items():
+        ratio = f"{r['p50_us'] / baseline[name]['p50_us']:.2f}x" if baseline and name in baseline else ""
+        print(f"{name:<40} {r['p50_us']:>10.1f} {r['p95_us']:>10.1f} {r['p99_us']:>10.1f} "
+              f"{r['throughput_per_s']:>12.0f} {ratio:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the neurofeedback and generation hot paths")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier of the number of iterations")
+    parser.add_argument("--save", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="JSON baseline to compare against, exits with 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=1.3, help="tolerated p50 slowdown ratio")
+    parser.add_argument("--log-level", default="WARNING", help="level of the (discarded) log records, DEBUG matches the live loop")
+    args = parser.parse_args()
+    logging.basicConfig(filename=os.devnull, level=args.log_level)
+
+    results = run_benchmarks(args.filter, args.scale)
+    baseline = json.loads(Path(args.compare).read_text())["results"] if args.compare else None
+    print_results(results, baseline)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps({"environment": environment(), "results": results}, indent=2))
+        print(f"Saved baseline to {args.save}")
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: p50 {before:.1f} -> {after:.1f} µs ({ratio:.2f}x)")
+        sys.exit(1 if regressions else 0)
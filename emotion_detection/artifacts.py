@@ -0,0 +1,255 @@
+"""
+Streaming artifact rejection for the Muse EEG: saturation, large amplitudes (movement, bad
+contact), eye blinks on the frontal channels and muscle (jaw clench) activity.
+
+Each incoming chunk is checked per channel with vectorized operations as it is buffered: its
+extremes, clipping, blink template matches and high-frequency power are kept per chunk, and the
+flags of an epoch are combined from the chunks covering it before its band powers enter the band
+buffer. The offline path computes the same chunk statistics for a whole recording at once.
+
+The band powers of flagged channels are set to NaN, so they are left out of the smoothing and of
+the channel averages of the metrics; only when every channel is flagged (by default) is the whole
+epoch rejected, so neither the band buffer nor the scalers see it.
+
+The thresholds are physiological rather than fitted to a recording. Scalp EEG at the Muse
+electrodes stays within a few tens of µV, so a peak-to-peak swing above ~150 µV over an epoch is
+movement, an electrode pop or a blink. Resting EEG falls off as 1/f and keeps only a few percent of
+its power above 30 Hz, while muscle activity is broadband up to hundreds of Hz. An electrode that
+is bad for a whole session (e.g. AF8 clipping throughout the bundled recording) is flagged in every
+epoch: leave it out of the channel selection (`index_channel`) rather than loosening the thresholds.
+"""
+
+import logging
+from collections import deque
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from emotion_detection.utils import NOTCH_HALF_WIDTH
+
+logger = logging.getLogger(__name__)
+
+# Absolute value (µV) at which the Muse ADC clips
+SATURATION_LEVEL = 990
+
+# Peak-to-peak amplitude (µV) of an epoch above which a channel is flagged
+AMPLITUDE_THRESHOLD = 150
+
+# Blinks: positive deflection of about 300 ms on AF7/AF8, matched with a Hann template
+BLINK_DURATION = 0.3
+BLINK_AMPLITUDE = 80
+BLINK_CORRELATION = 0.8
+
+# Muscle activity: fraction of the spectral power above HF_CUTOFF (Hz), mains harmonics excluded
+HF_CUTOFF = 30
+HF_RATIO = 0.2
+
+# Minimum band (Hz) between HF_CUTOFF and the Nyquist frequency for the muscle check, a decimated
+# stream (64 Hz, anti-aliased at 30 Hz) has nothing left above the cutoff and the check is disabled
+MIN_HF_BANDWIDTH = 10
+
+# Muse channel indices of the frontal electrodes AF7 and AF8
+FRONTAL_CHANNELS = (1, 2)
+
+CHECKS = ("saturation", "amplitude", "blink", "muscle")
+
+
+class ArtifactDetector:
+    """Flags artifacted channels chunk by chunk and masks their band powers in the epochs they cover"""
+    def __init__(self, fs, index_channel=(0, 1, 2, 3), saturation=SATURATION_LEVEL, amplitude=AMPLITUDE_THRESHOLD,
+                 blink_amplitude=BLINK_AMPLITUDE, blink_correlation=BLINK_CORRELATION, blink_duration=BLINK_DURATION,
+                 hf_cutoff=HF_CUTOFF, hf_ratio=HF_RATIO, mains=60, frontal_channels=FRONTAL_CHANNELS,
+                 max_bad_channels=None, epoch_length=2):
+        """
+        :param fs: Sampling frequency of the chunks.
+        :param index_channel: Muse channel index of each column of the chunks.
+        :param saturation: Absolute value (µV) considered as clipping, None disables the check.
+        :param amplitude: Peak-to-peak threshold (µV), None disables the check.
+        :param blink_amplitude: Minimum blink amplitude (µV), None disables the blink check.
+        :param blink_correlation: Minimum correlation with the blink template.
+        :param blink_duration: Length (seconds) of the blink template.
+        :param hf_cutoff: Frequency (Hz) above which power is attributed to muscles.
+        :param hf_ratio: Maximum fraction of power above `hf_cutoff`, None disables the check.
+        :param mains: Mains frequency, the bands around it and its harmonics are left out of the power ratio.
+        :param frontal_channels: Muse channel indices checked for blinks.
+        :param max_bad_channels: Number of flagged channels above which the epoch is rejected, all but one by default.
+        :param epoch_length: Length (seconds) of the epochs flagged by `clean`.
+        """
+        index_channel = list(index_channel)
+        self.fs = fs
+        self.n_channels = len(index_channel)
+        self.saturation = saturation
+        self.amplitude = amplitude
+        self.blink_amplitude = blink_amplitude
+        self.blink_correlation = blink_correlation
+        self.hf_cutoff = hf_cutoff
+        self.hf_ratio = hf_ratio
+        if hf_ratio is not None and fs / 2 - hf_cutoff < MIN_HF_BANDWIDTH:
+            logger.warning("Muscle check disabled, no band left above %s Hz at %s Hz sampling", hf_cutoff, fs)
+            self.hf_ratio = None
+        self.mains = mains
+        self.max_bad_channels = self.n_channels - 1 if max_bad_channels is None else max_bad_channels
+        self.frontal = [index_channel.index(ch) for ch in frontal_channels if ch in index_channel]
+        self.epoch_samples = int(epoch_length * fs)
+
+        template = np.hanning(max(int(blink_duration * fs), 3))
+        template -= template.mean()
+        self.template_norm = np.linalg.norm(template)
+        self.template = template / self.template_norm  # unit norm, zero mean
+        self.context = len(template) - 1  # samples of the previous chunk needed by the blink windows
+
+        self._masks = {}  # chunk length -> (Hann window, high frequency and total rfft bin masks)
+        self._chunks = deque()  # (samples, statistics) of the latest chunks, enough to cover an epoch
+        self._tail = None  # last `context` samples, the start of the next blink windows
+        self.last_flags = {check: np.zeros(self.n_channels, dtype=bool) for check in CHECKS}
+        self.n_epochs = 0
+        self.rejected_epochs = 0
+        self.flagged_channels = np.zeros(self.n_channels, dtype=int)  # per channel, epochs flagged
+        self.check_counts = dict.fromkeys(CHECKS, 0)  # channel flags per check
+
+    @property
+    def counts(self):
+        """Rejection counts, for logging"""
+        return dict(epochs=self.n_epochs, rejected_epochs=self.rejected_epochs,
+                    flagged_channels=self.flagged_channels.tolist(), **self.check_counts)
+
+    def update(self, chunk):
+        """
+        Checks the chunk of samples just buffered.
+        :param chunk: Notch filtered samples of shape (samples, channels), following the previous chunk.
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if len(chunk) == 0:
+            return
+        extended = chunk if self._tail is None else np.concatenate((self._tail, chunk))
+        self._chunks.append((len(chunk), self._stats(extended[..., None], len(extended) - len(chunk))))
+        self._tail = extended[-self.context:].copy()  # the chunk may be a view of a ring buffer
+        while sum(n for n, _ in self._chunks) - self._chunks[0][0] >= self.epoch_samples:
+            self._chunks.popleft()
+
+    def reset(self):
+        """Forgets the chunks seen so far, for a stream that does not continue them"""
+        self._chunks.clear()
+        self._tail = None
+
+    def check(self, epoch):
+        """
+        Flags the artifacted channels of a whole epoch, checked as a single chunk.
+        :param epoch: Notch filtered samples of shape (samples, channels).
+        :return: Boolean array of shape (channels,), True for artifacted channels.
+        """
+        stats = self._stats(np.asarray(epoch, dtype=float)[..., None])
+        self.last_flags = self._flags(stats)
+        return np.logical_or.reduce([self.last_flags[check] for check in CHECKS])
+
+    def clean(self, band_powers):
+        """
+        Flags the latest epoch from the chunks covering it and masks the band powers of its flagged channels.
+        :param band_powers: Band powers of the epoch ending with the last chunk, shape (bands, channels).
+        :return: Copy of the band powers with NaN for the flagged channels, or None if the epoch is rejected.
+        """
+        covering, covered = [], 0
+        for n, stats in reversed(self._chunks):
+            covering.append(stats)
+            covered += n
+            if covered >= self.epoch_samples:
+                break
+        stats = {key: np.concatenate([s[key] for s in covering], axis=-1) for key in covering[0]}
+        self.last_flags = self._flags(stats)
+        flagged = self._tally(self.last_flags)
+        if flagged.sum() > self.max_bad_channels:
+            logger.debug("Rejected epoch, flagged channels: %s", {c: np.flatnonzero(f).tolist() for c, f in self.last_flags.items() if f.any()})
+            return None
+        band_powers = np.array(band_powers, dtype=float)
+        band_powers[:, flagged] = np.nan
+        return band_powers
+
+    def clean_batch(self, chunks, band_powers, chunks_per_epoch, context=0):
+        """
+        Vectorized `update` and `clean` over a whole recording.
+        :param chunks: Consecutive chunks of notch filtered samples, shape (context + samples, channels, chunks),
+            each preceded by the last `context` samples of the previous one.
+        :param band_powers: Band powers of shape (bands, channels, epochs), epoch i ending with chunk
+            i + chunks_per_epoch - 1. The flagged channels are set to NaN in place.
+        :param chunks_per_epoch: Number of chunks covering an epoch.
+        :param context: Samples of the previous chunk at the start of each chunk, up to `self.context`.
+        :return: Boolean array of shape (epochs,), False for the rejected epochs.
+        """
+        stats = self._stats(chunks, context)
+        windows = {key: sliding_window_view(value, chunks_per_epoch, axis=-1) for key, value in stats.items()}
+        flags = self._flags(windows)  # (channels, epochs) per check
+        flagged = self._tally(flags)
+        kept = flagged.sum(axis=0) <= self.max_bad_channels
+        band_powers[:, flagged] = np.nan
+        return kept
+
+    def _tally(self, flags):
+        """Counts the flags of one epoch (channels,) or several epochs (channels, epochs)"""
+        flagged = np.logical_or.reduce([flags[check] for check in CHECKS])
+        n_flagged = flagged.sum(axis=0)
+        self.n_epochs += np.size(n_flagged)
+        self.rejected_epochs += int(np.sum(n_flagged > self.max_bad_channels))
+        self.flagged_channels += flagged if flagged.ndim == 1 else flagged.sum(axis=1)
+        for check in CHECKS:
+            self.check_counts[check] += int(flags[check].sum())
+        return flagged
+
+    def _stats(self, chunks, context=0):
+        """
+        Statistics of each chunk the flags are combined from.
+        :param chunks: Samples of shape (context + samples, channels, chunks).
+        :param context: Leading samples belonging to the previous chunk, only used by the blink windows.
+        :return: Dict of arrays of shape (channels, chunks).
+        """
+        new = chunks[context:]
+        stats = {"max": new.max(axis=0), "min": new.min(axis=0)}
+        stats["saturated"] = np.any(np.abs(new) >= self.saturation, axis=0) if self.saturation is not None \
+            else np.zeros(new.shape[1:], dtype=bool)
+        stats["blink"] = np.zeros(new.shape[1:], dtype=bool)
+        if self.blink_amplitude is not None and self.frontal:
+            stats["blink"][self.frontal] = self._blinks(chunks[:, self.frontal])
+        if self.hf_ratio is not None:
+            stats["high"], stats["power"] = self._hf_power(new)
+        return stats
+
+    def _flags(self, stats):
+        """Flags per check from chunk statistics, combined over their last axis (the chunks covering an epoch)"""
+        shape = stats["max"].shape[:-1]
+        flags = dict.fromkeys(CHECKS)
+        flags["saturation"] = stats["saturated"].any(axis=-1)
+        flags["amplitude"] = stats["max"].max(axis=-1) - stats["min"].min(axis=-1) > self.amplitude \
+            if self.amplitude is not None else np.zeros(shape, dtype=bool)
+        flags["blink"] = stats["blink"].any(axis=-1)
+        flags["muscle"] = stats["high"].sum(axis=-1) > self.hf_ratio * np.maximum(stats["power"].sum(axis=-1), 1e-12) \
+            if self.hf_ratio is not None else np.zeros(shape, dtype=bool)
+        return flags
+
+    def _blinks(self, frontal):
+        """Channels of each chunk with a window matching the blink template, both in shape and amplitude"""
+        n = len(self.template)
+        if len(frontal) < n:
+            return np.zeros(frontal.shape[1:], dtype=bool)
+        dots = sliding_window_view(frontal, n, axis=0) @ self.template  # (windows, channels, chunks)
+        # Norm of each mean-removed window from running sums of the samples and their squares
+        sums = np.zeros((2, len(frontal) + 1) + frontal.shape[1:])
+        np.cumsum(frontal, axis=0, out=sums[0, 1:])
+        np.cumsum(frontal * frontal, axis=0, out=sums[1, 1:])
+        window_sum, window_energy = sums[:, n:] - sums[:, :-n]
+        energy = np.maximum(window_energy - window_sum * window_sum / n, 1e-12)
+        correlation = dots / np.sqrt(energy)
+        amplitude = dots / self.template_norm  # least-squares amplitude of the unit-height template
+        return np.any((correlation > self.blink_correlation) & (amplitude > self.blink_amplitude), axis=0)
+
+    def _hf_power(self, chunks):
+        """
+        Spectral power (above 1 Hz, away from the mains harmonics) of each chunk above the cutoff, and
+        in total. Chunks are Hann windowed, so strong slow waves do not leak above the cutoff.
+        """
+        n = len(chunks)
+        if n not in self._masks:
+            freqs = np.fft.rfftfreq(n, 1 / self.fs)
+            harmonics = np.maximum(np.round(freqs / self.mains), 1) * self.mains  # nearest harmonic of each bin
+            valid = (freqs >= 1) & (np.abs(freqs - harmonics) > NOTCH_HALF_WIDTH)
+            self._masks[n] = (np.hanning(n)[:, None, None], (valid & (freqs >= self.hf_cutoff)).astype(float),
+                              valid.astype(float))
+        window, high, total = self._masks[n]
+        power = np.abs(np.fft.rfft((chunks - chunks.mean(axis=0)) * window, axis=0)) ** 2
+        return np.tensordot(high, power, axes=1), np.tensordot(total, power, axes=1)
@@ -0,0 +1,180 @@
+"""
+Latency instrumentation of the live loop: per-stage timings (pull, filter, FFT, smoothing,
+scaling, generation, OSC send) and end-to-end ages of the metrics, measured from the
+corrected LSL timestamp of the newest EEG sample they were computed from.
+
+Instrumentation is off by default: `stage` then returns a shared no-op context manager and
+`age` returns immediately. `enable` installs a process-wide LatencyMonitor that keeps a
+rolling window of each measurement and can dump summaries periodically to a JSON lines file
+and/or serve them on a local HTTP endpoint.
+
+Usage:
+    with latency.stage("fft"):
+        band_powers = engine.compute(epoch)
+    latency.age("osc_update", sample_timestamp)
+"""
+
+import contextlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Number of measurements kept per stage
+WINDOW = 1000
+
+# Upper edges (ms) of the histogram buckets, the last bucket is open
+HISTOGRAM_EDGES_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+_NULL_STAGE = contextlib.nullcontext()
+_monitor = None
+
+
+class _Stage:
+    __slots__ = ("monitor", "name", "start")
+
+    def __init__(self, monitor, name):
+        self.monitor = monitor
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.monitor.record(self.name, time.perf_counter() - self.start)
+
+
+class LatencyMonitor:
+    """Rolling windows of durations (seconds) per measurement name"""
+    def __init__(self, window=WINDOW, clock=time.monotonic):
+        """
+        :param window: Number of measurements kept per name.
+        :param clock: Clock of the corrected sample timestamps, pylsl.local_clock for a real inlet.
+        """
+        self.window = window
+        self.clock = clock
+        self.values = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._reporter = None
+        self._server = None
+        self._stop = threading.Event()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            if name not in self.values:
+                self.values[name] = deque(maxlen=self.window)
+                self.counts[name] = 0
+            self.values[name].append(seconds)
+            self.counts[name] += 1
+
+    def summary(self):
+        """Count, mean, percentiles, max (ms) and histogram of each measurement's rolling window"""
+        with self._lock:
+            windows = {name: np.array(values) * 1e3 for name, values in self.values.items()}
+            counts = dict(self.counts)
+        summary = {}
+        for name, ms in windows.items():
+            if len(ms) == 0:
+                continue
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            buckets = np.searchsorted(HISTOGRAM_EDGES_MS, ms, side="left")
+            summary[name] = {
+                "count": counts[name], "mean_ms": float(ms.mean()), "p50_ms": float(p50), "p95_ms": float(p95),
+                "p99_ms": float(p99), "max_ms": float(ms.max()),
+                "histogram": np.bincount(buckets, minlength=len(HISTOGRAM_EDGES_MS) + 1).tolist(),
+            }
+        return summary
+
+    def start_reporting(self, interval=10.0, path=None, port=None, host="127.0.0.1"):
+        """
+        Dumps the summary every `interval` seconds as a JSON line appended to `path`, and/or
+        serves it as JSON on http://host:port/ (port 0 picks a free port, see `address`).
+        """
+        if path is not None:
+            self._reporter = threading.Thread(target=self._report, args=(interval, path),
+                                              name="latency-report", daemon=True)
+            self._reporter.start()
+        if port is not None:
+            self._server = ThreadingHTTPServer((host, port), _handler(self))
+            threading.Thread(target=self._server.serve_forever, name="latency-http", daemon=True).start()
+            logger.info("Serving latency metrics on http://%s:%d/", *self.address)
+
+    @property
+    def address(self):
+        return self._server.server_address if self._server is not None else None
+
+    def stop_reporting(self):
+        self._stop.set()
+        if self._reporter is not None:
+            self._reporter.join()
+            self._reporter = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def dump(self, path):
+        with open(path, "a") as f:
+            f.write(json.dumps({"time": time.time(), "latency": self.summary()}) + "\n")
+
+    def _report(self, interval, path):
+        while not self._stop.wait(interval):
+            self.dump(path)
+        self.dump(path)
+
+
+def _handler(monitor):
+    class LatencyHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(monitor.summary()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+    return LatencyHandler
+
+
+def enable(window=WINDOW, clock=time.monotonic):
+    """Installs (and returns) the process-wide monitor"""
+    global _monitor
+    _monitor = LatencyMonitor(window, clock)
+    return _monitor
+
+
+def disable():
+    global _monitor
+    if _monitor is not None:
+        _monitor.stop_reporting()
+    _monitor = None
+
+
+def monitor():
+    """The installed LatencyMonitor, None when instrumentation is disabled"""
+    return _monitor
+
+
+def stage(name):
+    """Context manager timing a stage, a shared no-op when disabled"""
+    if _monitor is None:
+        return _NULL_STAGE
+    return _monitor.stage(name)
+
+
+def age(name, timestamp):
+    """Records how long ago `timestamp` (corrected LSL time) was, no-op when disabled or without timestamp"""
+    if _monitor is None or timestamp is None:
+        return
+    _monitor.record(name, _monitor.clock() - timestamp)
@@ -0,0 +1,114 @@
+"""
+Logging setup for the real-time loop.
+
+Records are put on a queue by the logging threads and formatted and written to a size-rotated
+file by a background listener, so a DEBUG run does not write to disk on the acquisition, DSP or
+beat threads. Hot-path loggers get a rate limit per message template, the suppressed records
+are counted and reported with the next record that goes through.
+
+Usage:
+    listener = setup_logging("system.log")
+    ...
+    listener.stop()  # flushes the queue
+"""
+
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from pathlib import Path
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%H:%M:%S'  # More compact time format
+
+# Size of a log file before it is rotated, and number of rotated files kept
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+# Records per second (and burst) let through per message template of the hot-path loggers
+HOT_PATH_LIMITS = {
+    "music_gen.generator": (2.0, 20),
+    "music_gen.controllers": (2.0, 20),
+    "emotion_detection.pipeline": (2.0, 20),
+    "emotion_detection.artifacts": (1.0, 5),
+    "music_gen.async_controllers": (2.0, 20),
+}
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per message template (record.msg): lets `rate` records per second through,
+    with bursts of up to `burst` records. Filtered records are counted, and the count is
+    appended to the next record of the same template that passes.
+    """
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.buckets = {}  # template -> [tokens, last update, suppressed]
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        now = self.clock()
+        with self._lock:
+            bucket = self.buckets.get(record.msg)
+            if bucket is None:
+                bucket = self.buckets[record.msg] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+            skipped, bucket[2] = bucket[2], 0
+        if skipped:
+            record.msg = f"{record.msg} [{skipped} similar suppressed]"
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves the formatting to the listener thread. Records are queued as they
+    are, so arguments must not be mutated after logging (the loop logs numbers and strings).
+    """
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(path="system.log", level=logging.DEBUG, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                  limits=HOT_PATH_LIMITS):
+    """
+    Routes all logging through a queue to a size-rotated file written by a background listener.
+    The previous run's log is rotated away, like the former filemode='w' kept one log per run.
+    :param path: Log file.
+    :param level: Level of the root logger.
+    :param max_bytes: Size at which the file is rotated.
+    :param backup_count: Number of rotated files kept.
+    :param limits: Mapping logger name -> (records per second, burst) for the hot-path loggers.
+    :return: The started QueueListener, stop it to flush the queue on exit.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    if Path(path).exists() and Path(path).stat().st_size > 0:
+        file_handler.doRollover()
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    for name, (rate, burst) in (limits or {}).items():
+        logger = logging.getLogger(name)
+        for existing in [f for f in logger.filters if isinstance(f, RateLimitFilter)]:
+            logger.removeFilter(existing)
+        logger.addFilter(RateLimitFilter(rate, burst))
+
+    listener.start()
+    return listener
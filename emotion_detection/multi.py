@@ -0,0 +1,197 @@
+"""
+Group sessions: several headsets processed together and aggregated into one (valence, arousal).
+
+All subjects share one ring buffer of shape (samples, subjects, channels), so notch filtering,
+band powers, smoothing and scaling run once per epoch for the whole group instead of once per
+headset. Chunks from the inlets are queued per subject and processed as soon as every subject
+has delivered them, which keeps the subjects aligned sample by sample.
+
+A headset that stalls or disconnects must not freeze the group: once another subject has more
+than `max_backlog` seconds queued, the group moves on and the missing samples of the subjects
+behind are filled with NaN. Their metrics are NaN and left out of the aggregation until they
+deliver again, their new chunks then continue at the group's current position.
+"""
+
+import logging
+import numpy as np
+from emotion_detection import utils
+from emotion_detection.pipeline import (BUFFER_LENGTH, EPOCH_LENGTH, OVERLAP_LENGTH, BAND_BUFFER_LENGTH,
+                                        INDEX_CHANNEL, MAINS_FREQUENCY, HIGHPASS_CUTOFF, SCALER_WINDOW,
+                                        VALENCE_SOURCE, ASYMMETRY_PAIRS, VALENCE_SOURCES, SMOOTHING_METHOD,
+                                        asymmetry_positions, compute_metrics)
+
+logger = logging.getLogger(__name__)
+
+AGGREGATIONS = ("mean", "weighted", "leader")
+
+# Seconds of EEG a subject can have queued while waiting for the others, beyond that the subjects
+# behind are considered stalled and the group continues without them
+MAX_BACKLOG = 2.0
+
+
+def aggregate(values, method="mean", weights=None, leader=0, follow=0.5):
+    """
+    Combines the metric of each subject into a single value, NaN values (stalled subjects) are left out.
+    :param values: Array of shape (subjects,).
+    :param method: "mean", "weighted" (normalized `weights`) or "leader" (the leader's value
+        pulled towards the mean of the other subjects by `follow`).
+    :param weights: One weight per subject, used by "weighted".
+    :param leader: Index of the leading subject, used by "leader".
+    :param follow: Influence of the other subjects on the leader, in [0, 1], used by "leader".
+    :return: Float, NaN when no subject has a value.
+    """
+    if method not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation method: {method}, expected one of {AGGREGATIONS}")
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return float("nan")
+    if method == "mean":
+        return float(values[valid].mean())
+    if method == "weighted":
+        weights = np.asarray(weights, dtype=float)[valid]
+        return float(weights @ values[valid] / weights.sum())
+    others = valid.copy()  # "leader"
+    others[leader] = False
+    if not others.any():
+        return float(values[leader])
+    if not valid[leader]:
+        return float(values[others].mean())  # the leader stalled, the others carry on
+    return float((1 - follow) * values[leader] + follow * values[others].mean())
+
+
+class MultiSubjectEngine:
+    """Turns chunks of raw EEG from several headsets into one scaled (valence, arousal)"""
+    def __init__(self, n_subjects, fs, index_channel=INDEX_CHANNEL, buffer_length=BUFFER_LENGTH,
+                 epoch_length=EPOCH_LENGTH, overlap_length=OVERLAP_LENGTH, band_buffer_length=BAND_BUFFER_LENGTH,
+                 mains=MAINS_FREQUENCY, highpass=HIGHPASS_CUTOFF, aggregation="mean", weights=None,
+                 leader=0, follow=0.5, valence_source=VALENCE_SOURCE, asymmetry_pairs=ASYMMETRY_PAIRS,
+                 smoothing=SMOOTHING_METHOD, max_backlog=MAX_BACKLOG):
+        """
+        :param n_subjects: Number of headsets.
+        :param fs: Sampling frequency shared by all the streams.
+        :param index_channel: Indices of the channels used from each incoming sample.
+        :param buffer_length: Length of the EEG buffer in seconds.
+        :param epoch_length: Length of the epochs used to compute the FFT in seconds.
+        :param overlap_length: Overlap between consecutive epochs in seconds.
+        :param band_buffer_length: Number of epochs averaged to smooth the band powers.
+        :param mains: Mains frequency removed by the notch filter.
+        :param highpass: Optional high-pass cutoff (Hz) applied with the notch.
+        :param aggregation: How the subjects are combined, see `aggregate`.
+        :param weights: Weight of each subject for the "weighted" aggregation.
+        :param leader: Leading subject for the "leader" aggregation.
+        :param follow: Influence of the other subjects for the "leader" aggregation.
+        :param valence_source: "theta_alpha" or "asymmetry", see pipeline.VALENCE_SOURCE.
+        :param asymmetry_pairs: (right, left) Muse channel pairs of the asymmetry valence.
+        :param smoothing: Smoothing method of the band buffer, "mean", "ema" or "median".
+        :param max_backlog: Seconds of EEG queued for a subject before the subjects behind are considered stalled.
+        """
+        if valence_source not in VALENCE_SOURCES:
+            raise ValueError(f"Unknown valence source: {valence_source}, expected one of {VALENCE_SOURCES}")
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation method: {aggregation}, expected one of {AGGREGATIONS}")
+        if aggregation == "weighted" and (weights is None or len(weights) != n_subjects):
+            raise ValueError(f"The weighted aggregation needs one weight per subject ({n_subjects})")
+        self.n_subjects = n_subjects
+        self.fs = fs
+        self.index_channel = list(index_channel)
+        self.shift_samples = int((epoch_length - overlap_length) * fs)
+        self.metrics = dict(valence_source=valence_source, asymmetry_pairs=(
+            asymmetry_positions(self.index_channel, asymmetry_pairs) if valence_source == "asymmetry" else None))
+        self.aggregation = dict(method=aggregation, weights=weights, leader=leader, follow=follow)
+
+        n_channels = len(self.index_channel)
+        self.ring = utils.EEGRingBuffer(int(fs * buffer_length), (n_subjects, n_channels), notch=True,
+                                        fs=fs, mains=mains, highpass=highpass)
+        self.band_engine = utils.BandPowerEngine(fs, epoch_length)
+        # Smoothed band powers of shape (bands, channels, subjects)
+        self.band_buffer = utils.BandSmoother(band_buffer_length, (len(self.band_engine.bands), n_channels, n_subjects),
+                                              method=smoothing)
+        self.arousal_scaler = utils.BatchDynamicScaler(n_subjects, window_size=SCALER_WINDOW)
+        self.valence_scaler = utils.BatchDynamicScaler(n_subjects, window_size=SCALER_WINDOW)
+        self.valence = None  # latest raw metrics per subject
+        self.arousal = None
+        self.scaled_valence = None  # latest scaled metrics per subject
+        self.scaled_arousal = None
+
+        self._pending = [[] for _ in range(n_subjects)]
+        self._pending_samples = np.zeros(n_subjects, dtype=int)
+        self._since_epoch = 0
+        self.max_backlog_samples = int(max_backlog * fs)
+        self.stalled = np.zeros(n_subjects, dtype=bool)  # subjects whose samples are NaN filled
+
+    @property
+    def buffer(self):
+        """The filtered EEG as a (subjects, samples, channels) view of the ring buffer"""
+        return self.ring.data.transpose(1, 0, 2)
+
+    def push(self, subject, eeg_data):
+        """
+        Queues a chunk of raw samples from one subject, see `process` for the returned value.
+        :param subject: Index of the headset the chunk was pulled from.
+        :param eeg_data: Samples of shape (samples, all channels) as pulled from the inlet.
+        """
+        if len(eeg_data):
+            self._pending[subject].append(np.asarray(eeg_data, dtype=float)[:, self.index_channel])
+            self._pending_samples[subject] += len(eeg_data)
+        return self.process()
+
+    def process(self):
+        """
+        Processes the samples delivered by every subject, with one filter call and at most
+        one band power computation for the whole group. Stalled subjects (see module docstring)
+        are filled with NaN.
+        :return: Aggregated (scaled_valence, scaled_arousal), or None if no new epoch is ready.
+        """
+        n = int(self._pending_samples.min())
+        n = max(n, int(self._pending_samples.max()) - self.max_backlog_samples)
+        if n <= 0:
+            return None
+        stalled = self._pending_samples < n
+        if np.any(stalled & ~self.stalled):
+            logger.warning("Subjects %s stalled, continuing without them", np.flatnonzero(stalled & ~self.stalled).tolist())
+        if np.any(self.stalled & ~stalled):
+            logger.info("Subjects %s deliver again", np.flatnonzero(self.stalled & ~stalled).tolist())
+        self.stalled = stalled
+        block = np.stack([self._take(subject, n) for subject in range(self.n_subjects)], axis=1)
+        was_full = self.ring.full
+        self.ring.append(block)  # (samples, subjects, channels)
+        if not was_full:
+            return None  # still populating the initial buffer
+
+        self._since_epoch += n
+        if self._since_epoch < self.shift_samples:
+            return None
+        self._since_epoch = 0
+
+        epoch = self.ring.last_epoch(self.band_engine.n_samples)
+        band_powers = self.band_engine.compute(epoch)  # Shape: (bands, subjects, channels)
+        smooth_band_powers = self.band_buffer.update(band_powers.transpose(0, 2, 1))  # Shape: (bands, channels, subjects)
+        if smooth_band_powers is None:
+            return None  # wait until there enough epochs in the band buffer
+        self.valence, self.arousal = compute_metrics(smooth_band_powers, **self.metrics)
+        self.valence_scaler.update(self.valence)
+        self.arousal_scaler.update(self.arousal)
+        if not self.valence_scaler.ready:
+            return None  # Wait for enough samples for scaling
+
+        self.scaled_valence = self.valence_scaler.scale(self.valence)
+        self.scaled_arousal = self.arousal_scaler.scale(self.arousal)
+        valence = aggregate(self.scaled_valence, **self.aggregation)
+        arousal = aggregate(self.scaled_arousal, **self.aggregation)
+        if np.isnan(valence) or np.isnan(arousal):
+            return None  # every subject stalled
+        return valence, arousal
+
+    def _take(self, subject, n):
+        """Removes and returns the first `n` queued samples of a subject, NaN filled if fewer are queued"""
+        chunks = self._pending[subject]
+        if not chunks:
+            return np.full((n, len(self.index_channel)), np.nan)
+        data = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        rest = data[n:]
+        self._pending[subject] = [rest] if len(rest) else []
+        self._pending_samples[subject] -= len(data) - len(rest)
+        if len(data) < n:
+            data = np.concatenate((data, np.full((n - len(data), data.shape[1]), np.nan)))
+        return data[:n]
@@ -0,0 +1,332 @@
+"""
+Neurofeedback processing shared by the live loop (main_neuro_music.py) and the offline replay:
+notch filtering, buffering, band powers, smoothing, valence/arousal protocols and scaling.
+"""
+
+import logging
+import numpy as np
+from emotion_detection import latency, utils
+from emotion_detection.artifacts import ArtifactDetector
+
+logger = logging.getLogger(__name__)
+
+class Band:
+    Delta = 0
+    Theta = 1
+    Alpha = 2
+    Beta = 3
+
+# Length of the EEG data buffer (in seconds)
+BUFFER_LENGTH = 4
+
+# Length of the epochs used to compute the FFT (in seconds)
+EPOCH_LENGTH = 2
+
+# Amount of overlap between two consecutive epochs (in seconds)
+OVERLAP_LENGTH = 1.5
+
+# Amount to 'shift' the start of each next consecutive epoch
+SHIFT_LENGTH = EPOCH_LENGTH - OVERLAP_LENGTH
+
+BAND_BUFFER_LENGTH = 10
+
+# Smoothing of the band powers over the band buffer: "mean", "ema" or "median", see utils.BandSmoother
+SMOOTHING_METHOD = "mean"
+
+# All the 4 electrodes
+INDEX_CHANNEL = [0, 1, 2, 3]
+
+# Mains frequency removed by the notch filter (60 Hz in the Americas, 50 Hz in Europe)
+MAINS_FREQUENCY = 60
+
+# Optional high-pass cutoff (Hz) removing slow drifts before the FFT, None disables it
+HIGHPASS_CUTOFF = None
+
+# Rolling window (in epochs) and method of the valence/arousal scalers, see utils.DynamicScaler
+SCALER_WINDOW = 50
+SCALER_METHOD = "minmax"
+
+# Decimate the notch filtered stream before buffering, 1 keeps the full rate. 4 analyses the Muse
+# 256 Hz stream at 64 Hz, which keeps the bands up to 30 Hz but leaves no band for the muscle check
+# of the artifact rejection (disabled then, see artifacts.MIN_HF_BANDWIDTH)
+DECIMATION_FACTOR = 1
+
+# Update band powers with a sliding DFT instead of a full FFT per epoch (cheaper for small shifts)
+INCREMENTAL_SPECTRUM = False
+
+# Number of epochs transformed at once by the offline path, bounds its memory use
+OFFLINE_BLOCK_EPOCHS = 1024
+
+# Valence protocol: "theta_alpha" (theta/alpha ratio) or "asymmetry" (frontal alpha asymmetry)
+VALENCE_SOURCE = "theta_alpha"
+
+# (right, left) channel pairs of the alpha asymmetry, as indices of the Muse channels
+# TP9=0, AF7=1, AF8=2, TP10=3: AF8 - AF7, add (3, 0) for the temporal pair TP10 - TP9
+ASYMMETRY_PAIRS = ((2, 1),)
+VALENCE_SOURCES = ("theta_alpha", "asymmetry")
+
+# Leave epochs and channels with artifacts (saturation, blinks, muscle) out of the band buffer
+# and scalers, see emotion_detection.artifacts for the thresholds
+ARTIFACT_REJECTION = False
+
+
+def alpha_asymmetry(smooth_band_powers, pairs=((2, 1),)):
+    """
+    Alpha asymmetry: log alpha power of the right minus the left channel, averaged over the pairs.
+    Lower alpha means more cortical activity, so positive values indicate a relatively more
+    active left hemisphere, associated with approach and positive valence.
+    :param smooth_band_powers: Array of log10 band powers of shape (bands, channels, ...).
+    :param pairs: (right, left) channel indices of the band power matrix.
+    :return: Float or array of the trailing shape, NaN when no pair has both channels clean.
+    """
+    alpha = smooth_band_powers[Band.Alpha]
+    right, left = [list(side) for side in zip(*pairs)]
+    return channel_mean(alpha[right] - alpha[left])
+
+
+def channel_mean(values):
+    """Mean over the first axis (channels) leaving NaN values out, NaN where all channels are (all flagged)"""
+    missing = np.isnan(values)
+    n_valid = (~missing).sum(axis=0)
+    with np.errstate(invalid="ignore"):
+        return np.where(n_valid > 0, np.where(missing, 0, values).sum(axis=0), np.nan) / n_valid
+
+
+def compute_metrics(smooth_band_powers, valence_source="theta_alpha", asymmetry_pairs=((2, 1),)):
+    """
+    Computes the raw valence and arousal from smoothed band powers.
+    :param smooth_band_powers: Array of shape (bands, channels, ...), NaN for channels left out
+        by the artifact detector.
+    :param valence_source: "theta_alpha" or "asymmetry", see VALENCE_SOURCE.
+    :param asymmetry_pairs: (right, left) channel indices of the band power matrix used by "asymmetry".
+    :return: (valence, arousal), floats or arrays of the trailing shape.
+    """
+    # TODO: is this correct?
+    # aggregate across channels
+    aggregated_alpha = channel_mean(smooth_band_powers[Band.Alpha])
+    aggregated_beta = channel_mean(smooth_band_powers[Band.Beta])
+
+    if valence_source == "asymmetry":
+        valence = alpha_asymmetry(smooth_band_powers, asymmetry_pairs)
+    elif valence_source == "theta_alpha":
+        aggregated_theta = channel_mean(smooth_band_powers[Band.Theta])
+        valence = aggregated_theta / aggregated_alpha # anxiety protocol
+    else:
+        raise ValueError(f"Unknown valence source: {valence_source}, expected one of {VALENCE_SOURCES}")
+    arousal = aggregated_beta / aggregated_alpha # rafa ramirez protocol
+    return valence, arousal
+
+
+def asymmetry_positions(index_channel, pairs=ASYMMETRY_PAIRS):
+    """Maps (right, left) Muse channel pairs to positions in the band power matrix of `index_channel`"""
+    index_channel = list(index_channel)
+    missing = {ch for pair in pairs for ch in pair} - set(index_channel)
+    if missing:
+        raise ValueError(f"Asymmetry channels {sorted(missing)} are not in the selected channels {index_channel}")
+    return tuple((index_channel.index(right), index_channel.index(left)) for right, left in pairs)
+
+
+class NeuroPipeline:
+    """Turns chunks of raw EEG into scaled (valence, arousal) values"""
+    def __init__(self, fs, index_channel=INDEX_CHANNEL, buffer_length=BUFFER_LENGTH, epoch_length=EPOCH_LENGTH,
+                 overlap_length=OVERLAP_LENGTH, band_buffer_length=BAND_BUFFER_LENGTH,
+                 decimation=DECIMATION_FACTOR, incremental=INCREMENTAL_SPECTRUM,
+                 mains=MAINS_FREQUENCY, highpass=HIGHPASS_CUTOFF, valence_source=VALENCE_SOURCE,
+                 asymmetry_pairs=ASYMMETRY_PAIRS, artifact_rejection=ARTIFACT_REJECTION,
+                 smoothing=SMOOTHING_METHOD):
+        """
+        :param fs: Sampling frequency of the incoming stream.
+        :param index_channel: Indices of the channels used from each incoming sample.
+        :param buffer_length: Length of the EEG buffer in seconds.
+        :param epoch_length: Length of the epochs used to compute the FFT in seconds.
+        :param overlap_length: Overlap between consecutive epochs in seconds.
+        :param band_buffer_length: Number of epochs averaged to smooth the band powers.
+        :param decimation: Decimation factor applied after the notch filter.
+        :param incremental: Use the sliding DFT instead of a full FFT per epoch.
+        :param mains: Mains frequency removed by the notch filter.
+        :param highpass: Optional high-pass cutoff (Hz) applied with the notch.
+        :param valence_source: "theta_alpha" or "asymmetry", see VALENCE_SOURCE.
+        :param asymmetry_pairs: (right, left) Muse channel pairs of the asymmetry valence.
+        :param artifact_rejection: Check every epoch with an ArtifactDetector before it enters the band buffer.
+        :param smoothing: Smoothing method of the band buffer, "mean", "ema" or "median".
+        """
+        if valence_source not in VALENCE_SOURCES:
+            raise ValueError(f"Unknown valence source: {valence_source}, expected one of {VALENCE_SOURCES}")
+        logger.info("FFT will be computed on %d second epoch in the buffer with an overlap of %f seconds", epoch_length, overlap_length)
+        self.fs = fs
+        self.index_channel = list(index_channel)
+        self.buffer_length = buffer_length
+        self.shift_length = epoch_length - overlap_length
+        self.decimation = decimation
+        self.mains = mains
+        self.highpass = highpass
+        self.valence_source = valence_source
+        # Computed from the same band power matrix as the other metrics, no extra FFT
+        self.asymmetry_pairs = asymmetry_positions(self.index_channel, asymmetry_pairs) if valence_source == "asymmetry" else None
+
+        self.eeg_buffer = utils.initialize_buffer(fs, buffer_length, self.index_channel, decimation=decimation,
+                                                  mains=mains, highpass=highpass)
+        self.band_engine = utils.BandPowerEngine(fs / decimation, epoch_length)
+        self.sliding_engine = utils.SlidingBandPowerEngine(self.band_engine, self.eeg_buffer) if incremental else None
+        self.band_buffer = utils.BandSmoother(band_buffer_length, (len(self.band_engine.bands), len(self.index_channel)),
+                                              method=smoothing)
+        self.artifact_detector = ArtifactDetector(fs / decimation, self.index_channel, mains=mains,
+                                                  epoch_length=epoch_length) if artifact_rejection else None
+
+        self.arousal_scaler = utils.DynamicScaler(window_size=SCALER_WINDOW, method=SCALER_METHOD)
+        self.valence_scaler = utils.DynamicScaler(window_size=SCALER_WINDOW, method=SCALER_METHOD)
+        self.valence = None # latest raw metrics
+        self.arousal = None
+
+    @property
+    def chunk_size(self):
+        """Number of input samples pulled per iteration, one epoch shift"""
+        return int(self.shift_length * self.fs)
+
+    def fill(self, inlet):
+        """Blocks until the EEG buffer is fully populated from the inlet"""
+        logger.info("Reading your brain waves until buffer and scalers are ready.")
+        utils.populate_initial_buffer(inlet, self.eeg_buffer, self.shift_length, self.fs, self.index_channel)
+        if self.artifact_detector is not None:
+            self.artifact_detector.update(self.eeg_buffer.last_epoch(self.band_engine.n_samples))
+
+    def reset_stream(self):
+        """
+        Restarts the EEG buffer after a gap in the input: the samples that follow do not continue the
+        buffered ones, joining them would put a step into the filters and the next epochs.
+        `push` returns None until the buffer is full again, the band buffer and scalers are kept.
+        """
+        self.eeg_buffer.reset()
+        if self.sliding_engine is not None:
+            self.sliding_engine.dft = None  # resynced from the refilled buffer
+        if self.artifact_detector is not None:
+            self.artifact_detector.reset()
+
+    def push(self, eeg_data):
+        """
+        Processes a chunk of raw samples.
+        :param eeg_data: Samples of shape (samples, all channels) as pulled from the inlet.
+        :return: (scaled_valence, scaled_arousal), or None while the buffers and scalers are filling up.
+        """
+        ch_data = np.asarray(eeg_data, dtype=float)[:, self.index_channel]
+        was_full = self.eeg_buffer.full
+        with latency.stage("filter"):
+            n_new = self.eeg_buffer.append(ch_data)  # notch filtered (and decimated) and written in place
+        if self.artifact_detector is not None and n_new:
+            with latency.stage("artifacts"):
+                self.artifact_detector.update(self.eeg_buffer.last_epoch(min(n_new, self.eeg_buffer.capacity)))
+        if not was_full:
+            return None  # still populating the initial buffer
+
+        # FFT on one epoch across all channels
+        with latency.stage("fft"):
+            if self.sliding_engine is not None:
+                band_powers = self.sliding_engine.update(n_new)  # Shape: (bands, channels)
+            else:
+                data_epoch = self.eeg_buffer.last_epoch(self.band_engine.n_samples)
+                band_powers = self.band_engine.compute(data_epoch)  # Shape: (bands, channels)
+
+        if self.artifact_detector is not None:
+            band_powers = self.artifact_detector.clean(band_powers)  # flags of the chunks covering the epoch
+            if band_powers is None:
+                return None  # artifacted epoch, kept out of the band buffer and scalers
+
+        # Aggregate across band buffer
+        with latency.stage("smoothing"):
+            smooth_band_powers = self.band_buffer.update(band_powers)  # Shape: (bands, channels)
+        if smooth_band_powers is None:
+            return None # wait until there enough samples in the buffer
+        self.valence, self.arousal = self._metrics(smooth_band_powers)
+        with latency.stage("scaling"):
+            return self._scale(self.valence, self.arousal)
+
+    def _metrics(self, smooth_band_powers):
+        return compute_metrics(smooth_band_powers, self.valence_source, self.asymmetry_pairs)
+
+    def _scale(self, valence, arousal):
+        if np.isnan(valence) or np.isnan(arousal):
+            return None  # every channel was flagged over the whole band buffer
+        # TODO: clamp the raw metrics to a wide range
+        self.arousal_scaler.update(arousal)
+        self.valence_scaler.update(valence)
+
+        if not self.arousal_scaler.ready or not self.valence_scaler.ready:
+            return None  # Wait for enough samples for scaling
+
+        return self.valence_scaler.scale(valence), self.arousal_scaler.scale(arousal)
+
+    def run_offline(self, samples):
+        """
+        Batch version of `push` over a whole recording, as fast as the CPU allows.
+        The recording is filtered in a single call, epoched with strided views and transformed
+        block by block. Epochs end every shift once the buffer is full, as in the live loop.
+        The scalers are shared with `push`, use a fresh pipeline per recording.
+        :param samples: Raw samples of shape (samples, all channels).
+        :return: Dict of arrays: epoch_end (input sample index), valence, arousal,
+            scaled_valence, scaled_arousal (NaN while the scalers are filling up).
+        """
+        ch_data = np.asarray(samples, dtype=float)[:, self.index_channel]
+        decimator = utils.PolyphaseDecimator(self.decimation, self.fs) if self.decimation > 1 else None
+        full_buffer = utils.EEGRingBuffer(len(ch_data), len(self.index_channel), notch=True, decimator=decimator,
+                                          fs=self.fs, mains=self.mains, highpass=self.highpass)
+        n_filtered = full_buffer.append(ch_data)
+        filtered = full_buffer.data[:n_filtered]
+
+        fs = self.fs / self.decimation
+        epoch_samples = self.band_engine.n_samples
+        shift_samples = int(self.shift_length * fs)
+        first_end = self.eeg_buffer.capacity + shift_samples
+        if n_filtered < first_end:
+            raise ValueError(f"Recording too short: {len(ch_data)} samples, needs at least {int(first_end * self.decimation)}")
+        epochs = utils.epoch(filtered[first_end - epoch_samples:], epoch_samples, epoch_samples - shift_samples)
+
+        n_epochs = epochs.shape[-1]
+        band_powers = np.empty((len(self.band_engine.bands), len(self.index_channel), n_epochs))
+        for start in range(0, n_epochs, OFFLINE_BLOCK_EPOCHS):
+            block = slice(start, start + OFFLINE_BLOCK_EPOCHS)
+            band_powers[..., block] = self.band_engine.compute(epochs[..., block])
+        epoch_end = first_end + shift_samples * np.arange(n_epochs)
+
+        if self.artifact_detector is not None:
+            # The chunks of the live loop, one per shift with the end of the previous one as context,
+            # epoch i is covered by chunks i .. i + chunks_per_epoch - 1
+            chunks_per_epoch = -(-epoch_samples // shift_samples)
+            start = first_end - chunks_per_epoch * shift_samples
+            context = min(self.artifact_detector.context, start)
+            chunks = utils.epoch(filtered[start - context:epoch_end[-1]], shift_samples + context, context)
+            kept = self.artifact_detector.clean_batch(chunks, band_powers, chunks_per_epoch, context)
+            # Rejected epochs never enter the band buffer, the moving average skips them
+            band_powers, epoch_end = band_powers[..., kept], epoch_end[kept]
+
+        n_smooth = self.band_buffer.length
+        if self.band_buffer.method == "mean":
+            # Moving average over the last band_buffer_length epochs, same as the band buffer
+            # (channels flagged by the artifact detector are NaN and left out)
+            missing = np.isnan(band_powers)
+            cumulative = np.cumsum(np.where(missing, 0, band_powers), axis=-1)
+            n_valid = np.cumsum(~missing, axis=-1)
+            for running in (cumulative, n_valid):
+                running[..., n_smooth:] = running[..., n_smooth:] - running[..., :-n_smooth]
+            with np.errstate(invalid="ignore"):
+                smooth_band_powers = np.where(n_valid > 0, cumulative, np.nan)[..., n_smooth - 1:] / n_valid[..., n_smooth - 1:]
+        else:
+            smoothed = [self.band_buffer.update(band_powers[..., i]) for i in range(band_powers.shape[-1])]
+            smooth_band_powers = np.stack(smoothed[n_smooth - 1:], axis=-1) if len(smoothed) >= n_smooth \
+                else np.empty(band_powers.shape[:-1] + (0,))
+        valence, arousal = self._metrics(smooth_band_powers)
+
+        scaled = np.full((len(valence), 2), np.nan)
+        for i, (v, a) in enumerate(zip(valence, arousal)):
+            metrics = self._scale(v, a)
+            if metrics is not None:
+                scaled[i] = metrics
+        if len(valence):
+            self.valence, self.arousal = valence[-1], arousal[-1]
+
+        return {
+            "epoch_end": epoch_end[n_smooth - 1:] * self.decimation,
+            "valence": valence,
+            "arousal": arousal,
+            "scaled_valence": scaled[:, 0],
+            "scaled_arousal": scaled[:, 1],
+        }
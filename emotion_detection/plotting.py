@@ -0,0 +1,189 @@
+"""
+Non-blocking live plot of the metrics.
+
+The loop publishes values into a ring buffer in shared memory, which costs a row write and a
+counter increment, no lock and no drawing. A separate process reads the buffer and redraws
+at a capped frame rate with blitting: the axes, grid and legend are rendered once, and each
+frame only restores that background and draws the lines and labels. The axes are rescaled
+(one full redraw) only when a value leaves the current limits.
+"""
+
+import logging
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Frames per second of the plotting process
+PLOT_FPS = 20
+
+# Number of values shown per series
+PLOT_POINTS = 100
+
+# Header slots (int64) in front of the samples
+_COUNT, _STOP, _FRAMES, _HEADER = 0, 1, 2, 3
+
+
+class SharedSeries:
+    """
+    Single-writer ring buffer of rows of `n_series` floats in shared memory.
+    The writer stores a row and then bumps the counter, readers never block the writer; a reader
+    racing the writer may see the oldest rows already overwritten, which is fine for plotting.
+    """
+    def __init__(self, n_series, capacity=PLOT_POINTS, name=None):
+        """
+        :param n_series: Number of values per row.
+        :param capacity: Number of rows kept.
+        :param name: Name of an existing buffer to attach to, a new one is created by default.
+        """
+        self.n_series = n_series
+        self.capacity = capacity
+        size = 8 * (_HEADER + capacity * n_series)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.header = np.ndarray((_HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        self.data = np.ndarray((capacity, n_series), dtype=np.float64, buffer=self.shm.buf, offset=8 * _HEADER)
+        if self.owner:
+            self.header[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def count(self):
+        """Number of rows published so far"""
+        return int(self.header[_COUNT])
+
+    def publish(self, *values):
+        count = self.header[_COUNT]
+        self.data[count % self.capacity] = values
+        self.header[_COUNT] = count + 1
+
+    def snapshot(self):
+        """Copy of the rows currently held, oldest first, shape (rows, n_series)"""
+        count = self.count
+        n = min(count, self.capacity)
+        return self.data[np.arange(count - n, count) % self.capacity]
+
+    def close(self):
+        # Views must be released before the buffer is closed
+        del self.header, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class LivePlotter:
+    """Plots published metrics from a separate process, see module docstring"""
+    def __init__(self, figures=(("Scaled", ("Valence", "Arousal")), ("Not Scaled", ("Valence", "Arousal"))),
+                 points=PLOT_POINTS, fps=PLOT_FPS, backend=None):
+        """
+        :param figures: Sequence of (title, series labels), one figure each. Values are published
+            in the same order, e.g. scaled valence, scaled arousal, raw valence, raw arousal.
+        :param points: Number of values shown per series.
+        :param fps: Maximum number of frames per second.
+        :param backend: Matplotlib backend of the plotting process, default backend if None.
+        """
+        self.figures = [(title, tuple(labels)) for title, labels in figures]
+        self.series = SharedSeries(sum(len(labels) for _, labels in self.figures), points)
+        self.fps = fps
+        self.backend = backend
+        self.process = None
+
+    def publish(self, *values):
+        """Hot-loop side: a memory write, never blocks on drawing"""
+        self.series.publish(*values)
+
+    @property
+    def frames(self):
+        """Number of frames rendered so far"""
+        return int(self.series.header[_FRAMES])
+
+    def start(self):
+        self.process = multiprocessing.Process(
+            target=_render, args=(self.series.name, self.series.n_series, self.series.capacity,
+                                  self.figures, self.fps, self.backend),
+            name="live-plot", daemon=True)
+        self.process.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self.series.header[_STOP] = 1
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        self.series.close()
+
+
+def _render(name, n_series, capacity, figures, fps, backend):
+    """Plotting process: draws the shared series at `fps` frames per second with blitting"""
+    import matplotlib
+    if backend:
+        matplotlib.use(backend)
+    import matplotlib.pyplot as plt
+
+    series = SharedSeries(n_series, capacity, name=name)
+    plots = []
+    column = 0
+    for title, labels in figures:
+        fig, ax = plt.subplots(figsize=(8, 4))
+        fig.suptitle(title)
+        ax.set_xlim(0, capacity - 1)
+        ax.set_ylim(0, 1)
+        ax.grid(True)
+        lines = [ax.plot([], [], label=label, animated=True)[0] for label in labels]
+        ax.legend()
+        texts = [ax.text(0.02, 0.02 + 0.08 * i, '', transform=ax.transAxes, fontsize=10,
+                         color=line.get_color(), animated=True) for i, line in enumerate(lines)]
+        plots.append({"fig": fig, "ax": ax, "lines": lines, "texts": texts,
+                      "columns": list(range(column, column + len(labels))), "background": None})
+        column += len(labels)
+    plt.show(block=False)
+
+    interval = 1 / fps
+    last_count = -1
+    try:
+        while not series.header[_STOP]:
+            start = time.perf_counter()
+            count = series.count
+            if count != last_count:
+                last_count = count
+                data = series.snapshot()
+                for plot in plots:
+                    _draw(plot, data)
+                series.header[_FRAMES] += 1
+            for plot in plots:
+                plot["fig"].canvas.flush_events()
+            time.sleep(max(interval - (time.perf_counter() - start), 0))
+    finally:
+        plt.close("all")
+        series.close()
+
+
+def _draw(plot, data):
+    fig, ax = plot["fig"], plot["ax"]
+    values = data[:, plot["columns"]]
+    finite = values[np.isfinite(values)]
+    low, high = ax.get_ylim()
+    if len(finite) and (finite.min() < low or finite.max() > high):
+        margin = 0.1 * max(finite.max() - finite.min(), 1e-6)
+        ax.set_ylim(min(low, finite.min() - margin), max(high, finite.max() + margin))
+        plot["background"] = None  # limits changed, the background is redrawn
+    if plot["background"] is None:
+        fig.canvas.draw()
+        plot["background"] = fig.canvas.copy_from_bbox(fig.bbox)
+
+    fig.canvas.restore_region(plot["background"])
+    x = np.arange(len(values))
+    for i, (line, text) in enumerate(zip(plot["lines"], plot["texts"])):
+        line.set_data(x, values[:, i])
+        if len(values):
+            text.set_text(f"{line.get_label()[0]}: {values[-1, i]:.2f}")
+        ax.draw_artist(line)
+        ax.draw_artist(text)
+    fig.canvas.blit(fig.bbox)
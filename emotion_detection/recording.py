@@ -0,0 +1,251 @@
+"""
+Compact, memory-mapped EEG session format.
+
+A session is a directory holding:
+- samples.f32: float32 sample matrix [n_samples, n_channels], C order
+- timestamps.f64: float64 LSL timestamps [n_samples]
+- index.f64: coarse time index, the timestamp of every `index_stride`-th sample
+- meta.json: channel names, sampling frequency, index stride and sample count
+
+Files are append-only, so a session stays readable if the recorder dies (the sample
+count is derived from the file sizes). Timestamps are assumed to be non-decreasing,
+LSL jitter only shifts a seek by a few samples.
+
+Usage:
+    python -m emotion_detection.recording convert recording.csv recording.eegsession
+"""
+
+import argparse
+import json
+import logging
+import queue
+import threading
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Channel layout of the muse-lsl CSV recordings
+EEG_CHANNELS = ["TP9", "AF7", "AF8", "TP10", "Right AUX"]
+
+# Sampling frequency of the muse-lsl CSV recordings, which do not store it (Muse 2016)
+CSV_FS = 256
+
+SAMPLES_FILE = "samples.f32"
+TIMESTAMPS_FILE = "timestamps.f64"
+INDEX_FILE = "index.f64"
+META_FILE = "meta.json"
+INDEX_STRIDE = 1024
+
+
+class SessionWriter:
+    """Appends chunks of samples to a session directory (synchronous, see SessionRecorder)"""
+    def __init__(self, path, channels=EEG_CHANNELS, fs=256, index_stride=INDEX_STRIDE):
+        """
+        :param path: Session directory, created if needed. Existing session files are overwritten.
+        :param channels: Channel names, one per column of the samples.
+        :param fs: Nominal sampling frequency.
+        :param index_stride: Number of samples between two entries of the coarse time index.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.channels = list(channels)
+        self.fs = fs
+        self.index_stride = index_stride
+        self.n_samples = 0
+        self._samples = open(self.path / SAMPLES_FILE, "wb")
+        self._timestamps = open(self.path / TIMESTAMPS_FILE, "wb")
+        self._index = open(self.path / INDEX_FILE, "wb")
+        self._write_meta()
+
+    def write(self, samples, timestamps):
+        """
+        Appends a chunk.
+        :param samples: Array of shape (samples, channels).
+        :param timestamps: Array of shape (samples,).
+        """
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1, len(self.channels))
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if len(samples) != len(timestamps):
+            raise ValueError(f"Got {len(samples)} samples but {len(timestamps)} timestamps")
+        samples.tofile(self._samples)
+        timestamps.tofile(self._timestamps)
+        # Index entries falling inside this chunk
+        first = -self.n_samples % self.index_stride
+        timestamps[first::self.index_stride].tofile(self._index)
+        self.n_samples += len(samples)
+
+    def flush(self):
+        for f in (self._samples, self._timestamps, self._index):
+            f.flush()
+
+    def close(self):
+        for f in (self._samples, self._timestamps, self._index):
+            f.close()
+        self._write_meta()
+        logger.info("Wrote %d samples to %s", self.n_samples, self.path)
+
+    def _write_meta(self):
+        meta = {"version": 1, "channels": self.channels, "fs": self.fs,
+                "index_stride": self.index_stride, "n_samples": self.n_samples}
+        (self.path / META_FILE).write_text(json.dumps(meta, indent=2))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SessionRecorder:
+    """
+    Records chunks through a background writer thread, so `record` never blocks
+    the acquisition loop on disk I/O.
+    """
+    def __init__(self, path, channels=EEG_CHANNELS, fs=256, index_stride=INDEX_STRIDE):
+        self.writer = SessionWriter(path, channels, fs, index_stride)
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="session-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, samples, timestamps):
+        """Queues a chunk of samples (samples, channels) and their timestamps for writing"""
+        self._queue.put((samples, timestamps))
+
+    def close(self):
+        """Writes the pending chunks and closes the session"""
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self.writer.write(*item)
+            except Exception:
+                logger.exception("Failed to write chunk to %s", self.writer.path)
+            if self._queue.empty():
+                self.writer.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordingInlet:
+    """Wraps an LSL inlet and records every pulled chunk, including the ones used to fill the buffers"""
+    def __init__(self, inlet, recorder):
+        self.inlet = inlet
+        self.recorder = recorder
+
+    def pull_chunk(self, timeout=0.0, max_samples=1024):
+        samples, timestamps = self.inlet.pull_chunk(timeout=timeout, max_samples=max_samples)
+        if timestamps:
+            self.recorder.record(samples, timestamps)
+        return samples, timestamps
+
+    def __getattr__(self, name):
+        return getattr(self.inlet, name)
+
+
+class Session:
+    """Read-only, memory-mapped view of a recorded session"""
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = json.loads((self.path / META_FILE).read_text())
+        self.channels = meta["channels"]
+        self.fs = meta["fs"]
+        self.index_stride = meta["index_stride"]
+        n_channels = len(self.channels)
+
+        # The sample count comes from the file sizes, meta.json is only final after close()
+        n_samples = min((self.path / SAMPLES_FILE).stat().st_size // (4 * n_channels),
+                        (self.path / TIMESTAMPS_FILE).stat().st_size // 8)
+        self.samples = _memmap(self.path / SAMPLES_FILE, np.float32, (n_samples, n_channels))
+        self.timestamps = _memmap(self.path / TIMESTAMPS_FILE, np.float64, (n_samples,))
+        n_index = -(-n_samples // self.index_stride)
+        self.index = _memmap(self.path / INDEX_FILE, np.float64, (n_index,))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def seek(self, timestamp):
+        """
+        Index of the first sample recorded at or after `timestamp`, in O(log n):
+        a binary search in the coarse index, then one in a single block of timestamps.
+        """
+        block = max(int(np.searchsorted(self.index, timestamp, side="left")) - 1, 0)
+        start = block * self.index_stride
+        stop = min(start + 2 * self.index_stride, len(self))
+        return start + int(np.searchsorted(self.timestamps[start:stop], timestamp, side="left"))
+
+    def between(self, start_time, end_time):
+        """Samples and timestamps recorded in [start_time, end_time), as memory-mapped views"""
+        start, stop = self.seek(start_time), self.seek(end_time)
+        return self.samples[start:stop], self.timestamps[start:stop]
+
+
+def _memmap(path, dtype, shape):
+    if shape[0] == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+def read_csv(path):
+    """
+    Reads a muse-lsl CSV recording (index, TP9, AF7, AF8, TP10, Right AUX, timestamps).
+    :return: (samples of shape [n_samples, channels], timestamps of shape [n_samples], channel names)
+    """
+    import pandas as pd
+
+    df = pd.read_csv(path, index_col=0, dtype={ch: np.float64 for ch in EEG_CHANNELS})
+    channels = [ch for ch in EEG_CHANNELS if ch in df.columns]
+    return df[channels].to_numpy(), df["timestamps"].to_numpy(), channels
+
+
+def load(path):
+    """
+    Loads a recording from either a session directory or a CSV file.
+    :return: (samples of shape [n_samples, channels], timestamps of shape [n_samples], channel names)
+    """
+    if Path(path).is_dir():
+        session = Session(path)
+        return session.samples, session.timestamps, session.channels
+    return read_csv(path)
+
+
+def load_with_fs(path):
+    """
+    Loads a recording like `load`, with its nominal sampling frequency: the one stored in the meta
+    of a session directory, CSV_FS for a CSV file.
+    :return: (samples, timestamps, channel names, sampling frequency)
+    """
+    if Path(path).is_dir():
+        session = Session(path)
+        return session.samples, session.timestamps, session.channels, session.fs
+    return (*read_csv(path), CSV_FS)
+
+
+def convert_csv(csv_path, session_path, fs=CSV_FS):
+    """Converts a muse-lsl CSV recording into a session directory"""
+    samples, timestamps, channels = read_csv(csv_path)
+    with SessionWriter(session_path, channels, fs) as writer:
+        writer.write(samples, timestamps)
+    return Session(session_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="EEG session recordings")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert = subparsers.add_parser("convert", help="convert a muse-lsl CSV recording to a session directory")
+    convert.add_argument("csv")
+    convert.add_argument("session")
+    convert.add_argument("--fs", type=float, default=256, help="nominal sampling frequency")
+    args = parser.parse_args()
+    convert_csv(args.csv, args.session, fs=args.fs)
@@ -0,0 +1,52 @@
+"""
+High-speed offline replay of recorded EEG sessions through the neurofeedback pipeline.
+
+Usage:
+    python -m emotion_detection.replay emotion_detection/eeg_recording/recording_2024-11-05-14.33.15.csv metrics.csv
+"""
+
+import argparse
+import logging
+import time
+import numpy as np
+import pandas as pd
+from emotion_detection import recording
+from emotion_detection.pipeline import NeuroPipeline
+
+logger = logging.getLogger(__name__)
+
+
+def replay(recording_path, output_path, fs=None, **pipeline_kwargs):
+    """
+    Re-scores a recording and writes the valence/arousal time series to `output_path` (CSV).
+    :param recording_path: Session directory or muse-lsl CSV recording, see `recording.load`.
+    :param output_path: Destination CSV with one row per scored epoch.
+    :param fs: Nominal sampling frequency of the recording, by default the one stored in the
+        session meta, recording.CSV_FS for a CSV recording.
+    :param pipeline_kwargs: Overrides of the NeuroPipeline configuration.
+    :return: DataFrame of the written time series.
+    """
+    samples, timestamps, _, stored_fs = recording.load_with_fs(recording_path)
+    fs = stored_fs if fs is None else fs
+    start = time.perf_counter()
+    result = NeuroPipeline(fs, **pipeline_kwargs).run_offline(samples)
+    elapsed = time.perf_counter() - start
+
+    epoch_end = result.pop("epoch_end")
+    df = pd.DataFrame({"timestamp": timestamps[np.minimum(epoch_end, len(timestamps)) - 1], **result})
+    df.to_csv(output_path, index=False)
+    logger.info("Replayed %.1f s of EEG in %.3f s (%d epochs) to %s",
+                len(samples) / fs, elapsed, len(df), output_path)
+    return df
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Re-score a recorded EEG session offline")
+    parser.add_argument("recording", help="recorded session (directory or muse-lsl CSV)")
+    parser.add_argument("output", help="output CSV for the valence/arousal time series")
+    parser.add_argument("--fs", type=float, default=None,
+                        help=f"nominal sampling frequency, by default from the session meta ({recording.CSV_FS} for a CSV)")
+    parser.add_argument("--decimation", type=int, default=1, help="decimation factor before the FFT")
+    args = parser.parse_args()
+    replay(args.recording, args.output, fs=args.fs, decimation=args.decimation)
@@ -0,0 +1,201 @@
+"""
+Staged runtime of the neurofeedback loop: acquisition, DSP and OSC output run in separate threads.
+
+    acquisition --(bounded chunk queue)--> DSP --(latest-value slot)--> output
+
+The acquisition thread only drains the inlet, so a slow Ableton link (every OSC message sleeps)
+never delays `pull_chunk`. Raw chunks go through a bounded queue that drops the oldest chunk when
+the DSP falls behind, and marks the chunk after the dropped ones: the DSP worker then restarts
+the EEG buffer and filters (`NeuroPipeline.reset_stream`) instead of joining non-adjacent samples.
+Control values go through a single slot where the newest value replaces any value the output
+worker has not sent yet, only the latest metrics matter to the music.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from emotion_detection import latency
+
+logger = logging.getLogger(__name__)
+
+# Raw chunks waiting for the DSP worker, about 16 s of EEG with the default 0.5 s shift
+CHUNK_QUEUE_SIZE = 32
+
+
+class DropOldestQueue:
+    """
+    Bounded FIFO that makes room for new items by discarding the oldest ones. `get` tells whether
+    items were dropped right before the one it returns, i.e. whether it follows the previous one.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._gap = False  # items were dropped in front of the oldest item
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+                self._gap = True
+            self._items.append(item)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Returns (oldest item, whether items were dropped just before it), raises queue.Empty after
+        `timeout` seconds.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items, timeout):
+                raise queue.Empty
+            gap, self._gap = self._gap, False
+            return self._items.popleft(), gap
+
+    def qsize(self):
+        return len(self._items)
+
+
+class LatestValue:
+    """Single-slot mailbox: `put` overwrites a value that has not been taken yet"""
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._value = None
+        self._pending = False
+        self.dropped = 0  # values overwritten before being taken
+
+    def put(self, value):
+        with self._condition:
+            if self._pending:
+                self.dropped += 1
+            self._value = value
+            self._pending = True
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """Returns the latest value, or None if none arrived within `timeout` seconds"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._pending, timeout):
+                return None
+            self._pending = False
+            return self._value
+
+    def qsize(self):
+        return int(self._pending)
+
+
+class NeuroRuntime:
+    """Runs an inlet, a NeuroPipeline and an AbletonMetaController in three worker threads"""
+    def __init__(self, inlet, pipeline, controller, chunk_queue_size=CHUNK_QUEUE_SIZE, timeout=1.0, time_correction=0.0,
+                 plotter=None):
+        """
+        :param inlet: LSL inlet (or stand-in) to read the EEG from.
+        :param pipeline: NeuroPipeline, already filled (see `NeuroPipeline.fill`).
+        :param controller: Receives the scaled metrics through `update_metrics`.
+        :param chunk_queue_size: Capacity of the raw chunk queue.
+        :param timeout: Seconds a worker waits for input before checking for shutdown.
+        :param time_correction: Offset (inlet.time_correction()) from the LSL timestamps to the local clock.
+        :param plotter: Optional plotting.LivePlotter receiving the scaled and raw metrics of each epoch.
+        """
+        self.inlet = inlet
+        self.pipeline = pipeline
+        self.controller = controller
+        self.timeout = timeout
+        self.time_correction = time_correction
+        self.plotter = plotter
+        self.chunks = DropOldestQueue(chunk_queue_size)
+        self.metrics = LatestValue()
+        self.counts = {"acquired": 0, "processed": 0, "scored": 0, "sent": 0, "errors": 0, "gaps": 0}
+        self._stop = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._guard, args=(self._acquire,), name="acquisition", daemon=True),
+            threading.Thread(target=self._guard, args=(self._process,), name="dsp", daemon=True),
+            threading.Thread(target=self._guard, args=(self._output,), name="output", daemon=True),
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        logger.info("Started the acquisition, DSP and output workers")
+        return self
+
+    def stop(self, timeout=None):
+        """Signals the workers to stop and waits for them, each finishes its current step"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout if timeout is not None else 2 * self.timeout)
+        logger.info("Stopped the workers: %s", self.stats())
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
+
+    def stats(self):
+        """Counters of each stage, the drops of the chunk queue and metrics slot, and their depth"""
+        return dict(self.counts,
+                    chunks_dropped=self.chunks.dropped, chunk_queue_depth=self.chunks.qsize(),
+                    metrics_dropped=self.metrics.dropped, metrics_pending=self.metrics.qsize())
+
+    def _guard(self, step):
+        """Runs a worker step until shutdown, logging (and counting) its failures"""
+        while not self._stop.is_set():
+            try:
+                step()
+            except Exception:
+                self.counts["errors"] += 1
+                logger.exception("Error in the %s worker", threading.current_thread().name)
+
+    def _acquire(self):
+        with latency.stage("pull"):
+            eeg_data, timestamps = self.inlet.pull_chunk(timeout=self.timeout, max_samples=self.pipeline.chunk_size)
+        if not eeg_data:
+            return
+        timestamp = timestamps[-1] + self.time_correction  # newest sample, on the local clock
+        latency.age("acquired", timestamp)
+        self.chunks.put((eeg_data, timestamp))
+        self.counts["acquired"] += 1
+
+    def _process(self):
+        try:
+            (eeg_data, timestamp), gap = self.chunks.get(timeout=self.timeout)
+        except queue.Empty:
+            return
+        if gap:
+            # Chunks were dropped in between, the EEG buffer is filled again from this one
+            logger.warning("DSP fell behind, %d raw chunks dropped so far, restarting the EEG buffer", self.chunks.dropped)
+            self.pipeline.reset_stream()
+            self.counts["gaps"] += 1
+        metrics = self.pipeline.push(eeg_data)
+        self.counts["processed"] += 1
+        if metrics is None:
+            return  # Wait for enough samples for smoothing and scaling
+        latency.age("scored", timestamp)
+        self.metrics.put((metrics, timestamp))
+        if self.plotter is not None:
+            self.plotter.publish(*metrics, self.pipeline.valence, self.pipeline.arousal)
+        self.counts["scored"] += 1
+
+    def _output(self):
+        item = self.metrics.get(timeout=self.timeout)
+        if item is None:
+            return
+        (scaled_valence, scaled_arousal), timestamp = item
+        self.controller.update_metrics(valence=scaled_valence, arousal=scaled_arousal, timestamp=timestamp)
+        latency.age("metrics_sent", timestamp)
+        self.counts["sent"] += 1
+
+    def run_forever(self, report_interval=10.0):
+        """Starts the workers and logs their stats every `report_interval` seconds until interrupted"""
+        self.start()
+        try:
+            while self.running:
+                time.sleep(report_interval)
+                logger.info("Runtime stats: %s", self.stats())
+                if latency.monitor() is not None:
+                    logger.info("Latency: %s", {name: round(s["p95_ms"], 2) for name, s in latency.monitor().summary().items()})
+        finally:
+            self.stop()
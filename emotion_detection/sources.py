@@ -0,0 +1,258 @@
+"""
+In-process stand-ins for the Muse LSL inlet, for load tests and reproducible measurements
+without a headset.
+
+The sources implement the part of `pylsl.StreamInlet` used by the pipeline
+(`pull_chunk`, `info().nominal_srate()`, `time_correction`). Samples become available in
+chunks, like the packets of a real outlet, either in real time (speed=1), accelerated
+(speed > 1) or unthrottled (speed=None), with optional random delivery jitter.
+
+Usage (local LSL outlet that main_neuro_music.py can resolve):
+    python -m emotion_detection.sources --replay emotion_detection/eeg_recording/recording_2024-11-05-14.33.15.csv
+    python -m emotion_detection.sources --synthetic
+"""
+
+import argparse
+import logging
+import time
+import numpy as np
+from emotion_detection import recording
+
+logger = logging.getLogger(__name__)
+
+# Muse packets carry 12 samples per channel
+MUSE_CHUNK_SIZE = 12
+
+# Amplitudes (µV) of the synthetic EEG bands, (low, high) in Hz
+SYNTHETIC_BANDS = {
+    "delta": ((1, 4), 20.0),
+    "theta": ((4, 8), 10.0),
+    "alpha": ((8, 12), 15.0),
+    "beta": ((12, 30), 5.0),
+}
+
+
+class StreamInfo:
+    """Subset of `pylsl.StreamInfo` used by the pipeline"""
+    def __init__(self, name, fs, channels):
+        self._name = name
+        self._fs = fs
+        self._channels = list(channels)
+
+    def name(self):
+        return self._name
+
+    def type(self):
+        return "EEG"
+
+    def nominal_srate(self):
+        return self._fs
+
+    def channel_count(self):
+        return len(self._channels)
+
+    def channel_names(self):
+        return self._channels
+
+    def desc(self):
+        return None
+
+
+class SimulatedInlet:
+    """
+    Base class of the stand-in sources. Subclasses implement `_read(start, n)` returning
+    samples [start, start + n) of shape (n, channels).
+    """
+    def __init__(self, fs, channels, chunk_size=MUSE_CHUNK_SIZE, speed=1.0, jitter=0.0, seed=None, clock=time.monotonic):
+        """
+        :param fs: Nominal sampling frequency.
+        :param channels: Channel names.
+        :param chunk_size: Number of samples delivered together, like an outlet packet.
+        :param speed: Playback speed relative to real time, None delivers samples as fast as they are pulled.
+        :param jitter: Maximum random delay (seconds) added to the delivery of each chunk.
+        :param seed: Seed of the jitter (and synthetic signal) generator.
+        :param clock: Clock used for pacing and timestamps.
+        """
+        self.fs = fs
+        self.channels = list(channels)
+        self.chunk_size = chunk_size
+        self.speed = speed
+        self.jitter = jitter
+        self.clock = clock
+        self.rng = np.random.default_rng(seed)
+        self._info = StreamInfo(type(self).__name__, fs, self.channels)
+        self._start = None
+        self._pulled = 0  # samples handed out so far
+        self._arrived = 0  # samples delivered by the simulated outlet so far
+        self._next_arrival = None  # arrival time of the next chunk, relative to start
+
+    def info(self):
+        return self._info
+
+    def time_correction(self, timeout=None):
+        return 0.0  # samples are timestamped with the local clock
+
+    def pull_chunk(self, timeout=0.0, max_samples=1024):
+        """
+        Returns the samples delivered since the last pull, waiting up to `timeout` seconds
+        for the next chunk if none is pending.
+        :return: (samples as a list of lists, timestamps as a list), like pylsl.
+        """
+        if self._start is None:
+            self._start = self.clock()
+            if self.speed is not None:
+                self._next_arrival = self._arrival_delay(self.chunk_size)
+
+        deadline = self.clock() + (timeout or 0.0)
+        if self.exhausted:
+            # Like an idle LSL inlet, wait out the timeout instead of letting the caller spin
+            time.sleep(max(deadline - self.clock(), 0.0))
+            return [], []
+        if self.speed is None:
+            n = self._available(max_samples)
+        else:
+            self._deliver()
+            while self._arrived == self._pulled:
+                now = self.clock()
+                if now >= deadline:
+                    break
+                time.sleep(max(min(deadline, self._start + self._next_arrival) - now, 0.0))
+                self._deliver()
+            n = self._available(min(max_samples, self._arrived - self._pulled))
+        if n == 0:
+            return [], []
+
+        samples = self._read(self._pulled, n)
+        timestamps = self._timestamps(self._pulled, n)
+        self._pulled += n
+        return samples.tolist(), timestamps.tolist()
+
+    def _deliver(self):
+        """Moves every chunk whose arrival time has passed to the delivered samples"""
+        elapsed = self.clock() - self._start
+        while self._next_arrival <= elapsed:
+            self._arrived += self.chunk_size
+            self._next_arrival = max(self._next_arrival, self._arrival_delay(self._arrived + self.chunk_size))
+
+    def _arrival_delay(self, n_samples):
+        """Wall-clock delay after which the first `n_samples` have been delivered"""
+        delay = n_samples / (self.fs * self.speed)
+        if self.jitter:
+            delay += self.rng.uniform(0, self.jitter)
+        return delay
+
+    def _timestamps(self, start, n):
+        index = np.arange(start, start + n)
+        if self.speed is None:
+            return np.full(n, self.clock())
+        return self._start + index / (self.fs * self.speed)
+
+    @property
+    def exhausted(self):
+        """Whether the source ran dry, no sample will ever be delivered again"""
+        return False
+
+    def _available(self, n):
+        return n
+
+    def _read(self, start, n):
+        raise NotImplementedError
+
+
+class ReplayInlet(SimulatedInlet):
+    """Replays a recorded session (session directory or muse-lsl CSV)"""
+    def __init__(self, path, fs=None, loop=True, **kwargs):
+        """
+        :param path: Recording to replay, see `recording.load`.
+        :param fs: Nominal sampling frequency of the recording, by default the one stored in the
+            session meta, recording.CSV_FS for a CSV recording.
+        :param loop: Start over at the end of the recording, otherwise the source runs dry.
+        """
+        samples, _, channels, stored_fs = recording.load_with_fs(path)
+        super().__init__(stored_fs if fs is None else fs, channels, **kwargs)
+        self.samples = np.asarray(samples, dtype=float)
+        self.loop = loop
+
+    @property
+    def exhausted(self):
+        return not self.loop and self._pulled >= len(self.samples)
+
+    def _available(self, n):
+        if self.loop:
+            return n
+        return max(min(n, len(self.samples) - self._pulled), 0)
+
+    def _read(self, start, n):
+        index = np.arange(start, start + n) % len(self.samples)
+        return self.samples[index]
+
+
+class SyntheticInlet(SimulatedInlet):
+    """
+    Synthesizes band-limited EEG: per band a sum of sinusoids at random frequencies and
+    phases, with slowly modulated amplitudes so that the metrics move, plus white noise.
+    """
+    def __init__(self, fs=256, channels=recording.EEG_CHANNELS, bands=SYNTHETIC_BANDS, components=8,
+                 noise=5.0, modulation_period=30.0, **kwargs):
+        """
+        :param bands: Mapping name -> ((low, high) Hz, amplitude µV).
+        :param components: Number of sinusoids per band and channel.
+        :param noise: Standard deviation of the white noise (µV).
+        :param modulation_period: Period (seconds) of the band amplitude modulation, None for constant amplitudes.
+        """
+        super().__init__(fs, channels, **kwargs)
+        n_channels = len(self.channels)
+        freqs, amplitudes = [], []
+        for (low, high), amplitude in bands.values():
+            freqs.append(self.rng.uniform(low, high, size=(components, n_channels)))
+            amplitudes.append(np.full((components, n_channels), amplitude / np.sqrt(components)))
+        self.freqs = np.stack(freqs)  # (bands, components, channels)
+        self.amplitudes = np.stack(amplitudes)
+        self.phases = self.rng.uniform(0, 2 * np.pi, size=self.freqs.shape)
+        self.modulation_phases = self.rng.uniform(0, 2 * np.pi, size=(len(bands), 1, 1))
+        self.modulation_period = modulation_period
+        self.noise = noise
+
+    def _read(self, start, n):
+        t = (np.arange(start, start + n) / self.fs)[:, None, None, None]  # (n, 1, 1, 1)
+        amplitudes = self.amplitudes
+        if self.modulation_period:
+            amplitudes = amplitudes * (1 + 0.5 * np.sin(2 * np.pi * t / self.modulation_period + self.modulation_phases))
+        signal = (amplitudes * np.sin(2 * np.pi * self.freqs * t + self.phases)).sum(axis=(1, 2))
+        return signal + self.rng.normal(scale=self.noise, size=signal.shape)
+
+
+def serve(source, name="SimulatedEEG"):
+    """Publishes a stand-in source as a local LSL outlet until interrupted"""
+    from pylsl import StreamInfo as LSLStreamInfo, StreamOutlet
+
+    info = LSLStreamInfo(name, "EEG", len(source.channels), source.fs, "float32", name)
+    outlet = StreamOutlet(info, chunk_size=source.chunk_size)
+    logger.info("Serving %s as LSL stream %s at %d Hz", type(source).__name__, name, source.fs)
+    while True:
+        samples, _ = source.pull_chunk(timeout=1.0)
+        if samples:
+            outlet.push_chunk(samples)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Local stand-in EEG stream")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--replay", help="recording to replay (session directory or muse-lsl CSV)")
+    group.add_argument("--synthetic", action="store_true", help="synthesize band-limited EEG")
+    parser.add_argument("--fs", type=float, default=None,
+                        help="sampling frequency, by default 256 Hz for --synthetic and the recorded one for --replay")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed relative to real time")
+    parser.add_argument("--chunk-size", type=int, default=MUSE_CHUNK_SIZE, help="samples per chunk")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum delivery jitter per chunk (seconds)")
+    args = parser.parse_args()
+
+    options = dict(speed=args.speed, chunk_size=args.chunk_size, jitter=args.jitter)
+    if args.fs is not None:
+        options["fs"] = args.fs
+    source = ReplayInlet(args.replay, **options) if args.replay else SyntheticInlet(**options)
+    try:
+        serve(source)
+    except KeyboardInterrupt:
+        logger.info("Stopping the stand-in stream")
@@ -8,46 +8,100 @@ epoching, and transforming EEG data into frequency bands
 @author: Cassani
 """
 
+import importlib
 import logging
+import threading
+import warnings
+from bisect import bisect_left, insort
 from collections import deque
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.signal import butter, lfilter, lfilter_zi
+from functools import lru_cache
 
 
 logger = logging.getLogger(__name__)
 
 
 class DynamicScaler:
-    def __init__(self, window_size=50, target_range=(0, 1)):
+    METHODS = ("minmax", "percentile", "decay")
+
+    def __init__(self, window_size=50, target_range=(0, 1), method="minmax", percentiles=(5, 95)):
         """
         Initialize the scaler with a rolling window to track recent values.
         :param window_size: Number of recent values to consider for scaling.
         :param target_range: The range to scale values into.
+        :param method: How the scaling bounds are tracked:
+            "minmax": min and max of the window, amortized O(1) with monotonic deques.
+            "percentile": low and high percentiles of the window, robust to EEG spikes (O(log n) search plus a memmove).
+            "decay": min and max envelopes decaying towards new values with a time constant of window_size updates, O(1).
+        :param percentiles: (low, high) percentiles used by the "percentile" method.
         """
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown scaling method {method}, expected one of {self.METHODS}")
         logger.debug("Scaler initialized with history of %d and target range of %s", window_size, target_range)
         self.window_size = window_size
         self.target_range = target_range
-        self.values = []  # List to store the rolling window of values.
+        self.method = method
+        self.percentiles = percentiles
+        self.values = deque(maxlen=window_size)  # Rolling window of values.
         self.ready = False  # Flag to indicate if the scaler is ready.
+        self.count = 0  # Number of values seen so far.
+        # Monotonic deques of (index, value): the front holds the min / max of the window
+        self._min_deque = deque()
+        self._max_deque = deque()
+        self._sorted = []  # Sorted window for the percentile method.
+        self._low = self._high = None  # Envelopes for the decay method.
 
     def update(self, value):
         """
         Update the rolling window with a new value.
         :param value: The latest metric to be added to the window.
         """
-        self.values.append(value)
-        if len(self.values) > self.window_size:
-            self.values.pop(0)  # Remove oldest value to maintain window size.
+        oldest = self.values[0] if len(self.values) == self.window_size else None
+        self.values.append(value)  # The deque drops the oldest value to maintain window size.
+        index = self.count
+        self.count += 1
+
+        if self.method == "minmax":
+            while self._min_deque and self._min_deque[-1][1] >= value:
+                self._min_deque.pop()
+            self._min_deque.append((index, value))
+            while self._max_deque and self._max_deque[-1][1] <= value:
+                self._max_deque.pop()
+            self._max_deque.append((index, value))
+            # Evict values that left the window
+            if self._min_deque[0][0] <= index - self.window_size:
+                self._min_deque.popleft()
+            if self._max_deque[0][0] <= index - self.window_size:
+                self._max_deque.popleft()
+        elif self.method == "percentile":
+            if oldest is not None:
+                del self._sorted[bisect_left(self._sorted, oldest)]
+            insort(self._sorted, value)
+        else:
+            if self._low is None:
+                self._low = self._high = value
+            alpha = 1 / self.window_size
+            self._low = min(value, self._low + alpha * (value - self._low))
+            self._high = max(value, self._high + alpha * (value - self._high))
 
         # Set the scaler as ready once the window is fully populated.
-        if not self.ready and len(self.values) == self.window_size:
+        if not self.ready and self.count >= self.window_size:
             logger.debug("Scaler is ready")
             self.ready = True
 
+    def bounds(self):
+        """Returns the (low, high) values mapped to the ends of the target range"""
+        if self.method == "minmax":
+            return self._min_deque[0][1], self._max_deque[0][1]
+        if self.method == "percentile":
+            last = len(self._sorted) - 1
+            low, high = self.percentiles
+            return self._sorted[round(low / 100 * last)], self._sorted[round(high / 100 * last)]
+        return self._low, self._high
+
     def scale(self, value):
         """
-        Scale a value based on the current min and max of the rolling window.
+        Scale a value based on the current bounds of the rolling window (min and max by default).
         Clamps the scaled value to the target range.
         :param value: The value to scale.
         :return: Scaled value within the target range.
@@ -55,8 +109,7 @@ class DynamicScaler:
         if not self.ready:
             raise ValueError("Scaler is not ready yet, window is not full.")
         
-        min_val = min(self.values)
-        max_val = max(self.values)
+        min_val, max_val = self.bounds()
         
         if max_val == min_val:
             logger.warning("Division by zero avoided in scaling.")
@@ -73,6 +126,123 @@ class DynamicScaler:
         
         return round(clamped_result, 2)
 
+SMOOTHING_METHODS = ("mean", "ema", "median")
+
+class BandSmoother:
+    """
+    Smooths successive band power arrays over the last `length` epochs.
+    "mean" is an exact moving average kept as a running sum over a circular history, "ema" an
+    exponential moving average, both cost O(1) per epoch whatever the length. "median" is
+    robust to outlier epochs but sorts the history, O(length) per epoch.
+    NaN values (channels flagged by the artifact detector) are left out: each value is smoothed
+    over its non-NaN values in the window, and is NaN when it has none.
+    """
+    def __init__(self, length, shape, method="mean", alpha=None, resync_every=1000):
+        """
+        :param length: Number of epochs smoothed over, and epochs needed before the smoother is ready.
+        :param shape: Shape of one band power array, e.g. (bands, channels).
+        :param method: "mean", "ema" or "median".
+        :param alpha: Weight of the newest epoch for "ema", 2 / (length + 1) by default.
+        :param resync_every: Updates after which the running sum is recomputed, bounds round-off drift.
+        """
+        if method not in SMOOTHING_METHODS:
+            raise ValueError(f"Unknown smoothing method: {method}, expected one of {SMOOTHING_METHODS}")
+        self.length = length
+        self.method = method
+        self.alpha = 2 / (length + 1) if alpha is None else alpha
+        self.resync_every = resync_every
+        shape = tuple(np.atleast_1d(shape))
+        self.history = np.full((length,) + shape, np.nan) if method != "ema" else None
+        self.total = np.zeros(shape)  # sum of the non-NaN values of the history
+        self.valid = np.zeros(shape, dtype=int)  # number of non-NaN values of the history
+        self.average = None  # EMA state
+        self.index = 0  # slot of the history written next
+        self.count = 0  # epochs seen so far
+        self._since_resync = 0
+
+    @property
+    def ready(self):
+        return self.count >= self.length
+
+    def update(self, values):
+        """
+        Adds the band powers of one epoch.
+        :return: The smoothed band powers, None until `length` epochs have been added.
+        """
+        values = np.asarray(values, dtype=float)
+        self.count += 1
+        if self.method == "ema":
+            if self.average is None:
+                self.average = values.copy()
+            else:
+                average = self.average + self.alpha * (values - self.average)
+                average = np.where(np.isnan(self.average), values, average)  # first non-NaN value
+                self.average = np.where(np.isnan(values), self.average, average)
+            return self.value if self.ready else None
+
+        slot = self.history[self.index]
+        if self.method == "mean":
+            missing, was_missing = np.isnan(values), np.isnan(slot)
+            self.total += np.where(missing, 0, values) - np.where(was_missing, 0, slot)
+            self.valid += was_missing.astype(int) - missing
+            self._since_resync += 1
+        slot[...] = values
+        self.index = (self.index + 1) % self.length
+        if self._since_resync >= self.resync_every:
+            self.total = np.nansum(self.history, axis=0)
+            self.valid = (~np.isnan(self.history)).sum(axis=0)
+            self._since_resync = 0
+        return self.value if self.ready else None
+
+    @property
+    def value(self):
+        """Current smoothed band powers (a new array)"""
+        if self.method == "mean":
+            with np.errstate(invalid="ignore"):
+                return np.where(self.valid > 0, self.total, np.nan) / self.valid
+        if self.method == "ema":
+            return self.average.copy()
+        window = self.history[:min(self.count, self.length)]
+        if not np.isnan(window).any():
+            return np.median(window, axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # values without non-NaN epochs stay NaN
+            return np.nanmedian(window, axis=0)
+
+class BatchDynamicScaler:
+    """
+    Min-max scaling of several metrics at once (e.g. one per subject), same behaviour as
+    `DynamicScaler` with the "minmax" method, with the history in a (window, values) array.
+    NaN values (a stalled subject) are left out of the window and scale to NaN.
+    """
+    def __init__(self, n_values, window_size=50, target_range=(0, 1)):
+        self.window_size = window_size
+        self.target_range = target_range
+        self.history = np.zeros((window_size, n_values))
+        self.count = 0
+        self.ready = False
+
+    def update(self, values):
+        """Adds one value per metric, array of shape (n_values,)"""
+        self.history[self.count % self.window_size] = values
+        self.count += 1
+        self.ready = self.count >= self.window_size
+
+    def scale(self, values):
+        """Scales one value per metric into the target range, rounded to 2 decimals"""
+        if not self.ready:
+            raise ValueError("Scaler is not ready yet, window is not full.")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # metrics without any value in the window stay NaN
+            min_val, max_val = np.nanmin(self.history, axis=0), np.nanmax(self.history, axis=0)
+        low, high = self.target_range
+        span = max_val - min_val
+        flat = span == 0
+        scaled = (np.asarray(values) - min_val) / np.where(flat, 1, span)
+        scaled = np.clip(low + scaled * (high - low), low, high).round(2)
+        # Neutral value where all values in the window are identical
+        return np.where(flat, round((low + high) / 2, 1), scaled)
+
 def compute_band_powers(eegdata, fs):
     #  TODO: refactor this function
     """Extract the features (band powers) from the EEG.
@@ -121,6 +291,167 @@ def compute_band_powers(eegdata, fs):
 
     return feature_vector
 
+# (name, low, high[, closed]) in Hz, a frequency f belongs to a band when low <= f < high,
+# or low <= f <= high when closed is True
+DEFAULT_BANDS = (
+    ("delta", 0, 4),
+    ("theta", 4, 8, True),  # edges of compute_band_powers, a bin at 8 Hz is in theta and alpha
+    ("alpha", 8, 12, True),
+    ("beta", 12, 30),
+)
+
+class BandPowerEngine:
+    """
+    Vectorized version of `compute_band_powers` for a fixed epoch length.
+    The Hamming window, FFT size, frequency axis and band masks are computed once,
+    then all channels are transformed with a single real FFT.
+    """
+    def __init__(self, fs, epoch_len, bands=DEFAULT_BANDS):
+        """
+        :param fs: Sampling frequency.
+        :param epoch_len: Length of the epochs in seconds.
+        :param bands: Sequence of (name, low, high) band definitions in Hz, covering [low, high),
+            or (name, low, high, True) to include the high edge.
+        """
+        self.fs = fs
+        self.n_samples = int(epoch_len * fs)
+        # Normalized to (name, low, high, closed)
+        self.bands = tuple((band[0], band[1], band[2], len(band) > 3 and bool(band[3])) for band in bands)
+        self.band_names = [name for name, _, _, _ in self.bands]
+        self.window = np.hamming(self.n_samples)
+        self.nfft = nextpow2(self.n_samples)
+        self.freqs = fs / 2 * np.linspace(0, 1, self.nfft // 2)  # same axis as compute_band_powers
+
+        # Averaging matrix of shape (bands, bins): PSD means become a single matrix product
+        masks = []
+        for _, low, high, closed in self.bands:
+            below_high = self.freqs <= high if closed else self.freqs < high
+            masks.append((self.freqs >= low) & below_high)
+        masks = np.array(masks, dtype=float)
+        if np.any(masks.sum(axis=1) == 0):
+            raise ValueError(f"Some bands of {self.bands} contain no FFT bin at fs={fs} and epoch_len={epoch_len}")
+        self.band_weights = masks / masks.sum(axis=1, keepdims=True)
+        # Only the bins up to the highest band edge are needed
+        self.n_bins = int(np.flatnonzero(masks.any(axis=0))[-1]) + 1
+        self.band_weights = self.band_weights[:, :self.n_bins]
+
+    def psd(self, epoch):
+        """
+        Returns the amplitude spectrum of the bins used by the bands, shape (bins, ...).
+        :param epoch: Array of shape (samples, channels, ...), time on axis 0.
+        """
+        epoch = np.asarray(epoch, dtype=float)
+        if epoch.shape[0] != self.n_samples:
+            raise ValueError(f"Expected {self.n_samples} samples per epoch, got {epoch.shape[0]}")
+        window = self.window.reshape((-1,) + (1,) * (epoch.ndim - 1))
+        centered = (epoch - epoch.mean(axis=0)) * window  # Remove offset and apply Hamming window
+        spectrum = np.fft.rfft(centered, n=self.nfft, axis=0)[:self.n_bins]
+        return 2 * np.abs(spectrum) / self.n_samples
+
+    def compute(self, epoch):
+        """
+        Computes the log10 band powers of an epoch.
+        :param epoch: Array of shape (samples, channels, ...), time on axis 0.
+        :return: Array of shape (bands, channels, ...).
+        """
+        return np.log10(np.tensordot(self.band_weights, self.psd(epoch), axes=1))
+
+class SlidingBandPowerEngine:
+    """
+    Incremental (sliding DFT) version of `BandPowerEngine` for overlapping epochs.
+
+    Keeps the running DFT of the last epoch of an `EEGRingBuffer`, restricted to the
+    bins used by the bands, and updates it with the samples entering and leaving the
+    epoch, so the cost per update grows with the number of new samples instead of
+    the epoch length. The symmetric Hamming window is applied in the frequency domain
+    (it is a sum of three complex exponentials) and the offset removal uses a running
+    sum, so the result matches `BandPowerEngine.compute` on the same epoch.
+    """
+    HAMMING_A, HAMMING_B = 0.54, 0.46
+
+    def __init__(self, engine, eeg_buffer, resync_every=500, validate=False, tolerance=1e-6):
+        """
+        :param engine: BandPowerEngine defining fs, epoch length and bands.
+        :param eeg_buffer: EEGRingBuffer the epochs are read from.
+        :param resync_every: Number of updates after which the DFT is recomputed from scratch to bound round-off drift.
+        :param validate: Check every update against the full FFT path.
+        :param tolerance: Maximum absolute deviation (log10 band power) tolerated in validation mode.
+        """
+        if eeg_buffer.capacity < engine.n_samples:
+            raise ValueError("The EEG buffer must hold at least one epoch")
+        self.engine = engine
+        self.eeg_buffer = eeg_buffer
+        self.resync_every = resync_every
+        self.validate = validate
+        self.tolerance = tolerance
+
+        n = engine.n_samples
+        omega = 2 * np.pi * np.arange(engine.n_bins) / engine.nfft
+        theta = 2 * np.pi / (n - 1)
+        # DFT is tracked at the bins and at the bins shifted by +/- the window frequency
+        self.omega = np.concatenate((omega, omega - theta, omega + theta))
+        self.dft_matrix = np.exp(-1j * np.outer(self.omega, np.arange(n + 1)))  # (frequencies, n + 1)
+        # Real and imaginary parts kept apart so chunk updates are real matrix products
+        self.dft_real = np.ascontiguousarray(self.dft_matrix.real)
+        self.dft_imag = np.ascontiguousarray(self.dft_matrix.imag)
+        self.epoch_shift = np.exp(-1j * self.omega * n)[:, None]
+        self.window_dft = self.dft_matrix[:engine.n_bins, :n] @ engine.window  # DFT of the window at the bins
+
+        self.dft = None  # running (unwindowed) DFT of the last epoch, shape (frequencies, channels)
+        self.epoch_sum = None  # running sum of the last epoch, shape (channels,)
+        self.n_updates = 0
+        self.max_error = 0.0  # largest deviation seen in validation mode
+
+    def resync(self):
+        """Recompute the running DFT from the last epoch of the buffer."""
+        epoch = self.eeg_buffer.last_epoch(self.engine.n_samples)
+        self.dft = self.dft_matrix[:, :-1] @ epoch
+        self.epoch_sum = epoch.sum(axis=0)
+        self.n_updates = 0
+
+    def update(self, n_new):
+        """
+        Slide the epoch forward by the `n_new` samples just appended to the buffer.
+        :param n_new: Number of samples appended since the last update.
+        :return: Log10 band powers of shape (bands, channels), None until the buffer holds one epoch.
+        """
+        n = self.engine.n_samples
+        if self.eeg_buffer.n_written < n:
+            return None
+        if (self.dft is None or n_new >= n or n + n_new > self.eeg_buffer.capacity
+                or self.n_updates >= self.resync_every):
+            self.resync()
+        elif n_new > 0:
+            window = self.eeg_buffer.last_epoch(n + n_new)
+            leaving, entering = window[:n_new], window[n:]
+            samples = np.concatenate((leaving, entering), axis=1)
+            partial = self.dft_real[:, :n_new] @ samples + 1j * (self.dft_imag[:, :n_new] @ samples)
+            n_ch = leaving.shape[1]
+            self.dft = self.dft_matrix[:, n_new].conj()[:, None] * (
+                self.dft - partial[:, :n_ch] + self.epoch_shift * partial[:, n_ch:])
+            self.epoch_sum += entering.sum(axis=0) - leaving.sum(axis=0)
+            self.n_updates += 1
+
+        band_powers = self._band_powers()
+        if self.validate:
+            expected = self.engine.compute(self.eeg_buffer.last_epoch(n))
+            error = float(np.max(np.abs(band_powers - expected)))
+            self.max_error = max(self.max_error, error)
+            if error > self.tolerance:
+                logger.warning("Sliding spectrum deviates by %g from the full FFT, resyncing", error)
+                self.resync()
+                band_powers = self._band_powers()
+        return band_powers
+
+    def _band_powers(self):
+        k = self.engine.n_bins
+        mean = self.epoch_sum / self.engine.n_samples
+        windowed = (self.HAMMING_A * self.dft[:k]
+                    - self.HAMMING_B / 2 * (self.dft[k:2 * k] + self.dft[2 * k:])
+                    - self.window_dft[:, None] * mean)
+        psd = 2 * np.abs(windowed) / self.engine.n_samples
+        return np.log10(self.engine.band_weights @ psd)
+
 def nextpow2(i):
     """
     Find the next power of 2 for number i
@@ -130,8 +461,104 @@ def nextpow2(i):
         n *= 2
     return n
 
-NOTCH_B, NOTCH_A = butter(4, np.array([55, 65]) / (256 / 2), btype='bandstop')
-def update_buffer(data_buffer, new_data, notch=False, filter_state=None):
+# Half width (Hz) of the band stopped around the mains frequency
+NOTCH_HALF_WIDTH = 5
+
+@lru_cache(maxsize=None)
+def design_sos(fs, btype, cutoff, order=4):
+    """
+    Butterworth filter in second-order sections, cached per (fs, band spec).
+    :param fs: Sampling frequency.
+    :param btype: 'bandstop', 'bandpass', 'highpass' or 'lowpass'.
+    :param cutoff: Cutoff frequency in Hz, or (low, high) tuple for band filters.
+    :param order: Filter order.
+    """
+    from scipy.signal import butter
+
+    return butter(order, cutoff, btype=btype, fs=fs, output='sos')
+
+def preload_dsp():
+    """
+    Imports scipy.signal (about a second on a cold start) in a background thread, so the
+    import overlaps with stream resolution and controller setup instead of delaying the
+    first filter. Later imports wait for it to finish.
+    """
+    thread = threading.Thread(target=importlib.import_module, args=("scipy.signal",), name="preload-dsp", daemon=True)
+    thread.start()
+    return thread
+
+class FilterBank:
+    """
+    Streaming filters applied to all channels in a single `sosfilt` call, with persistent state.
+    The main path is a mains notch and an optional high-pass (detrend) cascaded in one SOS array,
+    optional band-pass branches filter the main output in parallel.
+    The state is sized on the first chunk, time is on axis 0 and any trailing shape is supported.
+    """
+    def __init__(self, fs, mains=60, notch=True, highpass=None, bandpass=None, order=4):
+        """
+        :param fs: Sampling frequency.
+        :param mains: Mains frequency to notch out, 50 or 60 Hz.
+        :param notch: Whether to apply the mains notch.
+        :param highpass: Optional high-pass cutoff (Hz) removing slow drifts.
+        :param bandpass: Optional mapping name -> (low, high) Hz of band-pass branches.
+        :param order: Order of the Butterworth designs.
+        """
+        self.fs = fs
+        self.mains = mains
+        sections = []
+        if notch:
+            band = (mains - NOTCH_HALF_WIDTH, mains + NOTCH_HALF_WIDTH)
+            if band[1] >= fs / 2:
+                raise ValueError(f"A {mains} Hz notch does not fit below the Nyquist frequency of {fs / 2} Hz")
+            sections.append(design_sos(fs, 'bandstop', band, order))
+        if highpass:
+            sections.append(design_sos(fs, 'highpass', highpass, 2))
+        self.sos = np.concatenate(sections) if len(sections) > 1 else (sections[0] if sections else None)
+        self.branch_sos = {name: design_sos(fs, 'bandpass', tuple(band), order) for name, band in (bandpass or {}).items()}
+        self.state = None
+        self.branch_state = {}
+        self.branch_outputs = {}  # outputs of the branches for the last chunk
+
+    def apply(self, chunk):
+        """
+        Filters a chunk of shape (samples, ...) and returns the main path output.
+        Branch outputs of the same chunk are stored in `branch_outputs`.
+        """
+        from scipy.signal import sosfilt
+
+        chunk = np.asarray(chunk, dtype=float)
+        if len(chunk) == 0:
+            return chunk
+        out = chunk
+        if self.sos is not None:
+            if self.state is None:
+                # Steady state for the first sample, avoids a start-up transient on DC offsets
+                self.state = _initial_state(self.sos, chunk[0])
+            elif self.state.ndim > 2:
+                # Values whose input went missing (NaN, e.g. a stalled headset) restart from their next sample
+                stale = np.isnan(self.state).any(axis=(0, 1))
+                if stale.any():
+                    self.state[:, :, stale] = _initial_state(self.sos, chunk[0])[:, :, stale]
+            out, self.state = sosfilt(self.sos, chunk, axis=0, zi=self.state)
+        for name, sos in self.branch_sos.items():
+            if name not in self.branch_state:
+                self.branch_state[name] = _initial_state(sos, out[0])
+            self.branch_outputs[name], self.branch_state[name] = sosfilt(sos, out, axis=0, zi=self.branch_state[name])
+        return out
+
+    def reset(self):
+        """Forgets the filter state, the next chunk starts the filters afresh (after a gap in the input)"""
+        self.state = None
+        self.branch_state = {}
+        self.branch_outputs = {}
+
+def _initial_state(sos, first_sample):
+    from scipy.signal import sosfilt_zi
+
+    zi = sosfilt_zi(sos)  # (sections, 2) steady state for a unit step
+    return zi.reshape(zi.shape + (1,) * np.ndim(first_sample)) * first_sample
+
+def update_buffer(data_buffer, new_data, notch=False, filter_state=None, fs=256):
     """
     Concatenates "new_data" into "data_buffer", applies optional notch filtering,
     and returns an updated buffer of the same size as `data_buffer`.
@@ -140,7 +567,8 @@ def update_buffer(data_buffer, new_data, notch=False, filter_state=None):
     - data_buffer: Existing buffer of shape (buffer_size, channels).
     - new_data: Incoming data of shape (samples, channels) or (samples,).
     - notch: Boolean, whether to apply a notch filter.
-    - filter_state: State for the notch filter.
+    - filter_state: FilterBank holding the notch filter state, created on the first call.
+    - fs: Sampling frequency, used to design the notch filter.
 
     Returns:
     - new_buffer: Updated buffer of the same shape as `data_buffer`.
@@ -149,11 +577,10 @@ def update_buffer(data_buffer, new_data, notch=False, filter_state=None):
     # Apply notch filter if requested
     if notch:
         if filter_state is None:
-            # Initialize filter state for each channel
-            filter_state = np.array([lfilter_zi(NOTCH_B, NOTCH_A) for _ in range(data_buffer.shape[1])]).T
+            filter_state = FilterBank(fs)
 
-        # Apply filter independently to each channel
-        new_data, filter_state = lfilter(NOTCH_B, NOTCH_A, new_data, axis=0, zi=filter_state)
+        # Apply filter to all channels at once
+        new_data = filter_state.apply(new_data)
 
     # Concatenate along time axis and trim to buffer size
     new_buffer = np.concatenate((data_buffer, new_data), axis=0)
@@ -164,42 +591,191 @@ def update_buffer(data_buffer, new_data, notch=False, filter_state=None):
 def get_last_epoch(buffer_array, num_samples):
     return buffer_array[-num_samples:, :]
 
+class PolyphaseDecimator:
+    """
+    Streaming anti-aliased decimator, stateful across chunks.
+    A linear-phase FIR low-pass is evaluated only at the kept output samples
+    (polyphase form), so the cost per chunk is (samples / factor) * numtaps per channel.
+    The FIR adds a delay of (numtaps - 1) / 2 input samples (~0.45 s with the defaults at 256 Hz).
+    """
+    def __init__(self, factor, fs, passband=30, attenuation=60):
+        """
+        :param factor: Integer decimation factor.
+        :param fs: Input sampling frequency.
+        :param passband: Highest frequency (Hz) to preserve, aliases are kept above it.
+        :param attenuation: Stopband attenuation in dB.
+        """
+        from scipy.signal import firwin, kaiserord
+
+        self.factor = int(factor)
+        self.fs = fs
+        self.fs_out = fs / self.factor
+        stopband = self.fs_out - passband  # content above this folds back above the passband
+        if stopband <= passband:
+            raise ValueError(f"Passband of {passband} Hz does not fit below the output Nyquist of {self.fs_out / 2} Hz")
+        numtaps, beta = kaiserord(attenuation, (stopband - passband) / (fs / 2))
+        numtaps |= 1  # odd length, integer group delay
+        self.taps = firwin(numtaps, (passband + stopband) / 2, window=("kaiser", beta), fs=fs)
+        self.reversed_taps = self.taps[::-1].copy()
+        self.tail = None  # last numtaps - 1 input samples
+        self.phase = 0  # input samples to skip before the next output
+
+    def process(self, chunk):
+        """
+        Filter and decimate a chunk of shape (samples, channels).
+        :return: Decimated samples of shape (ceil((samples - phase) / factor), channels).
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        numtaps = len(self.taps)
+        if len(chunk) == 0:
+            # Nothing to prime the filter state with yet, and nothing to output
+            return np.empty((0,) + chunk.shape[1:])
+        if self.tail is None:
+            # Start as if the first sample had been constant forever, avoids a start-up transient
+            self.tail = np.repeat(chunk[:1], numtaps - 1, axis=0)
+        extended = np.concatenate((self.tail, chunk), axis=0)
+        self.tail = extended[len(extended) - (numtaps - 1):]
+
+        first = self.phase  # window index of the first output, windows start numtaps - 1 samples before it
+        windows = np.lib.stride_tricks.sliding_window_view(extended, numtaps, axis=0)[first::self.factor]
+        self.phase = first + self.factor * len(windows) - len(chunk)
+        return windows @ self.reversed_taps
+
+    def reset(self):
+        """Forgets the input history, the next chunk primes the filter again"""
+        self.tail = None
+        self.phase = 0
+
+class EEGRingBuffer:
+    """
+    Fixed-capacity circular buffer of shape (capacity, channels).
+    New chunks are written in place at the write cursor, so the cost of appending
+    only depends on the chunk size and not on the buffer length.
+    """
+    def __init__(self, capacity, n_channels, notch=True, decimator=None, fs=256, mains=60, highpass=None):
+        """
+        :param capacity: Number of samples held by the buffer (after decimation).
+        :param n_channels: Number of EEG channels, or a tuple for extra dimensions, e.g. (subjects, channels).
+        :param notch: Whether to notch filter incoming chunks before storing them.
+        :param decimator: Optional PolyphaseDecimator applied after the filters.
+        :param fs: Sampling frequency of the incoming chunks, used to design the filters.
+        :param mains: Mains frequency removed by the notch, 50 or 60 Hz.
+        :param highpass: Optional high-pass cutoff (Hz) applied with the notch.
+        """
+        self.capacity = int(capacity)
+        self.n_channels = n_channels
+        self.decimator = decimator
+        self.filter_bank = FilterBank(fs, mains=mains, notch=notch, highpass=highpass) if notch or highpass else None
+        self.data = np.zeros((self.capacity,) + (tuple(n_channels) if np.ndim(n_channels) else (n_channels,)))
+        self.cursor = 0  # index where the next sample is written
+        self.n_written = 0  # total number of samples written so far
+
+    @property
+    def full(self):
+        """True once the buffer has been filled at least once."""
+        return self.n_written >= self.capacity
+
+    def append(self, chunk):
+        """
+        Notch filter and decimate (both optional) a chunk of shape (samples, channels)
+        and write it into the buffer.
+        :param chunk: New samples, oldest first.
+        :return: Number of samples written to the buffer.
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if chunk.ndim == 1:
+            chunk = chunk.reshape(-1, 1)
+        if chunk.shape[0] == 0:
+            return 0
+
+        if self.filter_bank is not None:
+            chunk = self.filter_bank.apply(chunk)
+        if self.decimator is not None:
+            chunk = self.decimator.process(chunk)
+
+        n = chunk.shape[0]
+        self.n_written += n
+        if n >= self.capacity:
+            # Only the most recent samples fit, the cursor wraps back to the start
+            self.data[:] = chunk[-self.capacity:]
+            self.cursor = 0
+            return n
+
+        end = self.cursor + n
+        if end <= self.capacity:
+            self.data[self.cursor:end] = chunk
+        else:
+            split = self.capacity - self.cursor
+            self.data[self.cursor:] = chunk[:split]
+            self.data[:end - self.capacity] = chunk[split:]
+        self.cursor = end % self.capacity
+        return n
+
+    def reset(self):
+        """
+        Empties the buffer and the filter and decimator states, for a stream that does not continue
+        the samples already written (dropped chunks): the buffer has to be filled again.
+        """
+        if self.filter_bank is not None:
+            self.filter_bank.reset()
+        if self.decimator is not None:
+            self.decimator.reset()
+        self.data[:] = 0
+        self.cursor = 0
+        self.n_written = 0
+
+    def last_epoch(self, num_samples):
+        """
+        Returns the most recent `num_samples` samples in chronological order.
+        This is a view into the buffer unless the epoch wraps around the end, in
+        which case a single contiguous copy is made.
+        Views are overwritten by later appends, copy them if they need to outlive the next chunk.
+        """
+        num_samples = int(num_samples)
+        if num_samples > self.capacity:
+            raise ValueError(f"Epoch of {num_samples} samples exceeds buffer capacity {self.capacity}")
+        start = self.cursor - num_samples
+        if start >= 0:
+            return self.data[start:self.cursor]
+        return np.concatenate((self.data[start:], self.data[:self.cursor]), axis=0)
+
 def clamp(value, min_val, max_val):
     return max(min_val, min(max_val, value))
 
-def initialize_buffer(fs, buffer_length, index_channel):
+def initialize_buffer(fs, buffer_length, index_channel, decimation=1, mains=60, highpass=None):
     """
-    Initialize the EEG buffer and filter state.
+    Initialize the EEG ring buffer, the notch filter state is held by the buffer.
     :param fs: Sampling frequency.
     :param buffer_length: Length of the buffer in seconds.
     :param index_channel: List of channel indices.
-    :return: Initialized buffer and filter state.
+    :param decimation: Decimation factor applied after the notch filter, 1 keeps the full rate.
+    :param mains: Mains frequency removed by the notch, 50 or 60 Hz.
+    :param highpass: Optional high-pass cutoff (Hz) removing slow drifts.
+    :return: Initialized EEGRingBuffer of shape [samples, channels], sampled at fs / decimation.
     """
-    logger.info("Initializing buffer with length %d seconds and sampling frequency %d Hz", buffer_length, fs)
-    eeg_buffer = np.zeros((int(fs * buffer_length), len(index_channel)))  # shape [samples, channels]
-    filter_state = None
-    return eeg_buffer, filter_state
+    logger.info("Initializing buffer with length %d seconds and sampling frequency %d Hz", buffer_length, fs / decimation)
+    decimator = PolyphaseDecimator(decimation, fs) if decimation > 1 else None
+    return EEGRingBuffer(int(fs / decimation * buffer_length), len(index_channel), notch=True,
+                         decimator=decimator, fs=fs, mains=mains, highpass=highpass)
 
-def populate_initial_buffer(inlet, eeg_buffer, filter_state, shift_length, fs, index_channel):
+def populate_initial_buffer(inlet, eeg_buffer, shift_length, fs, index_channel):
     """
     Populate the initial EEG buffer with data.
     :param inlet: LSL inlet to pull data from.
-    :param eeg_buffer: EEG buffer to populate.
-    :param filter_state: Filter state for notch filtering.
+    :param eeg_buffer: EEGRingBuffer to populate, filled in place.
     :param shift_length: Length to shift the buffer.
     :param fs: Sampling frequency.
     :param index_channel: List of channel indices.
-    :return: Updated EEG buffer and filter state.
+    :return: The populated EEG buffer.
     """
     logger.debug("Populating initial buffer with EEG data")
-    while np.any(eeg_buffer == 0):
+    while not eeg_buffer.full:
         eeg_data, _ = inlet.pull_chunk(timeout=1, max_samples=int(shift_length * fs))
-        ch_data = np.array(eeg_data)[:, index_channel]
-        eeg_buffer, filter_state = update_buffer(
-            eeg_buffer, ch_data, notch=True, filter_state=filter_state
-        )
+        if not eeg_data:
+            continue
+        eeg_buffer.append(np.array(eeg_data)[:, index_channel])
     logger.debug("Buffer populated successfully")
-    return eeg_buffer, filter_state
+    return eeg_buffer
 
 def live_plot(valence, arousal, title:str="", max_points:int=100):
     """
@@ -210,6 +786,8 @@ def live_plot(valence, arousal, title:str="", max_points:int=100):
     :param title: Title of the plot, used as a unique identifier for the figure.
     :param max_points: Maximum number of points to display in the live plot.
     """
+    import matplotlib.pyplot as plt
+
     # Static storage for figures and plots
     if not hasattr(live_plot, "plots"):
         live_plot.plots = {}
@@ -268,27 +846,16 @@ def epoch(data, samples_epoch, samples_overlap=0):
         samples_overlap (int): Overlap between windows in samples
 
     Returns:
-        (numpy.ndarray): epoched data of shape
+        (numpy.ndarray): epoched data of shape [samples_epoch, n_channels, n_epochs],
+            a read-only strided view into `data` (no copy)
     """
 
     if isinstance(data, list):
         data = np.array(data)
 
-    n_samples, n_channels = data.shape
-
     samples_shift = samples_epoch - samples_overlap
 
-    n_epochs = int(
-        np.floor((n_samples - samples_epoch) / float(samples_shift)) + 1)
-
-    # Markers indicate where the epoch starts, and the epoch contains samples_epoch rows
-    markers = np.asarray(range(0, n_epochs + 1)) * samples_shift
-    markers = markers.astype(int)
-
-    # Divide data in epochs
-    epochs = np.zeros((samples_epoch, n_channels, n_epochs))
-
-    for i in range(0, n_epochs):
-        epochs[:, :, i] = data[markers[i]:markers[i] + samples_epoch, :]
+    # Windows of shape [n_windows, n_channels, samples_epoch], one every samples_shift samples
+    windows = np.lib.stride_tricks.sliding_window_view(data, samples_epoch, axis=0)[::samples_shift]
 
-    return epochs
+    return windows.transpose(2, 1, 0)
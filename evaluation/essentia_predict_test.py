@@ -1,22 +1,38 @@
+from functools import lru_cache
+from pathlib import Path
 import numpy as np
-from essentia.standard import MonoLoader, TensorflowPredictMusiCNN, TensorflowPredict2D
+
+MODEL_DIR = Path(__file__).parent / "model_weights"
+
+@lru_cache(maxsize=None)
+def load_models(model_dir=MODEL_DIR):
+    """Builds the TensorFlow graphs of the embedding and valence/arousal models, once per process"""
+    from essentia.standard import TensorflowPredictMusiCNN, TensorflowPredict2D
+
+    embedding_model = TensorflowPredictMusiCNN(graphFilename=str(Path(model_dir) / "msd-musicnn-1.pb"), output="model/dense/BiasAdd")
+    prediction_model = TensorflowPredict2D(graphFilename=str(Path(model_dir) / "deam-msd-musicnn-2.pb"), output="model/Identity")
+    return embedding_model, prediction_model
 
 class EssentiaPredictor:
-    def __init__(self):
-        self.embedding_model = TensorflowPredictMusiCNN(graphFilename="model_weights/msd-musicnn-1.pb", output="model/dense/BiasAdd")
-        self.prediction_model = TensorflowPredict2D(graphFilename="model_weights/deam-msd-musicnn-2.pb", output="model/Identity")
+    """Models are loaded on the first prediction"""
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+
     def predict(self, file_path):
+        from essentia.standard import MonoLoader
+
+        embedding_model, prediction_model = load_models(self.model_dir)
         # TODO: suppress the annoying warning
-        audio = MonoLoader(filename=file_path, sampleRate=16000, resampleQuality=4)()
-        embeddings = self.embedding_model(audio)
-        predictions = self.prediction_model(embeddings)
+        audio = MonoLoader(filename=str(file_path), sampleRate=16000, resampleQuality=4)()
+        embeddings = embedding_model(audio)
+        predictions = prediction_model(embeddings)
         return np.mean(predictions, axis=0)
 
 if __name__ == "__main__":
     predictor = EssentiaPredictor()
     audio_stream = np.random.rand(16000)
-    out = predictor.predict("sample.mp3")
+    out = predictor.predict(Path(__file__).parent / "sample.mp3")
     valence = out[0]
     arousal = out[1]
     print(f"valence: {valence}")
-    print(f"arousal: {arousal}")
\ No newline at end of file
+    print(f"arousal: {arousal}")
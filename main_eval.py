@@ -1,12 +1,12 @@
 import numpy as np
 import soundcard as sc
 
-from essentia.standard import MonoLoader, TensorflowPredictMusiCNN, TensorflowPredict2D, MonoMixer
+from essentia.standard import MonoMixer
+from evaluation.essentia_predict_test import load_models
 
 if __name__ == "__main__":
     loopback_device = sc.all_microphones(include_loopback=True)[1]
-    embedding_model = TensorflowPredictMusiCNN(graphFilename="model_weights/msd-musicnn-1.pb", output="model/dense/BiasAdd")
-    prediction_model = TensorflowPredict2D(graphFilename="model_weights/deam-msd-musicnn-2.pb", output="model/Identity")
+    embedding_model, prediction_model = load_models()  # cached, weights resolved next to the module
     mono_mixer = MonoMixer()
     try:
         with loopback_device.recorder(samplerate=16000) as mic:
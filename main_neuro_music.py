@@ -1,127 +1,106 @@
+import argparse
 import logging
-import numpy as np
-from pylsl import StreamInlet, resolve_byprop
+import time
+from pylsl import StreamInlet, local_clock, resolve_byprop
 from music_gen.controllers import AbletonMetaController
-from emotion_detection import utils
+from music_gen.async_controllers import AsyncAbletonMetaController
+from emotion_detection import latency, utils
+from emotion_detection.logconfig import setup_logging
+from emotion_detection.pipeline import NeuroPipeline
+from emotion_detection.plotting import LivePlotter
+from emotion_detection.recording import EEG_CHANNELS, RecordingInlet, SessionRecorder
+from emotion_detection.runtime import NeuroRuntime
+from emotion_detection.sources import ReplayInlet, SyntheticInlet
 
-class Band:
-    Delta = 0
-    Theta = 1
-    Alpha = 2
-    Beta = 3
+# Directory the raw EEG stream is recorded to (see emotion_detection.recording), None disables recording
+RECORD_SESSION = None
 
-# Length of the EEG data buffer (in seconds)
-BUFFER_LENGTH = 4
+# Seconds between two log reports of the runtime queues (drops, depth)
+RUNTIME_REPORT_INTERVAL = 10
 
-# Length of the epochs used to compute the FFT (in seconds)
-EPOCH_LENGTH = 2
+# Latency instrumentation (see emotion_detection.latency): JSON lines file and/or local HTTP port
+# the per-stage timings and metric ages are dumped to, both None disables the instrumentation
+LATENCY_REPORT = None
+LATENCY_PORT = None
 
-# Amount of overlap between two consecutive epochs (in seconds)
-OVERLAP_LENGTH = 1.5
-
-# Amount to 'shift' the start of each next consecutive epoch
-SHIFT_LENGTH = EPOCH_LENGTH - OVERLAP_LENGTH
-
-BAND_BUFFER_LENGTH = 10
-
-# All the 4 electrodes
-INDEX_CHANNEL = [0, 1, 2, 3]
+# Plot the scaled and raw metrics from a separate process (see emotion_detection.plotting)
+LIVE_PLOT = False
 
 if __name__ == "__main__":
-
-    # Configure the global logger
-    logging.basicConfig(
-        filename='system.log',
-        filemode='w',  # This will overwrite the log file on each run
-        level=logging.DEBUG,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%H:%M:%S'  # More compact time format
-    )
+    parser = argparse.ArgumentParser(description="EEG neurofeedback music generation")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--replay", help="replay a recording instead of reading the LSL stream")
+    source.add_argument("--synthetic", action="store_true", help="synthesize EEG instead of reading the LSL stream")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed of --replay/--synthetic")
+    parser.add_argument("--asyncio", action="store_true", help="non-blocking OSC server and client on an event loop")
+    args = parser.parse_args()
+
+    # Log through a background writer to a size-rotated file, hot-path messages are rate limited
+    log_listener = setup_logging('system.log', level=logging.DEBUG)
     logger = logging.getLogger(__name__)
 
     logger.info("Starting the magic")
 
-    # Search for active LSL streams
-    streams = resolve_byprop('type', 'EEG', timeout=2)
-    if len(streams) == 0:
-        logger.error('Cannot find EEG stream.')
-        raise RuntimeError('Cannot find EEG stream.')
+    # scipy.signal is imported while the stream is resolved and Ableton is set up
+    utils.preload_dsp()
+
+    if args.replay:
+        inlet = ReplayInlet(args.replay, speed=args.speed)
+    elif args.synthetic:
+        inlet = SyntheticInlet(speed=args.speed)
+    else:
+        # Search for active LSL streams
+        streams = resolve_byprop('type', 'EEG', timeout=2)
+        if len(streams) == 0:
+            logger.error('Cannot find EEG stream.')
+            raise RuntimeError('Cannot find EEG stream.')
+
+        # Set active EEG stream to inlet
+        inlet = StreamInlet(streams[0], max_chunklen=12)
 
-    # Set active EEG stream to inlet and apply time correction
-    inlet = StreamInlet(streams[0], max_chunklen=12)
+    # Apply time correction
     eeg_time_correction = inlet.time_correction()
 
+    if LATENCY_REPORT or LATENCY_PORT is not None:
+        # Sample timestamps are on the LSL clock, or the monotonic clock for the stand-in sources
+        monitor = latency.enable(clock=time.monotonic if args.replay or args.synthetic else local_clock)
+        monitor.start_reporting(RUNTIME_REPORT_INTERVAL, path=LATENCY_REPORT, port=LATENCY_PORT)
+
     # Initialize the Ableton controller
-    controller = AbletonMetaController()
+    controller = AsyncAbletonMetaController() if args.asyncio else AbletonMetaController()
     controller.setup()
 
-    # Initialize the scalers
-    arousal_scaler = utils.DynamicScaler()
-    valence_scaler = utils.DynamicScaler()
-
     # Get the stream info and description
     info = inlet.info()
     description = info.desc()
 
     # for the Muse 2016 fs should be 256
     fs = int(info.nominal_srate())
-    logger.info("FFT will be computed on %d second epoch in the buffer with an overlap of %f seconds", EPOCH_LENGTH, OVERLAP_LENGTH)
-
-    # Initialize buffers for all channels
-    eeg_buffer, filter_state = utils.initialize_buffer(fs, BUFFER_LENGTH, INDEX_CHANNEL)
-
-    # Wait until the buffer is fully populated
-    logger.info("Reading your brain waves until buffer and scalers are ready.")
-    eeg_buffer, filter_state = utils.populate_initial_buffer(inlet, eeg_buffer, filter_state, SHIFT_LENGTH, fs, INDEX_CHANNEL)
 
-    band_buffer = np.zeros((BAND_BUFFER_LENGTH, 4, len(INDEX_CHANNEL)))
-    try:
-        while True:
-            eeg_data, _ = inlet.pull_chunk(timeout=1, max_samples=int(SHIFT_LENGTH * fs))
-            ch_data = np.array(eeg_data)[:, INDEX_CHANNEL]
-
-            eeg_buffer, filter_state = utils.update_buffer(
-                eeg_buffer, ch_data, notch=True, filter_state=filter_state
-            )
-            data_epoch = utils.get_last_epoch(eeg_buffer, EPOCH_LENGTH * fs)
-
-            # FFT on one epoch across all channels
-            band_powers = np.array([utils.compute_band_powers(data_epoch[:, ch].reshape(-1, 1), fs)
-                        for ch in range(data_epoch.shape[1])])
-
-            # Shift and update the band buffer
-            band_buffer = np.roll(band_buffer, -1, axis=0)  # Shift to make space for new epoch
-            band_buffer[-1, :, :] = band_powers  # Add the latest band powers
-
-            if np.any(band_buffer == 0).any():
-                continue # wait until there enough samples in the buffer
-
-            # Aggregate across band buffer
-            smooth_band_powers = np.mean(band_buffer, axis=0)  # Shape: (bands, channels)
+    # Record the raw stream through a background writer, without blocking acquisition
+    recorder = None
+    if RECORD_SESSION:
+        recorder = SessionRecorder(RECORD_SESSION, channels=EEG_CHANNELS[:info.channel_count()], fs=fs)
+        inlet = RecordingInlet(inlet, recorder)
 
-            # TODO: is this correct?
-            # aggregate across channels
-            aggregated_alpha = np.mean(smooth_band_powers[Band.Alpha])
-            aggregated_beta = np.mean(smooth_band_powers[Band.Beta])
-            aggregated_theta = np.mean(smooth_band_powers[Band.Theta])
+    # Buffers, band powers, smoothing and scalers (configured in emotion_detection.pipeline)
+    pipeline = NeuroPipeline(fs)
 
-            valence = aggregated_theta / aggregated_alpha # anxiety protocol
-            arousal = aggregated_beta / aggregated_alpha # rafa ramirez protocol
-
-            # TODO: clamp the raw metrics to a wide range
-            arousal_scaler.update(arousal)
-            valence_scaler.update(valence)
-
-            if not arousal_scaler.ready or not valence_scaler.ready:
-                continue  # Wait for enough samples for scaling
-
-            scaled_arousal = arousal_scaler.scale(arousal)
-            scaled_valence = valence_scaler.scale(valence)
-            controller.update_metrics(valence=scaled_valence, arousal=scaled_arousal)
+    # Wait until the buffer is fully populated
+    pipeline.fill(inlet)
 
-            # utils.live_plot(scaled_valence, scaled_arousal, title="Scaled")
-            # utils.live_plot(valence, arousal, title="Not Scaled")
+    # Acquisition, DSP and OSC output in separate workers, so slow OSC sends never stall the inlet
+    plotter = LivePlotter().start() if LIVE_PLOT else None
+    runtime = NeuroRuntime(inlet, pipeline, controller, time_correction=eeg_time_correction, plotter=plotter)
 
+    try:
+        runtime.run_forever(report_interval=RUNTIME_REPORT_INTERVAL)
     except KeyboardInterrupt:
         logger.info("Closing application")
         controller.stop()
+        latency.disable()
+        if plotter is not None:
+            plotter.stop()
+        if recorder is not None:
+            recorder.close()
+        log_listener.stop()
@@ -0,0 +1,165 @@
+"""
+Asyncio mode of the Ableton controller: a non-blocking OSC server and client on one event loop.
+
+Beats are received by an AsyncIOOSCUDPServer and handled by a task, metric updates are scheduled
+on the loop, and OSC messages are queued and sent by a task that spaces them out with
+`asyncio.sleep` instead of sleeping in the caller. Nothing blocks on the network, so beats
+arriving during a note update are handled right after it instead of piling up in a socket.
+"""
+
+import asyncio
+import logging
+import threading
+from pythonosc.dispatcher import Dispatcher
+from pythonosc.osc_server import AsyncIOOSCUDPServer
+from music_gen.controllers import AbletonMetaController, AbletonOSCController, build_message
+
+logger = logging.getLogger(__name__)
+
+# Datagrams per second sent to Ableton, one bundle per update (see controllers.OSCSender)
+OSC_RATE = 100
+
+
+class AsyncOSCClient:
+    """
+    Non-blocking OSC client: `send_message` queues the message (from any thread) and a task of
+    the event loop sends the queue at most `rate` messages per second.
+    """
+    def __init__(self, ip, port, rate=OSC_RATE):
+        self.address = (ip, port)
+        self.interval = 1 / rate
+        self.sent = 0
+        self.loop = None
+        self._queue = None
+        self._transport = None
+        self._task = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._transport, _ = await self.loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                                                      remote_addr=self.address)
+        self._task = asyncio.create_task(self._send_loop(), name="osc-sender")
+
+    def send_message(self, address, value):
+        if self.loop is None:
+            raise RuntimeError("AsyncOSCClient is not started")
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, build_message(address, value).dgram)
+
+    def send(self, content):
+        if self.loop is None:
+            raise RuntimeError("AsyncOSCClient is not started")
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, content.dgram)
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def close(self, timeout=1.0):
+        """Sends the queued messages (waiting at most `timeout` seconds) and closes the socket"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d unsent OSC messages", self._queue.qsize())
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._transport.close()
+        self._task = None
+
+    async def _send_loop(self):
+        next_send = self.loop.time()
+        while True:
+            dgram = await self._queue.get()
+            delay = next_send - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)  # cooperative rate limiting, other tasks keep running
+            self._transport.sendto(dgram)
+            self.sent += 1
+            next_send = self.loop.time() + self.interval
+            self._queue.task_done()
+
+
+class AsyncAbletonMetaController(AbletonMetaController):
+    """
+    AbletonMetaController on an event loop. From asyncio code use `await start()` and
+    `await close()`, otherwise `setup()` and `stop()` run the loop in a background thread.
+    `update_metrics` can be called from any thread.
+    """
+    def __init__(self, ip="192.168.0.25", send_port=11000, receive_port=11001, listen_ip="0.0.0.0", rate=OSC_RATE):
+        self.client = AsyncOSCClient(ip, send_port, rate)
+        super().__init__(AbletonOSCController(send_port, ip, client=self.client, rate=None))
+        self.listen_address = (listen_ip, receive_port)
+        self.loop = None
+        self._beats = None
+        self._beat_task = None
+        self._server_transport = None
+        self._loop_thread = None
+
+    async def start(self):
+        """Starts the OSC client, the look-ahead worker, the beat listener and its task, then creates the clips"""
+        self.loop = asyncio.get_running_loop()
+        await self.client.start()
+        self.lookahead.start()
+        self._beats = asyncio.Queue()
+        self._beat_task = asyncio.create_task(self._beat_loop(), name="beat-handler")
+
+        dispatcher = Dispatcher()
+        dispatcher.map("/live/song/get/beat", lambda *args: self._beats.put_nowait(args))
+        server = AsyncIOOSCUDPServer(self.listen_address, dispatcher, self.loop)
+        self._server_transport, _ = await server.create_serve_endpoint()
+        self.listen_address = self._server_transport.get_extra_info("sockname")[:2]
+        logger.info("Listening for beats on %s:%d", *self.listen_address)
+
+        self.controller.song.start_listen_to_beats()
+        with self.controller.bundle():
+            self.controller.clip_slot.create_clip(0, 0, 16) # piano
+            self.controller.clip_slot.create_clip(1, 0, 16) # arpeggiator
+            self.controller.clip_slot.create_clip(2, 0, 16) # bass
+            self.controller.clip_slot.create_clip(3, 0, 16) # pad
+
+    async def close(self):
+        """Stops listening, finishes the beat being handled and flushes the queued messages"""
+        if self._server_transport is not None:
+            self._server_transport.close()
+            self._server_transport = None
+        if self._beat_task is not None:
+            self._beat_task.cancel()
+            await asyncio.gather(self._beat_task, return_exceptions=True)
+            self._beat_task = None
+        await self.client.close()
+        self.lookahead.stop(timeout=1.0)
+        logger.info("Closed the asyncio controller after sending %d OSC messages", self.client.sent)
+
+    def update_metrics(self, valence, arousal, timestamp=None):
+        """Schedules the modulation on the event loop, returns immediately"""
+        if self.loop is None:
+            raise RuntimeError("AsyncAbletonMetaController is not started")
+        self.loop.call_soon_threadsafe(super().update_metrics, valence, arousal, timestamp)
+
+    async def _beat_loop(self):
+        while True:
+            args = await self._beats.get()
+            try:
+                self._handle_beat(*args)
+            except Exception:
+                logger.exception("Failed to handle beat %s", args)
+
+    def setup(self, timeout=5.0):
+        """Runs the event loop in a daemon thread and starts the controller on it"""
+        loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=loop.run_forever, name="osc-loop", daemon=True)
+        self._loop_thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), loop).result(timeout)
+
+    def stop(self, timeout=5.0):
+        """Closes the controller and stops the background event loop started by `setup`"""
+        if self._loop_thread is None:
+            return
+        loop = self.loop
+        asyncio.run_coroutine_threadsafe(self.close(), loop).result(timeout)
+        loop.call_soon_threadsafe(loop.stop)
+        self._loop_thread.join(timeout)
+        loop.close()
+        self._loop_thread = None
@@ -6,24 +6,208 @@ import random
 import threading
 import time
 import logging
+from collections.abc import Iterable
+from contextlib import contextmanager
 from typing import Any, List, Tuple
 from pythonosc import udp_client
 from pythonosc.dispatcher import Dispatcher
+from pythonosc.osc_bundle_builder import IMMEDIATELY, OscBundleBuilder
+from pythonosc.osc_message_builder import OscMessageBuilder
 from pythonosc.osc_server import BlockingOSCUDPServer
 from music_gen.generator import MetaGenerator
+from music_gen.lookahead import LOOKAHEAD_THRESHOLD, LookAhead
+from emotion_detection import latency
 
 logger = logging.getLogger(__name__)
 
+# Datagrams per second sent to Ableton, and the burst sent before the limiter throttles
+OSC_RATE = 100
+OSC_BURST = 20
+
+# Maximum size (bytes) of a bundle datagram, larger updates are split across several bundles
+MAX_BUNDLE_SIZE = 8192
+
+# Change of a parameter below which it is not resent, per OSC address (the value is the last argument)
+DEADBANDS = {
+    "/live/song/set/tempo": 0.5,
+    "/live/track/set/volume": 0.01,
+    "/live/track/set/send": 0.01,
+    "/live/device/set/parameter/value": 0.005,
+}
+
+# Seconds after which an unchanged parameter is sent again, in case Ableton missed or overrode it
+MAX_STALENESS = 5.0
+
+
+def build_message(address, value):
+    """Encodes an OSC message like SimpleUDPClient.send_message"""
+    builder = OscMessageBuilder(address=address)
+    if value is None:
+        pass
+    elif not isinstance(value, Iterable) or isinstance(value, (str, bytes)):
+        builder.add_arg(value)
+    else:
+        for val in value:
+            builder.add_arg(val)
+    return builder.build()
+
+
+class TokenBucket:
+    """
+    Rate limiter: `acquire` returns immediately while tokens are left (up to `burst` of them,
+    refilled at `rate` per second) and only sleeps when the rate ceiling is actually hit.
+    """
+    def __init__(self, rate: float = OSC_RATE, burst: int = OSC_BURST, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.updated = clock()
+        self.waited = 0.0  # seconds spent throttled
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 1) -> float:
+        """Takes `tokens`, sleeping until they are available, returns the seconds waited"""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens  # reserved even if negative, later callers wait behind this one
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += wait
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class ParameterCache:
+    """
+    Last value sent per parameter, a parameter being an address with deadband and the arguments
+    before the value (track, device, ...). Updates within the deadband of the last sent value are
+    suppressed, unless that value is older than `max_staleness` seconds.
+    """
+    def __init__(self, deadbands=DEADBANDS, max_staleness=MAX_STALENESS, clock=time.monotonic):
+        """
+        :param deadbands: Mapping address -> deadband, other addresses are always sent.
+        :param max_staleness: Seconds after which an unchanged value is refreshed, None never refreshes.
+        :param clock: Clock of the staleness.
+        """
+        self.deadbands = dict(deadbands)
+        self.max_staleness = max_staleness
+        self.clock = clock
+        self.values = {}  # (address, args) -> (last sent value, time)
+        self.sent = 0
+        self.suppressed = 0
+
+    def should_send(self, address: str, params: Any) -> bool:
+        """Whether the update changes the parameter enough (or refreshes it), recorded as sent if so"""
+        deadband = self.deadbands.get(address)
+        if deadband is None:
+            return True
+        if isinstance(params, (list, tuple)):
+            key, value = (address, *params[:-1]), params[-1]
+        else:
+            key, value = (address,), params
+        now = self.clock()
+        last = self.values.get(key)
+        if (last is not None and abs(value - last[0]) < deadband
+                and (self.max_staleness is None or now - last[1] < self.max_staleness)):
+            self.suppressed += 1
+            return False
+        self.values[key] = (value, now)
+        self.sent += 1
+        return True
+
+    def clear(self):
+        """Forgets the sent values, e.g. after Ableton was restarted"""
+        self.values.clear()
+
+
+class OSCSender:
+    """
+    Sends OSC messages through a client, rate limited by an optional TokenBucket. Inside
+    `bundle()` the messages of the calling thread are collected instead and sent on exit as
+    timestamped OSC bundles, one datagram per `max_bundle_size` bytes.
+    """
+    def __init__(self, client, limiter: TokenBucket = None, bundling: bool = True, max_bundle_size: int = MAX_BUNDLE_SIZE,
+                 cache: ParameterCache = None):
+        """
+        :param client: OSC client with `send_message(address, value)` and `send(content)`.
+        :param limiter: TokenBucket taken once per datagram, None when the client rate limits itself.
+        :param cache: ParameterCache suppressing redundant parameter updates, None sends them all.
+        :param bundling: Collect the messages inside `bundle()`, otherwise they are sent one by one.
+        :param max_bundle_size: Maximum size (bytes) of a bundle datagram.
+        """
+        self.client = client
+        self.limiter = limiter
+        self.bundling = bundling
+        self.max_bundle_size = max_bundle_size
+        self.cache = cache
+        self.datagrams = 0
+        self._local = threading.local()
+
+    def send_message(self, address: str, params: Any) -> None:
+        if self.cache is not None and not self.cache.should_send(address, params):
+            return
+        messages = getattr(self._local, "messages", None)
+        if messages is not None:
+            messages.append(build_message(address, params))
+            return
+        self._send(lambda: self.client.send_message(address, params))
+
+    @contextmanager
+    def bundle(self, timetag=IMMEDIATELY):
+        """
+        Groups the messages sent in the block (by this thread) into bundles sent on exit.
+        :param timetag: Execution time (seconds since the epoch) of the bundles, immediately by default.
+        """
+        if not self.bundling or getattr(self._local, "messages", None) is not None:
+            yield  # nested blocks are part of the outer bundle
+            return
+        self._local.messages = []
+        try:
+            yield
+        finally:
+            messages, self._local.messages = self._local.messages, None
+            self._flush(messages, timetag)
+
+    def _flush(self, messages, timetag):
+        """Sends the messages as bundles of at most `max_bundle_size` bytes, a lone message as is"""
+        groups, size = [], self.max_bundle_size
+        for message in messages:
+            if size + 4 + message.size > self.max_bundle_size:
+                groups.append([])
+                size = 16  # "#bundle" and the timetag
+            groups[-1].append(message)
+            size += 4 + message.size
+        for group in groups:
+            if len(group) == 1:
+                content = group[0]
+            else:
+                builder = OscBundleBuilder(timetag)
+                for message in group:
+                    builder.add_content(message)
+                content = builder.build()
+            self._send(lambda: self.client.send(content))
+
+    def _send(self, send):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        with latency.stage("osc_send"):
+            send()
+        self.datagrams += 1
+
+
 class OSCBase:
     """Base class for OSC communication"""
 
-    def __init__(self, client: udp_client.SimpleUDPClient):
-        self.client = client
+    def __init__(self, sender: OSCSender):
+        self.sender = sender
 
     def send_message(self, address: str, params: Any) -> None:
-        """Send an OSC message with optional delay"""
-        self.client.send_message(address, params)
-        time.sleep(0.01)  # Prevent message flooding
+        """Send an OSC message, or add it to the bundle being collected"""
+        self.sender.send_message(address, params)
 
 
 class ClipAPI(OSCBase):
@@ -108,14 +292,30 @@ class TrackApi(OSCBase):
 
 class AbletonOSCController:
     """Main controller class that coordinates all APIs"""
-    def __init__(self, send_port: int = 11000, ip: str = "192.168.0.25"):
+    def __init__(self, send_port: int = 11000, ip: str = "192.168.0.25", client=None, rate: float = OSC_RATE,
+                 burst: int = OSC_BURST, bundling: bool = True, deadbands=DEADBANDS, max_staleness: float = MAX_STALENESS):
+        """
+        :param client: OSC client to send with, a SimpleUDPClient to ip:send_port by default.
+        :param rate: Datagrams per second before sends are throttled, None when the client rate limits itself.
+        :param burst: Datagrams sent at once before the rate applies.
+        :param bundling: Send the messages of `bundle()` blocks as OSC bundles.
+        :param deadbands: Per address change below which parameters are not resent, None sends every update.
+        :param max_staleness: Seconds after which unchanged parameters are sent again.
+        """
         logger.info("Sending to Ableton at %s:%d", ip, send_port)
-        self.client = udp_client.SimpleUDPClient(ip, send_port)
-        self.song = SongAPI(self.client)
-        self.clip_slot = ClipSlotAPI(self.client)
-        self.clip = ClipAPI(self.client)
-        self.device = DeviceAPI(self.client)
-        self.track = TrackApi(self.client)
+        self.client = client or udp_client.SimpleUDPClient(ip, send_port)
+        cache = ParameterCache(deadbands, max_staleness) if deadbands is not None else None
+        self.sender = OSCSender(self.client, TokenBucket(rate, burst) if rate else None, bundling, cache=cache)
+        self._volume_jitter = None  # (base volume, jitter of tracks 2 and 3), see set_tracks_volume
+        self.song = SongAPI(self.sender)
+        self.clip_slot = ClipSlotAPI(self.sender)
+        self.clip = ClipAPI(self.sender)
+        self.device = DeviceAPI(self.sender)
+        self.track = TrackApi(self.sender)
+
+    def bundle(self, timetag=IMMEDIATELY):
+        """Context manager sending the messages of the block as OSC bundles, see OSCSender.bundle"""
+        return self.sender.bundle(timetag)
 
     def remove_and_add_notes(
         self, track_index: int, clip_index: int, midi_notes: list, bar_number:int):
@@ -131,11 +331,19 @@ class AbletonOSCController:
         self.track.set_send(3, 2, value) 
 
     def set_tracks_volume(self, volume: float) -> None:
-        """Set volume of all tracks, oscillates between 0.5 and .9"""
+        """
+        Set volume of all tracks, oscillates between 0.5 and .9. Tracks 2 and 3 get a random
+        offset that is drawn again only when the volume moves by more than the volume deadband,
+        so a steady volume is not resent because of fresh jitter.
+        """
+        deadband = self.sender.cache.deadbands.get("/live/track/set/volume", 0) if self.sender.cache else 0
+        if self._volume_jitter is None or abs(volume - self._volume_jitter[0]) >= deadband:
+            self._volume_jitter = (volume, (random.uniform(-0.1, 0), random.uniform(-0.1, 0)))
+        jitter = self._volume_jitter[1]
         self.track.set_volume(0, volume)
         self.track.set_volume(1, volume)
-        self.track.set_volume(2, volume + random.uniform(-0.1, 0))
-        self.track.set_volume(3, volume + random.uniform(-0.1, 0))
+        self.track.set_volume(2, volume + jitter[0])
+        self.track.set_volume(3, volume + jitter[1])
 
 
 
@@ -143,32 +351,44 @@ class AbletonMetaController:
     """
     Piano is on track 1 (mids), zero index; Arpeggiator is on track 2 (high); Bass is on track 3 (bass)
     """
-    def __init__(self):
-        self.controller = AbletonOSCController()
+    def __init__(self, controller=None, lookahead_threshold=LOOKAHEAD_THRESHOLD, memo_grid=None):
+        """
+        :param controller: AbletonOSCController to send with.
+        :param lookahead_threshold: Change of the metrics after which the pre-generated phrase is generated again.
+        :param memo_grid: Step of the (valence, arousal) grid phrases are memoized on, None disables the memo.
+        """
+        self.controller = controller or AbletonOSCController()
         self.generator = MetaGenerator()
+        self.lookahead = LookAhead(self.generator, lookahead_threshold, memo_grid)
         self.valence = 0.5
         self.arousal = 0.5
         self.server_thread = None
+        self.metrics_timestamp = None  # corrected LSL timestamp of the newest sample behind the metrics
 
     def setup(self):
         """Starts the beat listener and creates midi clips of length 16 bars in the first 3 tracks"""
         logger.debug("Setting up AbletonMetaController: create empty clips and start listening to beats")
+        self.lookahead.start()
         self._start_beat_listener()
-        self.controller.clip_slot.create_clip(0, 0, 16) # piano
-        self.controller.clip_slot.create_clip(1, 0, 16) # arpeggiator
-        self.controller.clip_slot.create_clip(2, 0, 16) # bass
-        self.controller.clip_slot.create_clip(3, 0, 16) # pad
+        with self.controller.bundle():
+            self.controller.clip_slot.create_clip(0, 0, 16) # piano
+            self.controller.clip_slot.create_clip(1, 0, 16) # arpeggiator
+            self.controller.clip_slot.create_clip(2, 0, 16) # bass
+            self.controller.clip_slot.create_clip(3, 0, 16) # pad
 
 
-    def update_metrics(self, valence, arousal):
+    def update_metrics(self, valence, arousal, timestamp=None):
         """Updates valence and arousal and modulates params based on those"""
         logger.debug("Updating metrics: valence=%f, arousal=%f", valence, arousal)
         self.valence = valence
         self.arousal = arousal
-        # self.modulate_piano(self.valence, self.arousal)
-        self._modulate_arpeggiator(self.valence, self.arousal)
-        self._modulate_bass(self.valence, self.arousal)
-        self._modulate_global(self.valence, self.arousal)
+        self.metrics_timestamp = timestamp
+        self.lookahead.update(valence, arousal, timestamp)
+        with self.controller.bundle():  # one datagram per update
+            # self.modulate_piano(self.valence, self.arousal)
+            self._modulate_arpeggiator(self.valence, self.arousal)
+            self._modulate_bass(self.valence, self.arousal)
+            self._modulate_global(self.valence, self.arousal)
 
     def _handle_beat(self, *args) -> None:
         """Handle incoming beat messages, sends to ableton new midi every 8 beats"""
@@ -184,14 +404,18 @@ class AbletonMetaController:
     def add_events_to_ableton(self, start_bar_num:int) -> None:
         """Generates the next chord for Ableton, removes all existing notes before adding new ones"""
         logger.info("Adding events to Ableton starting at bar %d", start_bar_num)
-        chord_event, arp_event = self.generator.generate_next_event(self.valence, self.arousal)
-        # piano
-        self.controller.remove_and_add_notes(0, 0, chord_event.to_ableton_osc(start_time=start_bar_num), start_bar_num)
-        # bass, only the root note
-        self.controller.remove_and_add_notes(2, 0, [int(chord_event.root-12), start_bar_num, chord_event.duration, chord_event.velocity, 0], start_bar_num)
-        # arpeggiator
-        self.controller.remove_and_add_notes(1, 0, arp_event.to_ableton_osc(start_time=start_bar_num), start_bar_num)
-        self.controller.remove_and_add_notes(3, 0, chord_event.to_ableton_osc(start_time=start_bar_num), start_bar_num)
+        with latency.stage("generation"):  # only when the pre-generated phrase is missing or outdated
+            phrase = self.lookahead.take(self.valence, self.arousal, self.metrics_timestamp)
+        chord_event, arp_event = phrase.chord_event, phrase.arp_event
+        with self.controller.bundle():  # removes and adds of the 4 tracks in one datagram
+            # piano
+            self.controller.remove_and_add_notes(0, 0, chord_event.to_ableton_osc(start_time=start_bar_num), start_bar_num)
+            # bass, only the root note
+            self.controller.remove_and_add_notes(2, 0, [int(chord_event.root-12), start_bar_num, chord_event.duration, chord_event.velocity, 0], start_bar_num)
+            # arpeggiator
+            self.controller.remove_and_add_notes(1, 0, arp_event.to_ableton_osc(start_time=start_bar_num), start_bar_num)
+            self.controller.remove_and_add_notes(3, 0, chord_event.to_ableton_osc(start_time=start_bar_num), start_bar_num)
+        latency.age("notes_sent", phrase.timestamp)  # age of the metrics the notes were generated from
 
     # def _modulate_piano(self, valence: float, arousal: float) -> None:
     #     growl = arousal * (127 - 1) + 1  # Scale arousal (0-1) to MIDI range (1-127)
@@ -213,7 +437,8 @@ class AbletonMetaController:
         self.controller.set_saturator_send(1-valence) # inverse valence
 
     def stop(self):
-        """Stops the beat listener server thread"""
+        """Stops the look-ahead worker and the beat listener server thread"""
+        self.lookahead.stop(timeout=5)
         if self.server_thread:
             self.server_thread.join(timeout=5)
 
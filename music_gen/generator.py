@@ -2,10 +2,18 @@ import random
 import json
 import logging
 from dataclasses import dataclass
+from functools import lru_cache
 import numpy as np
+from music_gen.mode_tables import MODES_PATH, load_mode_tables
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=None)
+def load_mode_data(path=MODES_PATH):
+    """Reads the mode data once per process, shared (read-only) by all the generators"""
+    with open(path, "r") as f:
+        return json.load(f)
+
 # ordered from most positive to most negative
 IDX_TO_MODE = [
     "lydian",
@@ -55,23 +63,52 @@ class ArpeggiatorEvent(ChordEvent):
                 0                            # mute
             )
         ]
-    
+
+@dataclass
+class ProgressionBatch:
+    """
+    Progressions sampled by MetaGenerator.sample_progressions, n progressions of t events.
+    Melodies have variable lengths and are padded with -1.
+    """
+    roots: np.ndarray # MIDI note of the tonal center, (n, t)
+    chord_notes: np.ndarray # MIDI notes of the chords, (n, t, 4)
+    velocities: np.ndarray # (n, t)
+    melody_notes: np.ndarray # MIDI notes of the arpeggiator, (n, t, max length)
+    melody_lengths: np.ndarray # (n, t)
+
+    def events(self, i: int) -> list:
+        """The (ChordEvent, ArpeggiatorEvent) pairs of progression `i`, as generate_next_event returns them"""
+        return [
+            (ChordEvent(notes=self.chord_notes[i, j], velocity=int(self.velocities[i, j]), root=int(self.roots[i, j])),
+             ArpeggiatorEvent(notes=self.melody_notes[i, j, :self.melody_lengths[i, j]], velocity=int(self.velocities[i, j]),
+                              root=int(self.roots[i, j])))
+            for j in range(self.roots.shape[1])
+        ]
+
 class MetaGenerator:
     """Generates chords and arpeggiator events based on emotional metrics"""
     def __init__(self):
         self.mode_data = self._load_mode_data()
+        self.tables = load_mode_tables()  # compiled intervals and rules, see music_gen.mode_tables
         self.current_chord = "C" # to start with
         self.circle = CircleOfFifths()
     
     def _load_mode_data(self):
-        with open("music_gen/modes.json", "r") as f:
-            return json.load(f)
+        return load_mode_data()
     
     def generate_next_event(self, valence, arousal):
         """Move around the circle of fifths and generate a chord and arpeggiator event"""
+        self.current_chord, chord_event, arp_event = self.generate_event_from(self.current_chord, valence, arousal)
+        return chord_event, arp_event
+
+    def generate_event_from(self, chord, valence, arousal):
+        """
+        Generates the events following `chord` without moving the generator, so phrases can be
+        prepared ahead (see music_gen.lookahead). Returns the next chord, the chord and arpeggiator events.
+        """
         steps = 0 if random.random() < (1 - arousal) else random.choice([1, 2, 3])
         direction = 'fifths' if valence > 0.5 else 'fourths'
-        self.current_chord, tonal_midi_note = self.circle.navigate_circle(self.current_chord, steps, direction)
+        next_chord, tonal_midi_note = self.circle.navigate_circle(chord, steps, direction)
         # compute mode, velocity and pitch based on emotional metrics
         mode_intervals, mode_name = self._get_mode(valence)
         pitch = self._compute_pitch(valence)
@@ -79,16 +116,19 @@ class MetaGenerator:
         chord_event = self.create_chord(tonal_midi_note, mode_intervals, velocity, pitch)
         k = int(2 + 4 * arousal) # number of notes in the arpeggiator
         arp_event = self.create_arpeggiator(tonal_midi=tonal_midi_note, mode_name=mode_name, k=k, velocity=velocity, pitch_shift=pitch)
-        return chord_event, arp_event
+        return next_chord, chord_event, arp_event
     
     def _get_mode(self, valence):
         """Returns the mode intervals and mode name"""
+        mode_name = self._mode_name(valence)
+        logger.info("Selected mode: %s for valence %f", mode_name, valence)
+        return self.tables.mode_intervals(mode_name), mode_name
+
+    @staticmethod
+    def _mode_name(valence) -> str:
         # Determine the mode index based on valence
         mode_idx = int(6 - (5 * valence)) - 1 # minus 1 to convert to 0-based index
-        mode_name = IDX_TO_MODE[mode_idx]
-        logger.info("Selected mode: %s for valence %f", mode_name, valence)
-        mode_data = self.mode_data.get(mode_name)
-        return np.array(list(mode_data.get("intervals").values())), mode_name
+        return IDX_TO_MODE[mode_idx]
 
     def _compute_pitch(self, valence) -> int:
         return 0
@@ -120,46 +160,111 @@ class MetaGenerator:
         arp_midi_notes = intervals_to_midi_notes(melody_intervals, tonal_midi, pitch_shift)
         return ArpeggiatorEvent(notes=arp_midi_notes, duration=8, velocity=velocity, root=tonal_midi)
 
-    def _apply_l_system_rules(self, sequence: list, rules: dict) -> list:
-        """Apply rules that can produce either single elements or sequences"""
-        next_sequence = []
-        logger.debug("Current sequence: %s", sequence)
-        
-        # only using last symbol for now
-        symbol = sequence[-1]
-        if symbol in rules:
-            choice = random.choice(rules[symbol])
-            logger.debug("Rule applied: %s -> %s", symbol, choice)
-            
-            # Handle both single elements and sequences
-            if isinstance(choice, list):
-                next_sequence.extend(choice)
-            else:
-                next_sequence.append(choice)
-        else:
-            logger.warning("No rule found for symbol: %s", symbol)
-            next_sequence.append(symbol)
-            
-        logger.debug("Next sequence: %s", next_sequence)
-        return next_sequence
-
     def _generate_melody_interv(self, mode_name:str, k: int):
-        mode_data = self.mode_data.get(mode_name)
-        rules = mode_data.get("rules")
-        intervals = mode_data.get("intervals")
-        sequence = ["T"] # for now we start with the tonic
+        """Walks the compiled rules of the mode from the tonic, only the last symbol of each step is rewritten"""
+        tables = self.tables
+        m = tables.mode_index[mode_name]
+        intervals, rules = tables.interval_lists[m], tables.rule_lists[m]
+        degree = tables.symbol_index[m]["T"] # for now we start with the tonic
         # TODO: idea for later is to start with the note that is most characteristic for the mode
-        all_intervals = [intervals.get(sequence[0])]
-        
+        all_intervals = [intervals[degree]]
+
         logger.info("Generating melody with %d notes in %s mode", k, mode_name)
-        
+
         while len(all_intervals) < k:
-            sequence = self._apply_l_system_rules(sequence, rules)
-            all_intervals.extend([intervals.get(symbol) for symbol in sequence])
+            choices = rules[degree]
+            if choices:
+                targets = random.choice(choices)
+            else:
+                logger.warning("No rule found for symbol: %s", tables.symbols[m][degree])
+                targets = (degree,)
+            all_intervals.extend([intervals[t] for t in targets])
+            degree = targets[-1]
 
         logger.info("Final melody intervals: %s", all_intervals)
         return np.array(all_intervals)
 
+    def sample_melodies(self, mode_name: str, n: int, k: int, rng=None):
+        """
+        Samples `n` melodies at once, like `n` calls of _generate_melody_interv: one rule step per
+        iteration for all the melodies, drawn from `rng` instead of the global random module.
+        :param mode_name: Mode of the melodies.
+        :param n: Number of melodies.
+        :param k: Minimum number of notes, the last rule may add one more (like _generate_melody_interv).
+        :param rng: np.random.Generator or seed, reproducible runs pass a seed.
+        :return: Intervals of shape (n, max length) padded with -1, and the length of each melody.
+        """
+        rng = np.random.default_rng(rng)
+        tables = self.tables
+        m = tables.mode_index[mode_name]
+        max_length = tables.rule_targets.shape[-1]
+        n_steps = max(k - 1, 0) # every step adds at least one note
+        degrees = np.full((n, 1 + n_steps * max_length), -1, dtype=np.int64)
+        degrees[:, 0] = tables.symbol_index[m]["T"] # for now we start with the tonic
+        lengths = np.ones(n, dtype=np.int64)
+        current = degrees[:, 0].copy()
+        rows = np.arange(n)
+        for _ in range(n_steps):
+            active = lengths < k
+            counts = tables.rule_counts[m, current]
+            choice = (rng.random(n) * counts).astype(np.int64)
+            step_length = np.where(counts > 0, tables.rule_lengths[m, current, choice], 1)
+            targets = np.where((counts > 0)[:, None], tables.rule_targets[m, current, choice], -1)
+            targets[counts == 0, 0] = current[counts == 0] # no rule, the symbol repeats
+            step_length[~active] = 0
+            for i in range(max_length):
+                write = i < step_length
+                degrees[rows[write], lengths[write] + i] = targets[write, i]
+            current = np.where(active, targets[rows, np.maximum(step_length - 1, 0)], current)
+            lengths += step_length
+        width = int(lengths.max(initial=1))
+        intervals = np.where(degrees[:, :width] >= 0, tables.intervals[m, degrees[:, :width]], -1)
+        return intervals, lengths
+
+    def sample_progressions(self, metrics, n: int = 1, rng=None) -> ProgressionBatch:
+        """
+        Samples `n` progressions for a sequence of (valence, arousal), each event drawn like
+        generate_next_event, vectorized over the progressions. The generator's current chord is
+        the start of every progression and is left unchanged.
+        :param metrics: Sequence of (valence, arousal), one event each.
+        :param n: Number of progressions.
+        :param rng: np.random.Generator or seed, reproducible runs pass a seed.
+        """
+        rng = np.random.default_rng(rng)
+        metrics = np.asarray(metrics, dtype=float).reshape(-1, 2)
+        circle = self.circle
+        n_notes = len(circle.fifth_order)
+        midi_by_index = np.array(circle.midi_by_index)
+        position = np.full(n, circle.fifth_index[self.current_chord])
+        roots, chords, velocities, melodies = [], [], [], []
+        for valence, arousal in metrics:
+            steps = np.where(rng.random(n) < (1 - arousal), 0, rng.integers(1, 4, size=n))
+            position = (position + (steps if valence > 0.5 else -steps)) % n_notes
+            root = midi_by_index[position]
+            mode_name = self._mode_name(valence)
+            pitch = self._compute_pitch(valence)
+            # like random.uniform, which allows high < low unlike Generator.uniform
+            velocity = np.maximum(50, (50 + (127 * arousal - 50) * rng.random(n)).astype(np.int64))
+            chord = root[:, None] + self.tables.mode_intervals(mode_name)[[0, 2, 4, 6]] + pitch
+            intervals, lengths = self.sample_melodies(mode_name, n, int(2 + 4 * arousal), rng)
+            notes = np.where(intervals >= 0, root[:, None] + intervals + pitch + 12, -1) # one octave up
+            roots.append(root)
+            chords.append(chord)
+            velocities.append(velocity)
+            melodies.append((notes, lengths))
+
+        width = max((notes.shape[1] for notes, _ in melodies), default=0)
+        melody_notes = np.full((n, len(metrics), width), -1, dtype=np.int64)
+        for j, (notes, _) in enumerate(melodies):
+            melody_notes[:, j, :notes.shape[1]] = notes
+        return ProgressionBatch(
+            roots=np.stack(roots, axis=1) if roots else np.empty((n, 0), dtype=np.int64),
+            chord_notes=np.stack(chords, axis=1) if chords else np.empty((n, 0, 4), dtype=np.int64),
+            velocities=np.stack(velocities, axis=1) if velocities else np.empty((n, 0), dtype=np.int64),
+            melody_notes=melody_notes,
+            melody_lengths=np.stack([lengths for _, lengths in melodies], axis=1) if melodies else np.empty((n, 0), dtype=np.int64),
+        )
+
 class CircleOfFifths:
     """Class to navigate the circle of fifths and fourths"""
     def __init__(self):
@@ -184,26 +289,27 @@ class CircleOfFifths:
         }           
         # Circle of fourths (counterclockwise) - reverse of fifths
         self.fourth_order = self.fifth_order[::-1]
+        # Position of each note on the circle of fifths, and MIDI pitch by position
+        self.fifth_index = {note: i for i, note in enumerate(self.fifth_order)}
+        self.midi_by_index = [self.note_to_midi[note] for note in self.fifth_order]
 
     def _to_midi_pitch(self, note: str) -> int:
         return self.note_to_midi[note]
 
     def navigate_circle(self, start_note, steps: int, direction='fifths'):
         """Returns next tonal center and its MIDI pitch based on the start note and steps"""
-        # Select the appropriate circle based on direction
-        current_circle = self.fifth_order if direction == 'fifths' else self.fourth_order
-        # Find the index of the start note
         try:
-            start_index = current_circle.index(start_note)
-        except ValueError:
+            start_index = self.fifth_index[start_note]
+        except KeyError:
             logger.error("Invalid note %s not found in the circle of fifths", start_note)
-            raise ValueError(f"Note {start_note} not found in the circle")       
-        # Calculate the destination index
+            raise ValueError(f"Note {start_note} not found in the circle")
+        # Moving by fourths is moving backwards on the circle of fifths
         # Use modulo to wrap around the circle
-        dest_index = int(round((start_index + steps) % len(current_circle)))    
-        next_note = current_circle[dest_index]
-        midi_pitch = self._to_midi_pitch(next_note)
-        
+        step = steps if direction == 'fifths' else -steps
+        dest_index = int(round((start_index + step) % len(self.fifth_order)))
+        next_note = self.fifth_order[dest_index]
+        midi_pitch = self.midi_by_index[dest_index]
+
         logger.info("Circle navigation: %s -> %s (%d steps %s)", 
                    start_note, next_note, steps, direction)
         logger.debug("Note %s has MIDI pitch %d", next_note, midi_pitch)
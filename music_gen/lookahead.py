@@ -0,0 +1,160 @@
+"""
+Look-ahead generation of the next phrase, so the beat handler only dispatches notes.
+
+A worker thread keeps the phrase of the next bar generated from the current chord and the
+latest metrics. Metric updates only trigger a new generation when they move past a threshold
+from the ones the pending phrase was generated from. `take` hands the pending phrase over,
+moves the generator to its chord and lets the worker prepare the following one; it generates
+synchronously only when no fitting phrase is ready (worker not started or behind).
+
+Optionally, phrases are memoized over a grid of quantized (valence, arousal) per chord, so a
+steady state reuses phrases instead of generating them (at the cost of repeating them). The
+memo and the counters are shared by the worker and `take`, so they are only accessed under the
+lock; a key being generated by one of them is waited for by the other rather than generated twice.
+"""
+
+import dataclasses
+import logging
+import threading
+from dataclasses import dataclass
+from music_gen.generator import ArpeggiatorEvent, ChordEvent, MetaGenerator
+
+logger = logging.getLogger(__name__)
+
+# Change of valence or arousal after which the pending phrase is generated again
+LOOKAHEAD_THRESHOLD = 0.1
+
+
+@dataclass
+class Phrase:
+    chord: str # tonal center the phrase moves the circle to
+    chord_event: ChordEvent
+    arp_event: ArpeggiatorEvent
+    valence: float # metrics the phrase was generated from
+    arousal: float
+    timestamp: float = None # corrected LSL timestamp of the newest sample behind the metrics
+
+
+class LookAhead:
+    """Keeps the next phrase of a MetaGenerator ready, see module docstring"""
+    def __init__(self, generator: MetaGenerator, threshold: float = LOOKAHEAD_THRESHOLD, memo_grid: float = None):
+        """
+        :param generator: Generator of the phrases, its current chord advances with each `take`.
+        :param threshold: Change of valence or arousal after which the pending phrase is outdated.
+        :param memo_grid: Step of the (valence, arousal) grid phrases are memoized on, None disables the memo.
+        """
+        self.generator = generator
+        self.threshold = threshold
+        self.memo_grid = memo_grid
+        self.memo = {}
+        self._memo_pending = set() # memo keys being generated
+        self.counts = {"generated": 0, "ready": 0, "missed": 0, "memo_hits": 0}
+        self._condition = threading.Condition()
+        self._metrics = (0.5, 0.5, None) # latest valence, arousal and timestamp
+        self._phrase = None
+        self._version = 0 # bumped when the chord or metrics change, outdates phrases being generated
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="lookahead", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def ready(self):
+        """Whether a phrase is pending"""
+        return self._phrase is not None
+
+    def update(self, valence, arousal, timestamp=None):
+        """Latest metrics, the pending phrase is generated again only if they moved past the threshold"""
+        with self._condition:
+            self._metrics = (valence, arousal, timestamp)
+            if self._phrase is not None and self._fits(self._phrase, valence, arousal):
+                self._phrase = dataclasses.replace(self._phrase, timestamp=timestamp)
+                return
+            self._phrase = None
+            self._version += 1
+            self._condition.notify_all()
+
+    def take(self, valence=None, arousal=None, timestamp=None):
+        """
+        Hands over the phrase of the next bar and moves the generator to its chord.
+        :param valence: Current valence, the latest `update` by default.
+        :param arousal: Current arousal, the latest `update` by default.
+        :param timestamp: Timestamp of the current metrics.
+        """
+        with self._condition:
+            if valence is None or arousal is None:
+                valence, arousal, timestamp = self._metrics
+            phrase, self._phrase = self._phrase, None
+            chord = self.generator.current_chord
+            missed = phrase is None or not self._fits(phrase, valence, arousal)
+            self.counts["missed" if missed else "ready"] += 1
+        if missed:
+            phrase = self._generate(chord, valence, arousal, timestamp)
+        with self._condition:
+            self.generator.current_chord = phrase.chord
+            self._version += 1
+            self._condition.notify_all()
+        return phrase
+
+    def _fits(self, phrase, valence, arousal):
+        return abs(phrase.valence - valence) <= self.threshold and abs(phrase.arousal - arousal) <= self.threshold
+
+    def _generate(self, chord, valence, arousal, timestamp):
+        if not self.memo_grid:
+            next_chord, chord_event, arp_event = self.generator.generate_event_from(chord, valence, arousal)
+            with self._condition:
+                self.counts["generated"] += 1
+            return Phrase(next_chord, chord_event, arp_event, valence, arousal, timestamp)
+        key = (chord, round(valence / self.memo_grid), round(arousal / self.memo_grid))
+        with self._condition:
+            self._condition.wait_for(lambda: key not in self._memo_pending)
+            phrase = self.memo.get(key)
+            if phrase is not None:
+                self.counts["memo_hits"] += 1
+                return dataclasses.replace(phrase, valence=valence, arousal=arousal, timestamp=timestamp)
+            self._memo_pending.add(key)
+        phrase = None
+        try:
+            # Generated from the grid point, so the memoized phrase fits the whole cell
+            next_chord, chord_event, arp_event = self.generator.generate_event_from(
+                chord, key[1] * self.memo_grid, key[2] * self.memo_grid)
+            phrase = Phrase(next_chord, chord_event, arp_event, valence, arousal)
+        finally:
+            with self._condition:
+                self._memo_pending.discard(key)
+                if phrase is not None:
+                    self.memo[key] = phrase
+                    self.counts["generated"] += 1
+                self._condition.notify_all()
+        return dataclasses.replace(phrase, timestamp=timestamp)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: not self._running or self._phrase is None)
+                if not self._running:
+                    return
+                version, chord, metrics = self._version, self.generator.current_chord, self._metrics
+            try:
+                phrase = self._generate(chord, *metrics)
+            except Exception:
+                logger.exception("Failed to generate the next phrase")
+                with self._condition:
+                    self._condition.wait(1.0) # retried on the next update or take
+                continue
+            with self._condition:
+                if version == self._version:
+                    self._phrase = phrase
@@ -0,0 +1,157 @@
+"""
+Compiled form of modes.json for the generator: dense integer arrays instead of nested dicts.
+
+Each mode's symbols are numbered by scale degree, in the order of its "intervals" entry, so
+    intervals[mode, degree]                      semitones of a degree, (modes, 7)
+    rule_counts[mode, degree]                    number of rule choices (0 when the symbol has no rule)
+    rule_lengths[mode, degree, choice]           number of symbols a choice produces
+    rule_targets[mode, degree, choice, i]        degrees a choice produces, -1 padded
+The compiled tables are cached to an .npz file together with the SHA-256 of the JSON they
+come from, and compiled again when the JSON changed. The cache is written to a temporary file
+and renamed into place, so an interrupted or concurrent write never leaves a truncated file.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Intervals and rules of each mode
+MODES_PATH = Path(__file__).parent / "modes.json"
+
+# Compiled tables, with the compiled bytecode so they are never committed
+CACHE_PATH = Path(__file__).parent / "__pycache__" / "modes.npz"
+
+# Bumped when the layout of the compiled tables changes, invalidates the cached files
+FORMAT_VERSION = 1
+
+_ARRAYS = ("intervals", "rule_counts", "rule_lengths", "rule_targets")
+
+
+@dataclass(frozen=True, eq=False)
+class ModeTables:
+    modes: tuple  # mode names, in the order of the JSON
+    symbols: tuple  # per mode, symbol of each degree
+    intervals: np.ndarray
+    rule_counts: np.ndarray
+    rule_lengths: np.ndarray
+    rule_targets: np.ndarray
+    source_hash: str
+
+    def __post_init__(self):
+        object.__setattr__(self, "mode_index", {mode: i for i, mode in enumerate(self.modes)})
+        object.__setattr__(self, "symbol_index", tuple({s: i for i, s in enumerate(symbols)} for symbols in self.symbols))
+        for name in _ARRAYS:
+            getattr(self, name).setflags(write=False)  # shared by all the generators
+        # Plain int views for the one-symbol-at-a-time walk, numpy scalar indexing is slower there
+        object.__setattr__(self, "interval_lists", self.intervals.tolist())
+        object.__setattr__(self, "rule_lists", [[[tuple(self.rule_targets[m, d, c, :self.rule_lengths[m, d, c]].tolist())
+                                                  for c in range(self.rule_counts[m, d])]
+                                                 for d in range(self.intervals.shape[1])]
+                                                for m in range(len(self.modes))])
+
+    def mode_intervals(self, mode_name):
+        """Intervals (semitones) of the degrees of a mode, read-only"""
+        return self.intervals[self.mode_index[mode_name]]
+
+
+def compile_modes(mode_data, source_hash=""):
+    """
+    Compiles the mode dict of modes.json into ModeTables.
+    :param mode_data: Mapping mode -> {"intervals": {symbol: semitones}, "rules": {symbol: [choice, ...]}},
+        a choice being a symbol or a list of symbols.
+    :param source_hash: Hash of the JSON the data was read from.
+    """
+    modes = tuple(mode_data)
+    symbols = tuple(tuple(mode_data[mode]["intervals"]) for mode in modes)
+    n_degrees = max(len(s) for s in symbols)
+    rules = [{symbol: [c if isinstance(c, list) else [c] for c in choices]
+              for symbol, choices in mode_data[mode].get("rules", {}).items()} for mode in modes]
+    n_choices = max((len(choices) for r in rules for choices in r.values()), default=1)
+    max_length = max((len(c) for r in rules for choices in r.values() for c in choices), default=1)
+
+    intervals = np.zeros((len(modes), n_degrees), dtype=np.int64)
+    rule_counts = np.zeros((len(modes), n_degrees), dtype=np.int64)
+    rule_lengths = np.zeros((len(modes), n_degrees, n_choices), dtype=np.int64)
+    rule_targets = np.full((len(modes), n_degrees, n_choices, max_length), -1, dtype=np.int64)
+    for m, mode in enumerate(modes):
+        index = {symbol: i for i, symbol in enumerate(symbols[m])}
+        intervals[m, :len(symbols[m])] = list(mode_data[mode]["intervals"].values())
+        for symbol, choices in rules[m].items():
+            if symbol not in index:
+                logger.warning("Ignoring the rule of %s in %s, it is not a degree of the mode", symbol, mode)
+                continue
+            unknown = {s for c in choices for s in c} - index.keys()
+            if unknown:
+                raise ValueError(f"Rule of {symbol} in {mode} produces unknown symbols {sorted(unknown)}")
+            rule_counts[m, index[symbol]] = len(choices)
+            for c, choice in enumerate(choices):
+                rule_lengths[m, index[symbol], c] = len(choice)
+                rule_targets[m, index[symbol], c, :len(choice)] = [index[s] for s in choice]
+    return ModeTables(modes, symbols, intervals, rule_counts, rule_lengths, rule_targets, source_hash)
+
+
+def _hash(source):
+    return hashlib.sha256(source + f"format {FORMAT_VERSION}".encode()).hexdigest()
+
+
+def _read_cache(cache_path, source_hash):
+    try:
+        with np.load(cache_path, allow_pickle=False) as cached:
+            if str(cached["source_hash"]) != source_hash:
+                return None
+            symbols = tuple(tuple(s for s in row if s) for row in cached["symbols"].tolist())
+            return ModeTables(tuple(cached["modes"].tolist()), symbols,
+                              *(cached[name] for name in _ARRAYS), source_hash)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None  # missing or corrupt, compiled again
+
+
+def _write_cache(cache_path, tables):
+    directory = Path(cache_path).parent
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        pass
+    if not os.access(directory, os.W_OK):
+        logger.debug("Not caching the compiled modes, %s is not writable (installed package?)", directory)
+        return
+    n_degrees = tables.intervals.shape[1]
+    symbols = np.array([list(s) + [""] * (n_degrees - len(s)) for s in tables.symbols])
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=Path(cache_path).name, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, modes=np.array(tables.modes), symbols=symbols, source_hash=np.array(tables.source_hash),
+                     **{name: getattr(tables, name) for name in _ARRAYS})
+        os.replace(tmp_path, cache_path)  # atomic, readers see the old or the new file
+    except OSError:
+        logger.warning("Cannot cache the compiled modes to %s", cache_path)
+        if tmp_path is not None:
+            Path(tmp_path).unlink(missing_ok=True)
+
+
+@lru_cache(maxsize=None)
+def load_mode_tables(path=MODES_PATH, cache_path=CACHE_PATH):
+    """
+    Compiled tables of a modes JSON, read from `cache_path` when it was compiled from the same
+    JSON, otherwise compiled and cached there (None disables the disk cache).
+    """
+    source = Path(path).read_bytes()
+    source_hash = _hash(source)
+    if cache_path is not None:
+        tables = _read_cache(cache_path, source_hash)
+        if tables is not None:
+            return tables
+    tables = compile_modes(json.loads(source), source_hash)
+    if cache_path is not None:
+        _write_cache(cache_path, tables)
+    return tables
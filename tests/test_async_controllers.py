@@ -0,0 +1,88 @@
+import asyncio
+import random
+from pythonosc.osc_bundle import OscBundle
+from pythonosc.osc_message import OscMessage
+from pythonosc.osc_message_builder import OscMessageBuilder
+from music_gen.async_controllers import AsyncAbletonMetaController
+
+
+class FakeAbleton(asyncio.DatagramProtocol):
+    """Collects the OSC messages sent to Ableton, unpacking bundles"""
+    def __init__(self):
+        self.messages = []
+        self.datagrams = 0
+
+    def datagram_received(self, data, addr):
+        self.datagrams += 1
+        if OscBundle.dgram_is_bundle(data):
+            self.messages.extend(OscBundle(data))
+        else:
+            self.messages.append(OscMessage(data))
+
+    def addresses(self):
+        return [message.address for message in self.messages]
+
+
+async def _wait_for(condition, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise TimeoutError
+
+
+def _beat(number):
+    builder = OscMessageBuilder("/live/song/get/beat")
+    builder.add_arg(number)
+    return builder.build().dgram
+
+
+async def _session():
+    loop = asyncio.get_running_loop()
+    ableton = FakeAbleton()
+    ableton_transport, _ = await loop.create_datagram_endpoint(lambda: ableton, local_addr=("127.0.0.1", 0))
+    port = ableton_transport.get_extra_info("sockname")[1]
+    controller = AsyncAbletonMetaController("127.0.0.1", port, receive_port=0, listen_ip="127.0.0.1", rate=1000)
+    await controller.start()
+    await _wait_for(lambda: ableton.addresses().count("/live/clip_slot/create_clip") == 4)
+
+    controller.update_metrics(0.6, 0.7)
+    await _wait_for(lambda: "/live/song/set/tempo" in ableton.addresses())
+    assert controller.valence == 0.6 and controller.arousal == 0.7
+
+    beats, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=controller.listen_address)
+    beats.sendto(_beat(21))
+    beats.sendto(_beat(22))  # triggers the next chord
+    await _wait_for(lambda: ableton.addresses().count("/live/clip/add/notes") == 4)
+    beats.close()
+
+    await controller.close()
+    ableton_transport.close()
+    return controller, ableton
+
+
+def test_async_controller_session():
+    random.seed(0)
+    controller, ableton = asyncio.run(_session())
+    assert controller.client.sent == ableton.datagrams
+    assert controller.client.pending == 0
+    assert ableton.addresses()[0] == "/live/song/start_listen/beat"
+
+
+def test_async_controller_background_loop():
+    async def ableton_endpoint():
+        return await asyncio.get_running_loop().create_datagram_endpoint(FakeAbleton, local_addr=("127.0.0.1", 0))
+
+    loop = asyncio.new_event_loop()
+    transport, ableton = loop.run_until_complete(ableton_endpoint())
+    port = transport.get_extra_info("sockname")[1]
+    controller = AsyncAbletonMetaController("127.0.0.1", port, receive_port=0, listen_ip="127.0.0.1")
+    controller.setup()
+    controller.update_metrics(0.2, 0.3)  # from a thread that is not the event loop
+    controller.stop()
+    loop.run_until_complete(asyncio.sleep(0.05))  # receive the datagrams
+    transport.close()
+    loop.close()
+    assert not controller._loop_thread
+    assert controller.client.sent == ableton.datagrams
+    assert "/live/track/set/volume" in ableton.addresses()
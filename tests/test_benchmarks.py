@@ -0,0 +1,14 @@
+from benchmarks import run
+
+
+def test_compare_flags_regressions():
+    baseline = {"a": {"p50_us": 10.0}, "b": {"p50_us": 10.0}}
+    results = {"a": {"p50_us": 12.0}, "b": {"p50_us": 14.0}, "new": {"p50_us": 1.0}}
+    regressions = run.compare(results, baseline, threshold=1.3)
+    assert [name for name, *_ in regressions] == ["b"]
+
+def test_measure_reports_percentiles():
+    results = run.run_benchmarks("band_power_engine", scale=0.01)
+    stats = results["band_power_engine[4ch,2s]"]
+    assert stats["iterations"] == 20
+    assert 0 < stats["p50_us"] <= stats["p95_us"] <= stats["p99_us"]
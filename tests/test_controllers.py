@@ -0,0 +1,115 @@
+import random
+from pythonosc.osc_bundle import OscBundle
+from music_gen.controllers import AbletonMetaController, AbletonOSCController, OSCSender, ParameterCache, TokenBucket
+
+
+class RecordingClient:
+    """Keeps the datagrams a controller sends"""
+    def __init__(self):
+        self.datagrams = []
+
+    def send_message(self, address, value):
+        self.datagrams.append((address, value))
+
+    def send(self, content):
+        self.datagrams.append(content)
+
+    def messages(self):
+        messages = []
+        for datagram in self.datagrams:
+            if isinstance(datagram, OscBundle):
+                messages.extend((message.address, message.params) for message in datagram)
+            elif isinstance(datagram, tuple):
+                messages.append(datagram)
+            else:
+                messages.append((datagram.address, datagram.params))
+        return messages
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_only_throttles_above_the_rate():
+    fake = FakeTime()
+    bucket = TokenBucket(rate=10, burst=3, clock=fake.clock, sleep=fake.sleep)
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire() == 0.1
+    assert fake.slept == [0.1]
+    fake.now += 1.0  # refilled up to the burst
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+
+
+def test_update_is_sent_as_one_bundle():
+    random.seed(0)
+    client = RecordingClient()
+    controller = AbletonMetaController(AbletonOSCController(client=client, rate=None))
+    controller.update_metrics(0.4, 0.6)
+    assert len(client.datagrams) == 1 and isinstance(client.datagrams[0], OscBundle)
+    addresses = [address for address, _ in client.messages()]
+    assert addresses.count("/live/track/set/volume") == 4
+    assert "/live/song/set/tempo" in addresses
+
+    controller.add_events_to_ableton(start_bar_num=0)
+    assert len(client.datagrams) == 2
+    addresses = [address for address, _ in client.messages()[len(addresses):]]
+    assert addresses == ["/live/clip/remove/notes", "/live/clip/add/notes"] * 4
+
+
+def test_unbundled_controller_sends_messages_one_by_one():
+    random.seed(0)
+    client = RecordingClient()
+    controller = AbletonMetaController(AbletonOSCController(client=client, rate=None, bundling=False))
+    controller.update_metrics(0.4, 0.6)
+    assert len(client.datagrams) == len(client.messages()) > 1
+
+
+def test_large_bundles_are_split():
+    client = RecordingClient()
+    sender = OSCSender(client, max_bundle_size=200)
+    with sender.bundle():
+        for i in range(20):
+            sender.send_message("/live/track/set/volume", [i, 0.5])
+    assert len(client.datagrams) > 1
+    assert all(datagram.size <= 200 for datagram in client.datagrams)
+    assert [params[0] for _, params in client.messages()] == list(range(20))
+
+
+def test_parameter_cache_deadband_and_staleness():
+    fake = FakeTime()
+    cache = ParameterCache({"/live/track/set/volume": 0.01}, max_staleness=5.0, clock=fake.clock)
+    assert cache.should_send("/live/track/set/volume", [0, 0.5])
+    assert not cache.should_send("/live/track/set/volume", [0, 0.505])
+    assert cache.should_send("/live/track/set/volume", [1, 0.505])  # another track
+    assert cache.should_send("/live/track/set/volume", [0, 0.52])
+    assert cache.should_send("/live/clip/add/notes", [0, 0, 60, 0, 1, 100, 0])  # no deadband
+    fake.now = 5.0
+    assert cache.should_send("/live/track/set/volume", [0, 0.52])  # stale, refreshed
+    assert cache.suppressed == 1
+
+
+def test_steady_metrics_are_not_resent():
+    random.seed(0)
+    client = RecordingClient()
+    controller = AbletonMetaController(AbletonOSCController(client=client, rate=None))
+    controller.update_metrics(0.4, 0.6)
+    first = len(client.messages())
+    for _ in range(10):
+        controller.update_metrics(0.4, 0.6)
+    assert len(client.messages()) == first
+    assert len(client.datagrams) == 1  # empty bundles are not sent
+
+    controller.update_metrics(0.5, 0.6)  # valence moves volumes, sends and the wavetable shape
+    updates = client.messages()[first:]
+    assert "/live/song/set/tempo" not in [address for address, _ in updates]
+    volumes = [params[0] for address, params in updates if address == "/live/track/set/volume"]
+    assert volumes[:2] == [0, 1]  # tracks 2 and 3 only if their new jitter moved them past the deadband
@@ -0,0 +1,511 @@
+from pathlib import Path
+import numpy as np
+import pytest
+from emotion_detection import utils
+
+RECORDING = Path(__file__).parent.parent / "emotion_detection/eeg_recording/recording_2024-11-05-14.33.15.csv"
+
+
+@pytest.fixture
+def eeg_chunks():
+    rng = np.random.default_rng(0)
+    return [rng.normal(scale=50, size=(n, 4)) for n in (12, 128, 7, 300, 128, 64)]
+
+def test_ring_buffer_matches_update_buffer(eeg_chunks):
+    """The ring buffer should hold the same (notch filtered) samples as the concatenate-and-slice buffer"""
+    legacy_buffer, filter_state = np.zeros((256, 4)), None
+    ring = utils.EEGRingBuffer(256, 4, notch=True)
+    for chunk in eeg_chunks:
+        legacy_buffer, filter_state = utils.update_buffer(legacy_buffer, chunk, notch=True, filter_state=filter_state)
+        ring.append(chunk)
+        assert np.allclose(ring.last_epoch(256), legacy_buffer)
+        assert np.allclose(ring.last_epoch(100), utils.get_last_epoch(legacy_buffer, 100))
+    assert ring.full
+
+def test_ring_buffer_epoch_is_view_when_contiguous():
+    ring = utils.EEGRingBuffer(10, 1, notch=False)
+    ring.append(np.arange(6))
+    assert not ring.full
+    epoch = ring.last_epoch(4)
+    assert np.shares_memory(epoch, ring.data)
+    assert np.array_equal(epoch[:, 0], [2, 3, 4, 5])
+
+    ring.append(np.arange(6, 12))  # wraps around the end
+    assert ring.full
+    assert np.array_equal(ring.last_epoch(5)[:, 0], [7, 8, 9, 10, 11])
+    with pytest.raises(ValueError):
+        ring.last_epoch(11)
+
+@pytest.mark.parametrize("fs", [256, 240])  # at 240 Hz, 2 s epochs have a bin on the 8 Hz edge
+@pytest.mark.parametrize("epoch_len", [0.5, 1, 2, 3])
+def test_band_power_engine_matches_compute_band_powers(epoch_len, fs):
+    rng = np.random.default_rng(1)
+    epoch = rng.normal(scale=20, size=(int(epoch_len * fs), 4))
+    engine = utils.BandPowerEngine(fs, epoch_len)
+    band_powers = engine.compute(epoch)
+    assert band_powers.shape == (4, 4)  # (bands, channels)
+    for ch in range(4):
+        expected = utils.compute_band_powers(epoch[:, ch].reshape(-1, 1), fs)
+        assert np.allclose(band_powers[:, ch], expected)
+
+def test_band_power_engine_custom_bands_and_epochs():
+    fs = 256
+    engine = utils.BandPowerEngine(fs, 1, bands=[("low", 0, 10), ("high", 10, 40)])
+    epochs = np.random.default_rng(2).normal(size=(fs, 2, 5))  # (samples, channels, epochs)
+    band_powers = engine.compute(epochs)
+    assert band_powers.shape == (2, 2, 5)
+    assert np.allclose(band_powers[..., 3], engine.compute(epochs[..., 3]))
+    assert engine.bands == (("low", 0, 10, False), ("high", 10, 40, False))
+    # Only a closed band takes the bin at its high edge
+    high = engine.freqs[12]
+    edges = [utils.BandPowerEngine(fs, 1, bands=[("band", 8, high, closed)]).n_bins for closed in (False, True)]
+    assert edges == [12, 13]
+
+def test_sliding_band_power_engine_matches_full_fft():
+    fs = 256
+    rng = np.random.default_rng(3)
+    ring = utils.EEGRingBuffer(4 * fs, 4)
+    engine = utils.BandPowerEngine(fs, 2)
+    sliding = utils.SlidingBandPowerEngine(engine, ring, resync_every=10_000)
+    assert sliding.update(0) is None
+    for _ in range(200):
+        n_new = int(rng.integers(1, 140))
+        ring.append(rng.normal(loc=300, scale=50, size=(n_new, 4)))
+        band_powers = sliding.update(n_new)
+        if ring.n_written >= engine.n_samples:
+            assert np.allclose(band_powers, engine.compute(ring.last_epoch(engine.n_samples)), atol=1e-9)
+
+def test_sliding_band_power_engine_validation_mode():
+    fs = 256
+    ring = utils.EEGRingBuffer(3 * fs, 2)
+    sliding = utils.SlidingBandPowerEngine(utils.BandPowerEngine(fs, 1), ring, validate=True)
+    rng = np.random.default_rng(4)
+    for _ in range(50):
+        ring.append(rng.normal(size=(32, 2)))
+        sliding.update(32)
+    assert 0 <= sliding.max_error < 1e-9
+
+def test_decimator_streaming_matches_single_call():
+    rng = np.random.default_rng(5)
+    signal = rng.normal(size=(3000, 3))
+    streaming = utils.PolyphaseDecimator(4, fs=256)
+    chunks, start = [], 0
+    while start < len(signal):
+        size = int(rng.integers(1, 200))
+        chunks.append(streaming.process(signal[start:start + size]))
+        start += size
+    single = utils.PolyphaseDecimator(4, fs=256).process(signal)
+    assert single.shape == (750, 3)
+    assert np.allclose(np.concatenate(chunks), single)
+
+def test_decimator_skips_empty_chunks_before_priming():
+    decimator = utils.PolyphaseDecimator(4, fs=256)
+    assert decimator.process(np.empty((0, 3))).shape == (0, 3)
+    assert decimator.tail is None
+    signal = np.full((400, 3), 5.0)
+    assert np.allclose(decimator.process(signal), 5.0)  # primed from the first samples, no transient
+
+def test_muscle_check_disabled_when_decimated():
+    from emotion_detection.artifacts import ArtifactDetector
+    assert ArtifactDetector(256).hf_ratio is not None
+    assert ArtifactDetector(64).hf_ratio is None
+
+def test_decimated_band_powers_match_full_rate():
+    """Band powers at 64 Hz stay within 0.05 log10 units (~12%) of the 256 Hz path"""
+    fs, factor = 256, 4
+    rng = np.random.default_rng(6)
+    t = np.arange(40 * fs) / fs
+    signal = (rng.normal(scale=5, size=(len(t), 4)) + 20 * np.sin(2 * np.pi * 10 * t)[:, None]
+              + 10 * np.sin(2 * np.pi * 20 * t)[:, None] + 30 * np.sin(2 * np.pi * 45 * t)[:, None])
+    full = utils.initialize_buffer(fs, 4, [0, 1, 2, 3])
+    decimated = utils.initialize_buffer(fs, 4, [0, 1, 2, 3], decimation=factor)
+    full_engine, decimated_engine = utils.BandPowerEngine(fs, 2), utils.BandPowerEngine(fs / factor, 2)
+    delay = (len(decimated.decimator.taps) - 1) // 2  # FIR group delay in input samples
+    for start in range(0, len(t), 128):
+        full.append(signal[start:start + 128])
+        assert decimated.append(signal[start:start + 128]) == 32
+        if full.n_written >= full.capacity:
+            expected = full_engine.compute(full.last_epoch(full_engine.n_samples + delay)[:full_engine.n_samples])
+            actual = decimated_engine.compute(decimated.last_epoch(decimated_engine.n_samples))
+            assert np.max(np.abs(actual - expected)) < 0.05
+
+def test_offline_pipeline_matches_streaming():
+    from emotion_detection.pipeline import NeuroPipeline
+    fs = 256
+    samples = np.random.default_rng(7).normal(loc=100, scale=30, size=(60 * fs, 5))
+    streaming = NeuroPipeline(fs)
+    outputs = []
+    for start in range(0, len(samples), streaming.chunk_size):
+        metrics = streaming.push(samples[start:start + streaming.chunk_size])
+        outputs.append((streaming.valence, streaming.arousal) + (metrics or (np.nan, np.nan)))
+    outputs = np.array([row for row in outputs if row[0] is not None], dtype=float)
+
+    offline = NeuroPipeline(fs).run_offline(samples)
+    assert len(offline["valence"]) == len(outputs)
+    assert np.allclose(offline["valence"], outputs[:, 0])
+    assert np.allclose(offline["arousal"], outputs[:, 1])
+    assert np.allclose(offline["scaled_valence"], outputs[:, 2], equal_nan=True)
+    assert np.allclose(offline["scaled_arousal"], outputs[:, 3], equal_nan=True)
+
+def test_replay_recording(tmp_path):
+    from emotion_detection import replay
+    output = tmp_path / "metrics.csv"
+    df = replay.replay(RECORDING, output)
+    assert output.exists()
+    assert list(df.columns) == ["timestamp", "valence", "arousal", "scaled_valence", "scaled_arousal"]
+    scaled = df["scaled_valence"].dropna()
+    assert len(scaled) > 0 and scaled.between(0, 1).all()
+
+def test_replay_session_uses_its_sampling_frequency(tmp_path):
+    from emotion_detection import recording, replay
+    from emotion_detection.pipeline import NeuroPipeline
+    session = recording.convert_csv(RECORDING, tmp_path / "rec.eegsession", fs=200)
+    df = replay.replay(session.path, tmp_path / "metrics.csv")
+    assert len(df) == len(NeuroPipeline(200).run_offline(session.samples)["valence"])
+    assert len(df) != len(replay.replay(session.path, tmp_path / "metrics.csv", fs=256))
+
+def test_session_recorder_roundtrip_and_seek(tmp_path):
+    from emotion_detection import recording
+    rng = np.random.default_rng(8)
+    timestamps = 1000 + np.arange(5000) / 256
+    samples = rng.normal(size=(5000, 5))
+    with recording.SessionRecorder(tmp_path / "s.eegsession", index_stride=256) as recorder:
+        for start in range(0, 5000, 12):
+            recorder.record(samples[start:start + 12], timestamps[start:start + 12])
+
+    session = recording.Session(tmp_path / "s.eegsession")
+    assert len(session) == 5000 and len(session.index) == 20
+    assert np.allclose(session.samples, samples.astype(np.float32))
+    assert np.array_equal(session.timestamps, timestamps)
+    for t in (999.0, 1000.0, 1003.3, 1010.0, 1019.53, 1100.0):
+        assert session.seek(t) == np.searchsorted(timestamps, t)
+    chunk, chunk_timestamps = session.between(1002, 1003)
+    assert len(chunk) == 256 and chunk_timestamps[0] == 1002
+
+def test_convert_csv_session(tmp_path):
+    from emotion_detection import recording
+    session = recording.convert_csv(RECORDING, tmp_path / "rec.eegsession")
+    samples, timestamps, channels = recording.read_csv(RECORDING)
+    assert session.channels == channels == recording.EEG_CHANNELS
+    assert np.allclose(session.samples, samples, atol=1e-3)
+    assert np.array_equal(session.timestamps, timestamps)
+
+def test_replay_inlet_unthrottled_chunks():
+    from emotion_detection.sources import ReplayInlet
+    inlet = ReplayInlet(RECORDING, speed=None, loop=False)
+    assert inlet.info().nominal_srate() == 256
+    samples, timestamps = inlet.pull_chunk(timeout=1, max_samples=128)
+    assert len(samples) == len(timestamps) == 128 and len(samples[0]) == 5
+    assert np.allclose(samples, inlet.samples[:128])
+    pulled = 128
+    while True:
+        samples, _ = inlet.pull_chunk(max_samples=5000)
+        if not samples:
+            break
+        pulled += len(samples)
+    assert pulled == len(inlet.samples)
+
+def test_replay_inlet_uses_the_session_sampling_frequency(tmp_path):
+    from emotion_detection import recording
+    from emotion_detection.sources import ReplayInlet
+    session = recording.convert_csv(RECORDING, tmp_path / "rec.eegsession", fs=200)
+    assert ReplayInlet(session.path, speed=None).info().nominal_srate() == 200
+    assert ReplayInlet(session.path, fs=256, speed=None).info().nominal_srate() == 256
+
+def test_exhausted_replay_waits_out_the_timeout():
+    import time
+    from emotion_detection.sources import ReplayInlet
+    inlet = ReplayInlet(RECORDING, speed=1000, loop=False)
+    inlet.pull_chunk()
+    time.sleep(len(inlet.samples) / (256 * 1000) + 0.01)  # the whole recording has arrived
+    while inlet.pull_chunk(timeout=0.0, max_samples=100000)[0]:
+        pass
+    assert inlet.exhausted
+    start = time.monotonic()
+    assert inlet.pull_chunk(timeout=0.05) == ([], [])
+    assert time.monotonic() - start >= 0.04  # no busy loop in the acquisition thread
+
+def test_synthetic_inlet_paced_with_jitter():
+    from emotion_detection.sources import SyntheticInlet
+
+    class FakeClock:
+        now = 0.0
+        def __call__(self):
+            return self.now
+
+    clock = FakeClock()
+    inlet = SyntheticInlet(speed=2.0, chunk_size=12, jitter=0.01, seed=0, clock=clock)
+    assert inlet.pull_chunk() == ([], [])
+    clock.now = 0.5  # 0.5 s at 2x speed, 256 samples were produced (21 full chunks of 12)
+    samples, timestamps = inlet.pull_chunk(max_samples=1024)
+    assert 240 <= len(samples) <= 252 and len(samples) % 12 == 0
+    assert np.allclose(np.diff(timestamps), 1 / 512)
+    assert np.std(samples) > 1
+
+class ListScaler:
+    """Reference implementation of the original list-based DynamicScaler"""
+    def __init__(self, window_size):
+        self.window_size, self.values = window_size, []
+
+    def scale(self, value):
+        min_val, max_val = min(self.values), max(self.values)
+        if max_val == min_val:
+            return 0.5
+        return round(utils.clamp((value - min_val) / (max_val - min_val), 0, 1), 2)
+
+def test_dynamic_scaler_matches_list_window():
+    rng = np.random.default_rng(9)
+    scaler, reference = utils.DynamicScaler(window_size=20), ListScaler(20)
+    for value in rng.normal(size=500).round(1):  # rounding creates ties in the window
+        scaler.update(value)
+        reference.values = (reference.values + [value])[-20:]
+        assert scaler.bounds() == (min(reference.values), max(reference.values))
+        if scaler.ready:
+            assert scaler.scale(value) == reference.scale(value)
+    assert len(scaler.values) == 20
+
+@pytest.mark.parametrize("method", ["percentile", "decay"])
+def test_dynamic_scaler_robust_methods(method):
+    scaler = utils.DynamicScaler(window_size=100, method=method)
+    values = np.random.default_rng(10).uniform(0, 1, size=300)
+    values[150] = 1000  # artifact spike
+    for value in values:
+        scaler.update(value)
+    low, high = scaler.bounds()
+    assert low <= high
+    assert 0 <= scaler.scale(0.5) <= 1
+    if method == "percentile":
+        assert high < 2  # the spike does not stretch the bounds
+        assert scaler.bounds() == (np.percentile(values[-100:], 5, method="nearest"),
+                                   np.percentile(values[-100:], 95, method="nearest"))
+
+def test_dynamic_scaler_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        utils.DynamicScaler(method="median")
+
+@pytest.mark.parametrize("fs, mains", [(256, 60), (256, 50), (512, 50), (220, 60)])
+def test_filter_bank_removes_mains(fs, mains):
+    t = np.arange(10 * fs) / fs
+    alpha = np.sin(2 * np.pi * 10 * t)
+    signal = np.stack([alpha + 3 * np.sin(2 * np.pi * mains * t)] * 4, axis=1) + 100  # with a DC offset
+    bank = utils.FilterBank(fs, mains=mains)
+    filtered = np.concatenate([bank.apply(signal[i:i + 12]) for i in range(0, len(signal), 12)])
+    spectrum = 2 * np.abs(np.fft.rfft(filtered[-4 * fs:, 0])) / (4 * fs)  # 0.25 Hz bins
+    assert spectrum[mains * 4] < 0.05
+    assert 0.9 < spectrum[10 * 4] < 1.1
+    assert abs(spectrum[0] / 2 - 100) < 0.1
+    assert utils.design_sos(fs, 'bandstop', (mains - 5, mains + 5), 4) is bank.sos  # cached design
+
+def test_filter_bank_highpass_and_branches():
+    fs = 256
+    t = np.arange(20 * fs) / fs
+    signal = (np.sin(2 * np.pi * 10 * t) + np.sin(2 * np.pi * 20 * t) + 5 * t)[:, None]  # with a slow drift
+    bank = utils.FilterBank(fs, highpass=1.0, bandpass={"alpha": (8, 12), "beta": (12, 30)})
+    main = np.concatenate([bank.apply(signal[i:i + 128]) for i in range(0, len(signal), 128)])
+    assert abs(np.mean(main[-5 * fs:])) < 0.05  # drift removed
+    assert set(bank.branch_outputs) == {"alpha", "beta"}
+    alpha = bank.branch_outputs["alpha"][:, 0]
+    assert 0.5 < np.std(alpha) / np.std(np.sin(2 * np.pi * 10 * t[-128:])) < 1.2
+
+def test_multi_subject_engine_matches_single_pipelines():
+    from emotion_detection.multi import MultiSubjectEngine
+    from emotion_detection.pipeline import NeuroPipeline
+    fs, n_subjects = 256, 3
+    rng = np.random.default_rng(11)
+    samples = rng.normal(loc=100, scale=30, size=(n_subjects, 60 * fs, 5))
+    engine = MultiSubjectEngine(n_subjects, fs, aggregation="leader", leader=1, follow=0.25)
+    pipelines = [NeuroPipeline(fs) for _ in range(n_subjects)]
+    assert engine.buffer.shape == (n_subjects, 4 * fs, 4)
+    n_scaled = 0
+    for start in range(0, 60 * fs, pipelines[0].chunk_size):
+        for subject in reversed(range(n_subjects)):  # the last subject completes the aligned block
+            metrics = engine.push(subject, samples[subject, start:start + pipelines[0].chunk_size])
+        expected = [p.push(samples[s, start:start + p.chunk_size]) for s, p in enumerate(pipelines)]
+        assert (metrics is None) == (expected[0] is None)
+        if metrics is not None:
+            n_scaled += 1
+            assert np.allclose(engine.valence, [p.valence for p in pipelines])
+            assert np.allclose(engine.scaled_arousal, [e[1] for e in expected])
+            others = np.mean([e[0] for i, e in enumerate(expected) if i != 1])
+            assert metrics[0] == pytest.approx(0.75 * expected[1][0] + 0.25 * others)
+    assert n_scaled > 0
+
+def test_multi_subject_engine_continues_without_a_stalled_subject():
+    from emotion_detection.multi import MultiSubjectEngine
+    fs, chunk = 256, 128
+    rng = np.random.default_rng(12)
+    samples = rng.normal(loc=100, scale=30, size=(2, 90 * fs, 5))
+    engine = MultiSubjectEngine(2, fs, max_backlog=1.0)
+    outputs = {}
+    for start in range(0, 90 * fs, chunk):
+        metrics = engine.push(0, samples[0, start:start + chunk])
+        if not 40 * fs <= start < 60 * fs:  # the second headset drops out for 20 s
+            metrics = engine.push(1, samples[1, start:start + chunk])
+        outputs[start] = metrics
+        assert engine._pending_samples.max() <= fs + chunk  # no unbounded backlog
+        if start == 55 * fs:
+            assert engine.stalled.tolist() == [False, True] and np.isnan(engine.scaled_valence[1])
+    assert any(outputs[start] is not None for start in range(50 * fs, 60 * fs, chunk))  # the first subject carries on
+    assert not engine.stalled.any()
+    assert np.isfinite(engine.scaled_valence).all() and outputs[start] is not None  # delivering again
+
+def test_multi_subject_aggregation():
+    from emotion_detection.multi import MultiSubjectEngine, aggregate
+    assert aggregate([0.2, 0.4, 0.9]) == pytest.approx(0.5)
+    assert aggregate([0.2, 0.4], "weighted", weights=[3, 1]) == pytest.approx(0.25)
+    assert aggregate([0.2, 0.4, 0.6], "leader", leader=0, follow=0.5) == pytest.approx(0.35)
+    assert aggregate([0.2, np.nan, 0.6]) == pytest.approx(0.4)  # stalled subject left out
+    assert aggregate([np.nan, 0.4, 0.6], "leader", leader=0) == pytest.approx(0.5)
+    assert np.isnan(aggregate([np.nan, np.nan]))
+    with pytest.raises(ValueError):
+        MultiSubjectEngine(2, 256, aggregation="weighted")
+
+def test_alpha_asymmetry_valence():
+    from emotion_detection.pipeline import NeuroPipeline, Band, compute_metrics
+    band_powers = np.ones((4, 4))
+    band_powers[Band.Alpha] = [1.0, 2.0, 1.5, 0.5]  # log10 alpha of TP9, AF7, AF8, TP10
+    valence, arousal = compute_metrics(band_powers, "asymmetry", ((2, 1), (3, 0)))
+    assert valence == pytest.approx(((1.5 - 2.0) + (0.5 - 1.0)) / 2)
+    assert arousal == compute_metrics(band_powers)[1]
+
+    fs = 256
+    samples = np.random.default_rng(12).normal(loc=100, scale=30, size=(30 * fs, 5))
+    pipeline = NeuroPipeline(fs, index_channel=[1, 2], valence_source="asymmetry")
+    for start in range(0, len(samples), pipeline.chunk_size):
+        pipeline.push(samples[start:start + pipeline.chunk_size])
+    smooth = pipeline.band_buffer.value
+    assert pipeline.valence == pytest.approx(smooth[Band.Alpha, 1] - smooth[Band.Alpha, 0])
+    offline = NeuroPipeline(fs, index_channel=[1, 2], valence_source="asymmetry").run_offline(samples)
+    assert offline["valence"][-1] == pytest.approx(pipeline.valence)
+
+    with pytest.raises(ValueError):
+        NeuroPipeline(fs, index_channel=[0, 1], valence_source="asymmetry")
+
+def _clean_eeg(fs, seconds, seed):
+    from emotion_detection.sources import SyntheticInlet
+    inlet = SyntheticInlet(fs, seed=seed, modulation_period=None, speed=None)
+    return np.asarray(inlet.pull_chunk(max_samples=int(seconds * fs))[0])[:, :4]
+
+def test_artifact_detector_checks():
+    from emotion_detection.artifacts import ArtifactDetector
+    fs = 256
+    epoch = _clean_eeg(fs, 2, seed=13)
+    detector = ArtifactDetector(fs)
+    assert not detector.check(epoch).any()
+
+    blink = epoch.copy()
+    blink[200:277, 1:3] += 150 * np.hanning(77)[:, None]  # AF7 and AF8
+    assert detector.check(blink).tolist() == [False, True, True, False]
+    assert detector.last_flags["blink"].tolist() == [False, True, True, False]
+
+    muscle = epoch.copy()
+    muscle[:, 0] += np.random.default_rng(14).normal(scale=40, size=len(epoch))  # broadband EMG on TP9
+    assert detector.check(muscle).tolist() == [True, False, False, False]
+    assert detector.last_flags["muscle"][0]
+
+    saturated = epoch.copy()
+    saturated[100:140, 3] = 1000  # TP10 clipped
+    assert detector.check(saturated)[3] and detector.last_flags["saturation"][3]
+
+def test_artifact_detector_flags_epochs_from_chunks():
+    from emotion_detection.artifacts import ArtifactDetector
+    fs = 256
+    eeg = _clean_eeg(fs, 6, seed=13)
+    eeg[200:277, 1:3] += 150 * np.hanning(77)[:, None]  # blink on AF7 and AF8, across a chunk boundary
+    eeg[4 * fs + 100:4 * fs + 140] = 1000  # every channel clipped in the third epoch
+    detector = ArtifactDetector(fs, epoch_length=2)
+    band_powers = np.arange(16.0).reshape(4, 4)
+    cleaned = []
+    for start in range(0, len(eeg), fs // 2):
+        detector.update(eeg[start:start + fs // 2])
+        if (start + fs // 2) % (2 * fs) == 0:
+            cleaned.append(detector.clean(band_powers))
+    masked, clean, rejected = cleaned
+    assert np.isnan(masked[:, [1, 2]]).all() and np.array_equal(masked[:, [0, 3]], band_powers[:, [0, 3]])
+    assert detector.check(eeg[:2 * fs]).tolist() == [False, True, True, False]  # same as the whole epoch
+    assert np.array_equal(clean, band_powers)  # the blink chunks no longer cover the epoch
+    assert rejected is None
+    assert detector.counts["rejected_epochs"] == 1 and detector.counts["saturation"] == 4
+
+def test_artifact_rejection_in_pipeline():
+    from emotion_detection.pipeline import NeuroPipeline
+    fs = 256
+    samples = _clean_eeg(fs, 60, seed=15)
+    samples[20 * fs:21 * fs, :] = 1000  # saturation on every channel, whole epochs rejected
+    samples = np.hstack((samples, np.zeros((len(samples), 1))))
+
+    streaming = NeuroPipeline(fs, artifact_rejection=True)
+    outputs = []
+    for start in range(0, len(samples), streaming.chunk_size):
+        metrics = streaming.push(samples[start:start + streaming.chunk_size])
+        if metrics is not None:
+            outputs.append(metrics)
+    assert streaming.artifact_detector.rejected_epochs >= 4
+
+    offline_pipeline = NeuroPipeline(fs, artifact_rejection=True)
+    offline = offline_pipeline.run_offline(samples)
+    assert offline_pipeline.artifact_detector.counts == streaming.artifact_detector.counts
+    scaled = np.column_stack((offline["scaled_valence"], offline["scaled_arousal"]))
+    assert np.allclose(scaled[~np.isnan(scaled[:, 0])], outputs)
+
+def test_artifact_rejection_on_the_recording():
+    from emotion_detection import recording
+    from emotion_detection.pipeline import NeuroPipeline
+    samples, _, _ = recording.read_csv(RECORDING)  # 50 Hz mains
+    af8 = NeuroPipeline(256, artifact_rejection=True, mains=50)
+    af8.run_offline(samples)
+    assert af8.artifact_detector.counts["flagged_channels"][2] == af8.artifact_detector.counts["epochs"]  # clipped throughout
+
+    # Without the bad electrode, the live loop and the offline replay keep the same epochs
+    settings = dict(artifact_rejection=True, mains=50, index_channel=[0, 1, 3])
+    streaming = NeuroPipeline(256, **settings)
+    n_samples = len(samples) // streaming.chunk_size * streaming.chunk_size
+    outputs = [metrics for start in range(0, n_samples, streaming.chunk_size)
+               if (metrics := streaming.push(samples[start:start + streaming.chunk_size])) is not None]
+    offline_pipeline = NeuroPipeline(256, **settings)
+    offline = offline_pipeline.run_offline(samples[:n_samples])
+    assert offline_pipeline.artifact_detector.counts == streaming.artifact_detector.counts
+    assert len(outputs) > 0
+    scaled = np.column_stack((offline["scaled_valence"], offline["scaled_arousal"]))
+    assert np.allclose(scaled[~np.isnan(scaled[:, 0])], outputs)
+
+@pytest.mark.parametrize("method", ["mean", "ema", "median"])
+def test_band_smoother_skips_nan(method):
+    smoother = utils.BandSmoother(3, (2,), method=method)
+    for values in ([1.0, np.nan], [2.0, np.nan], [3.0, 4.0]):
+        smoothed = smoother.update(values)
+    assert np.isfinite(smoothed[0]) and smoothed[1] == 4.0  # first finite value of the second channel
+    smoother = utils.BandSmoother(2, (1,), method=method)
+    smoother.update([np.nan])
+    assert np.isnan(smoother.update([np.nan])).all()
+
+@pytest.mark.parametrize("method", ["mean", "ema", "median"])
+def test_band_smoother(method):
+    rng = np.random.default_rng(16)
+    values = rng.normal(size=(40, 4, 3))
+    smoother = utils.BandSmoother(10, (4, 3), method=method, resync_every=7)
+    average = values[0]
+    for i, value in enumerate(values):
+        smoothed = smoother.update(value)
+        average = average if i == 0 else average + 2 / 11 * (value - average)
+        assert (smoothed is None) == (i < 9) and smoother.ready == (i >= 9)
+        if smoothed is None:
+            continue
+        window = values[i - 9:i + 1]
+        expected = {"mean": window.mean(axis=0), "median": np.median(window, axis=0), "ema": average}[method]
+        assert np.allclose(smoothed, expected)
+    with pytest.raises(ValueError):
+        utils.BandSmoother(10, (4, 3), method="max")
+
+@pytest.mark.parametrize("smoothing", ["ema", "median"])
+def test_offline_pipeline_smoothing_matches_streaming(smoothing):
+    from emotion_detection.pipeline import NeuroPipeline
+    fs = 256
+    samples = np.random.default_rng(17).normal(loc=100, scale=30, size=(40 * fs, 5))
+    streaming = NeuroPipeline(fs, smoothing=smoothing)
+    valence = []
+    for start in range(0, len(samples), streaming.chunk_size):
+        if streaming.push(samples[start:start + streaming.chunk_size]) is not None or streaming.valence is not None:
+            valence.append(streaming.valence)
+    offline = NeuroPipeline(fs, smoothing=smoothing).run_offline(samples)
+    assert np.allclose(offline["valence"], valence)
@@ -0,0 +1,38 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# Modules the live loop imports before the first chunk, and the heavy ones they must not pull in
+LIVE_MODULES = ["emotion_detection.pipeline", "emotion_detection.runtime", "emotion_detection.sources",
+                "emotion_detection.multi", "music_gen.controllers", "music_gen.async_controllers"]
+HEAVY_MODULES = ["matplotlib", "scipy", "pandas", "tensorflow", "essentia"]
+
+# Generous wall time budget (seconds) for the imports above in a fresh interpreter, ~0.2 s here
+IMPORT_BUDGET = 2.0
+
+
+def _fresh_import(modules):
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"for name in {modules!r}: __import__(name)\n"
+        "print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def test_live_imports_are_light():
+    result = _fresh_import(LIVE_MODULES)
+    loaded = {name.split(".")[0] for name in result["modules"]}
+    assert loaded.isdisjoint(HEAVY_MODULES)
+    assert result["seconds"] < IMPORT_BUDGET
+
+
+def test_mode_data_is_cached_and_cwd_independent(tmp_path, monkeypatch):
+    from music_gen.generator import MetaGenerator
+    monkeypatch.chdir(tmp_path)
+    assert MetaGenerator().mode_data is MetaGenerator().mode_data
@@ -0,0 +1,60 @@
+import json
+import time
+import urllib.request
+from emotion_detection import latency
+from emotion_detection.pipeline import NeuroPipeline
+from emotion_detection.runtime import NeuroRuntime
+from emotion_detection.sources import SyntheticInlet
+
+
+class Controller:
+    def update_metrics(self, valence, arousal, timestamp=None):
+        pass
+
+
+def test_disabled_instrumentation_is_a_noop():
+    latency.disable()
+    assert latency.stage("fft") is latency.stage("filter")
+    latency.age("metrics_sent", 0.0)
+    assert latency.monitor() is None
+
+
+def test_stage_timings_and_ages(tmp_path):
+    clock = [100.0]
+    monitor = latency.enable(window=5, clock=lambda: clock[0])
+    try:
+        for _ in range(8):
+            with latency.stage("fft"):
+                time.sleep(0.001)
+        latency.age("metrics_sent", 99.75)
+        summary = monitor.summary()
+        assert summary["fft"]["count"] == 8 and sum(summary["fft"]["histogram"]) == 5  # rolling window
+        assert summary["fft"]["p50_ms"] >= 1
+        assert summary["metrics_sent"]["p50_ms"] == 250
+
+        path = tmp_path / "latency.jsonl"
+        monitor.start_reporting(interval=0.05, path=path, port=0)
+        url = "http://%s:%d/" % monitor.address
+        assert json.loads(urllib.request.urlopen(url, timeout=2).read())["fft"]["count"] == 8
+        time.sleep(0.12)
+    finally:
+        latency.disable()
+    lines = path.read_text().splitlines()
+    assert len(lines) >= 2 and "fft" in json.loads(lines[-1])["latency"]
+
+
+def test_runtime_records_end_to_end_age():
+    inlet = SyntheticInlet(speed=20, seed=0)
+    pipeline = NeuroPipeline(inlet.fs)
+    pipeline.fill(inlet)
+    monitor = latency.enable()
+    try:
+        runtime = NeuroRuntime(inlet, pipeline, Controller(), timeout=0.05).start()
+        time.sleep(0.5)
+        runtime.stop()
+        summary = monitor.summary()
+    finally:
+        latency.disable()
+    for name in ("pull", "filter", "fft", "smoothing", "scaling", "acquired", "scored", "metrics_sent"):
+        assert name in summary
+    assert 0 <= summary["metrics_sent"]["p50_ms"] < 1000
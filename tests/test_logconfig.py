@@ -0,0 +1,61 @@
+import logging
+import pytest
+from emotion_detection.logconfig import RateLimitFilter, setup_logging
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def record(msg, *args):
+    return logging.LogRecord("music_gen.generator", logging.INFO, __file__, 0, msg, args, None)
+
+
+def test_rate_limit_filter_counts_suppressed_records():
+    clock = Clock()
+    limit = RateLimitFilter(rate=1.0, burst=2, clock=clock)
+    passed = [limit.filter(record("Selected mode: %s", i)) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+    # Other templates have their own bucket
+    assert limit.filter(record("Circle navigation: %s", 0))
+
+    clock.now = 1.0
+    late = record("Selected mode: %s", 5)
+    assert limit.filter(late)
+    assert late.getMessage() == "Selected mode: 5 [3 similar suppressed]"
+    assert limit.suppressed == 3
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    for name in ("music_gen.generator", "other"):
+        logging.getLogger(name).filters.clear()
+
+
+def test_setup_logging_writes_through_the_listener(tmp_path, restore_logging):
+    path = tmp_path / "system.log"
+    path.write_text("previous run\n")
+    listener = setup_logging(path, max_bytes=2000, backup_count=2, limits={"music_gen.generator": (0.001, 3)})
+    for i in range(100):
+        logging.getLogger("music_gen.generator").info("Selected mode: %d", i)
+    for i in range(100):
+        logging.getLogger("other").debug("Message number %04d", i)
+    listener.stop()
+
+    assert (tmp_path / "system.log.1").exists()  # the previous run was rotated away
+    text = "".join(p.read_text() for p in sorted(tmp_path.glob("system.log*")) if p.read_text() != "previous run\n")
+    assert text.count("Selected mode") == 3
+    assert "Message number 0099" in text
+    assert path.stat().st_size <= 2000
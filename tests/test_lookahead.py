@@ -0,0 +1,95 @@
+import random
+import threading
+import time
+from music_gen.controllers import AbletonMetaController, AbletonOSCController
+from music_gen.generator import MetaGenerator
+from music_gen.lookahead import LookAhead
+from tests.test_controllers import RecordingClient
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        time.sleep(0.001)
+
+
+def test_generate_event_from_leaves_the_generator_unchanged():
+    generator = MetaGenerator()
+    random.seed(0)
+    next_chord, chord_event, arp_event = generator.generate_event_from("C", 0.7, 0.8)
+    assert generator.current_chord == "C"
+    random.seed(0)
+    expected = generator.generate_next_event(0.7, 0.8)
+    assert generator.current_chord == next_chord
+    assert (chord_event.notes == expected[0].notes).all() and (arp_event.notes == expected[1].notes).all()
+
+
+def test_phrases_are_ready_before_the_beat():
+    lookahead = LookAhead(MetaGenerator(), threshold=0.1).start()
+    try:
+        lookahead.update(0.7, 0.8, timestamp=1.0)
+        for _ in range(5):
+            _wait_for(lambda: lookahead.ready)
+            lookahead.update(0.75, 0.75, timestamp=2.0)  # within the threshold, kept
+            assert lookahead.ready
+            phrase = lookahead.take()
+            assert phrase.timestamp == 2.0
+            assert lookahead.generator.current_chord == phrase.chord
+            lookahead.update(0.7, 0.8, timestamp=1.0)
+        assert lookahead.counts["ready"] == 5 and lookahead.counts["missed"] == 0
+
+        _wait_for(lambda: lookahead.ready)
+        phrase = lookahead.take(0.1, 0.2)  # the metrics moved since, generated on the spot
+        assert (phrase.valence, phrase.arousal) == (0.1, 0.2)
+        assert lookahead.counts["missed"] == 1
+    finally:
+        lookahead.stop(timeout=1)
+
+
+def test_memoized_phrases_are_reused():
+    generator = MetaGenerator()
+    generator.circle.navigate_circle = lambda chord, steps, direction: (chord, 60)  # stay on C
+    lookahead = LookAhead(generator, memo_grid=0.25)
+    first = lookahead.take(0.5, 0.5)
+    second = lookahead.take(0.52, 0.48)  # same grid cell
+    assert second.chord_event is first.chord_event
+    assert lookahead.counts == {"generated": 1, "ready": 0, "missed": 2, "memo_hits": 1}
+
+
+def test_concurrent_memo_lookups_generate_once():
+    generator = MetaGenerator()
+    generate = generator.generate_event_from
+
+    def slow_generate(*args):
+        time.sleep(0.05)  # the second lookup arrives while the first is generating
+        return generate(*args)
+
+    generator.generate_event_from = slow_generate
+    lookahead = LookAhead(generator, memo_grid=0.25)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(lookahead._generate("C", 0.5, 0.5, None)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(phrase.chord_event) for phrase in results}) == 1
+    assert lookahead.counts["generated"] == 1 and lookahead.counts["memo_hits"] == 3
+
+
+def test_controller_dispatches_pre_generated_phrases():
+    random.seed(0)
+    client = RecordingClient()
+    controller = AbletonMetaController(AbletonOSCController(client=client, rate=None))
+    controller.lookahead.start()
+    try:
+        controller.update_metrics(0.6, 0.7, timestamp=3.0)
+        _wait_for(lambda: controller.lookahead.ready)
+        controller._handle_beat(None, 14)
+        assert controller.lookahead.counts["ready"] == 1
+        addresses = [address for address, _ in client.messages()]
+        assert addresses.count("/live/clip/add/notes") == 4
+    finally:
+        controller.lookahead.stop(timeout=1)
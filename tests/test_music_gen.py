@@ -75,4 +75,102 @@ def test_get_mode_real_data(meta_generator):
     # Test sad/low valence (phrygian)
     intervals, mode = meta_generator._get_mode(0.0)
     assert isinstance(intervals, np.ndarray)
-    assert mode == "phrygian"
\ No newline at end of file
+    assert mode == "phrygian"
+
+def test_compiled_mode_tables_match_the_json():
+    from music_gen.generator import load_mode_data
+    from music_gen.mode_tables import load_mode_tables
+    tables = load_mode_tables()
+    for mode, data in load_mode_data().items():
+        m = tables.mode_index[mode]
+        assert tables.intervals[m].tolist() == list(data["intervals"].values())
+        for symbol, choices in data["rules"].items():
+            if symbol not in tables.symbol_index[m]:
+                continue  # rules of symbols that are not degrees are ignored
+            degree = tables.symbol_index[m][symbol]
+            compiled = [[tables.symbols[m][t] for t in tables.rule_targets[m, degree, c, :tables.rule_lengths[m, degree, c]]]
+                        for c in range(tables.rule_counts[m, degree])]
+            assert compiled == [c if isinstance(c, list) else [c] for c in choices]
+
+
+def test_mode_tables_disk_cache_is_validated(tmp_path):
+    import json
+    from music_gen.generator import load_mode_data
+    from music_gen.mode_tables import load_mode_tables
+    modes, cache = tmp_path / "modes.json", tmp_path / "modes.npz"
+    data = load_mode_data()
+    modes.write_text(json.dumps(data))
+    compiled = load_mode_tables(modes, cache)
+    assert cache.exists()
+    cached = load_mode_tables.__wrapped__(modes, cache)
+    assert cached.source_hash == compiled.source_hash and cached.symbols == compiled.symbols
+    assert np.array_equal(cached.rule_targets, compiled.rule_targets)
+
+    data = dict(data, ionian=dict(data["ionian"], intervals=dict(data["ionian"]["intervals"], M7=10)))
+    modes.write_text(json.dumps(data))
+    changed = load_mode_tables.__wrapped__(modes, cache)
+    assert changed.source_hash != compiled.source_hash
+    assert changed.mode_intervals("ionian")[-1] == 10
+
+
+def test_corrupt_mode_tables_cache_is_recompiled(tmp_path):
+    from music_gen.mode_tables import MODES_PATH, load_mode_tables
+    cache = tmp_path / "modes.npz"
+    load_mode_tables.__wrapped__(MODES_PATH, cache)
+    cache.write_bytes(cache.read_bytes()[:100])  # truncated
+    tables = load_mode_tables.__wrapped__(MODES_PATH, cache)
+    assert tables.mode_intervals("ionian").tolist() == [0, 2, 4, 5, 7, 9, 11]
+    assert load_mode_tables.__wrapped__(MODES_PATH, cache).source_hash == tables.source_hash  # rewritten
+
+
+def test_mode_tables_cache_write_is_atomic_and_skipped_when_read_only(tmp_path, monkeypatch):
+    import os
+    from music_gen.mode_tables import MODES_PATH, load_mode_tables
+    cache = tmp_path / "modes.npz"
+    load_mode_tables.__wrapped__(MODES_PATH, cache)
+    assert [p.name for p in tmp_path.iterdir()] == ["modes.npz"]  # no temporary file left behind
+    read_only = tmp_path / "read_only"
+    read_only.mkdir()
+    monkeypatch.setattr(os, "access", lambda path, mode: False)
+    tables = load_mode_tables.__wrapped__(MODES_PATH, read_only / "modes.npz")
+    assert tables.mode_intervals("ionian").tolist() == [0, 2, 4, 5, 7, 9, 11]
+    assert list(read_only.iterdir()) == []
+
+
+def test_navigate_circle_fourths_goes_backwards(meta_generator):
+    circle = meta_generator.circle
+    assert circle.navigate_circle("C", 1, "fifths") == ("G", 55)
+    assert circle.navigate_circle("C", 1, "fourths") == ("F", 65)
+    assert circle.navigate_circle("F", 2, "fourths") == ("D♯/E♭", 63)
+    with pytest.raises(ValueError):
+        circle.navigate_circle("H", 1)
+
+
+def test_sample_melodies_follow_the_rules(meta_generator):
+    intervals, lengths = meta_generator.sample_melodies("dorian", 2000, k=5, rng=0)
+    assert intervals.shape == (2000, lengths.max())
+    assert np.all((lengths >= 5) & (lengths <= 6))
+    assert np.all(intervals[:, 0] == 0)
+    assert np.all((intervals == -1) == (np.arange(intervals.shape[1]) >= lengths[:, None]))
+    # Same melodies as the one-at-a-time walk
+    random.seed(0)
+    single = {tuple(meta_generator._generate_melody_interv("dorian", k=5).tolist()) for _ in range(2000)}
+    assert {tuple(row[:n]) for row, n in zip(intervals.tolist(), lengths)} == single
+
+    again, _ = meta_generator.sample_melodies("dorian", 2000, k=5, rng=0)
+    assert np.array_equal(intervals, again)
+
+
+def test_sample_progressions_are_reproducible(meta_generator):
+    metrics = [(0.8, 0.9), (0.2, 0.3), (0.5, 0.5)]
+    batch = meta_generator.sample_progressions(metrics, n=64, rng=42)
+    assert batch.roots.shape == batch.velocities.shape == batch.melody_lengths.shape == (64, 3)
+    assert batch.chord_notes.shape == (64, 3, 4)
+    assert np.all((batch.velocities >= 50) & (batch.velocities <= 127))
+    assert np.array_equal(batch.melody_notes, meta_generator.sample_progressions(metrics, n=64, rng=42).melody_notes)
+    assert meta_generator.current_chord == "C"
+
+    chord_event, arp_event = batch.events(0)[1]
+    assert np.array_equal(chord_event.notes - chord_event.root, [0, 3, 7, 10])  # aeolian for valence 0.2
+    assert len(arp_event.notes) == batch.melody_lengths[0, 1] >= int(2 + 4 * 0.3)
+    assert len(chord_event.to_ableton_osc(start_time=0)) == 20
@@ -0,0 +1,34 @@
+import time
+import numpy as np
+from emotion_detection.plotting import LivePlotter, SharedSeries
+
+
+def test_shared_series_ring():
+    series = SharedSeries(2, capacity=4)
+    reader = SharedSeries(2, capacity=4, name=series.name)
+    try:
+        assert reader.snapshot().shape == (0, 2)
+        for i in range(6):
+            series.publish(i, -i)
+        assert reader.count == 6
+        assert reader.snapshot().tolist() == [[2, -2], [3, -3], [4, -4], [5, -5]]
+    finally:
+        reader.close()
+        series.close()
+
+
+def test_live_plotter_renders_in_separate_process():
+    plotter = LivePlotter(points=50, fps=50, backend="Agg").start()
+    try:
+        start = time.perf_counter()
+        for i in range(200):
+            plotter.publish(np.sin(i / 10), np.cos(i / 10), 3 * i, -i)  # raw values force a rescale
+        assert time.perf_counter() - start < 0.1  # publishing never waits for drawing
+        deadline = time.monotonic() + 20
+        while plotter.frames == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert plotter.frames > 0
+        process = plotter.process
+    finally:
+        plotter.stop()
+    assert process.exitcode == 0
@@ -0,0 +1,73 @@
+import threading
+import time
+from emotion_detection.pipeline import NeuroPipeline
+from emotion_detection.runtime import DropOldestQueue, LatestValue, NeuroRuntime
+from emotion_detection.sources import SyntheticInlet
+
+
+class SlowController:
+    """Stands in for AbletonMetaController with a slow OSC link"""
+    def __init__(self, delay):
+        self.delay = delay
+        self.updates = []
+
+    def update_metrics(self, valence, arousal, timestamp=None):
+        time.sleep(self.delay)
+        self.updates.append((valence, arousal))
+
+
+def test_drop_oldest_queue():
+    q = DropOldestQueue(3)
+    for i in range(5):
+        q.put(i)
+    assert q.dropped == 2 and q.qsize() == 3
+    assert [q.get(), q.get(), q.get()] == [(2, True), (3, False), (4, False)]
+
+
+def test_latest_value_wins():
+    slot = LatestValue()
+    assert slot.get(timeout=0.01) is None
+    slot.put(1)
+    slot.put(2)
+    assert slot.dropped == 1 and slot.qsize() == 1
+    assert slot.get() == 2 and slot.qsize() == 0
+    threading.Timer(0.05, slot.put, args=(3,)).start()
+    assert slot.get(timeout=2) == 3
+
+
+def test_slow_output_does_not_block_acquisition():
+    inlet = SyntheticInlet(speed=50, seed=0)
+    pipeline = NeuroPipeline(inlet.fs)
+    pipeline.fill(inlet)
+    controller = SlowController(delay=0.2)
+    runtime = NeuroRuntime(inlet, pipeline, controller, timeout=0.05).start()
+    time.sleep(1.5)
+    runtime.stop(timeout=1)  # lets the output worker finish its slow update
+    stats = runtime.stats()
+    assert stats["errors"] == 0
+    # 50x real time delivers a 12 sample packet about every ms, far more than the controller handles
+    assert stats["acquired"] > 50
+    assert stats["acquired"] == stats["processed"] + stats["chunks_dropped"] + stats["chunk_queue_depth"]
+    assert stats["sent"] == len(controller.updates) <= 8
+    assert stats["scored"] == stats["sent"] + stats["metrics_dropped"] + stats["metrics_pending"]
+    assert stats["metrics_dropped"] > 0
+
+
+def test_dropped_chunks_restart_the_eeg_buffer():
+    inlet = SyntheticInlet(speed=None, seed=1)
+    pipeline = NeuroPipeline(inlet.fs)
+    pipeline.fill(inlet)
+    runtime = NeuroRuntime(inlet, pipeline, SlowController(delay=0), chunk_queue_size=4)
+    chunks = [inlet.pull_chunk(max_samples=pipeline.chunk_size)[0] for _ in range(12)]
+    for i, chunk in enumerate(chunks[:6]):
+        runtime.chunks.put((chunk, float(i)))  # the DSP worker is behind, chunks 0 and 1 are dropped
+    for _ in range(4):
+        runtime._process()
+    assert runtime.counts["gaps"] == 1 and runtime.stats()["chunks_dropped"] == 2
+
+    # Same buffer as a pipeline that only ever saw the chunks after the gap, no step from the old samples
+    fresh = NeuroPipeline(inlet.fs)
+    for chunk in chunks[2:6]:
+        fresh.push(chunk)
+    assert pipeline.eeg_buffer.n_written == fresh.eeg_buffer.n_written
+    assert (pipeline.eeg_buffer.data == fresh.eeg_buffer.data).all()